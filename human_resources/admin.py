@@ -1,27 +1,210 @@
+import json
+import os
 from itertools import chain
 
 from django.contrib import admin
+from django.contrib.admin import helpers
+from django.contrib.admin.options import IncorrectLookupParameters
+from django.contrib.admin.views.main import ChangeList
+from django.core.exceptions import PermissionDenied
+from django.core.paginator import InvalidPage
 from django.db.models import URLField, CharField
-from django.http import HttpResponseRedirect
-from django.core.cache import cache
-
-import twitter
+from django.db.models.query import prefetch_related_objects
+from django.conf.urls.defaults import patterns, url
+from django.http import HttpResponse, HttpResponseBadRequest, HttpResponseRedirect
+from django.shortcuts import render_to_response, get_object_or_404
+from django.template import RequestContext
+from django.utils.html import escape
 
 from human_resources.models import Person, WebLink, JobOpportunity, \
 NiceToHave, Candidacy, Position, Qualification, Responsibility, \
-ContractType, Evaluation, Interview, File, Benefit, PersonNote
-from human_resources.forms import EvaluationAddForm, EvaluationChangeForm
+ContractType, Evaluation, Interview, File, Benefit, PersonNote, CandidacyScore, \
+DuplicateSuggestion
+from human_resources.forms import EvaluationAddForm, EvaluationChangeForm, \
+PeopleImportUploadForm, PipelineStageForm, InterviewInlineFormSet
 from human_resources.widgets import WebLinkWidget, ExtraWideCharFieldWidget
-
-try:
-	import memcache
-	memcache_present = True
-except ImportError:
-	memcache_present = False
+from human_resources.twitter_status import get_refresher
+from human_resources.published_jobs import refresh_published_jobs
+from human_resources.search import search_people, search_evaluations, search_positions
+from human_resources.importer import PeopleImporter, READERS
+from human_resources.storage import serve as serve_person_file
+from human_resources.instrumentation import instrument_list_display, section
+from human_resources.export import export_action, PersonExporter, \
+CandidacyExporter, EvaluationExporter
+from human_resources.pagination import Keyset, EstimatedCountPaginator, \
+estimated_count, AFTER_VAR, BEFORE_VAR, COUNT_THRESHOLD
+from human_resources.filters import LookupListFilter
+from human_resources.column_cache import cached_column, load_columns
+from human_resources.pipeline import change_stage, CANDIDACY_CLOSED
+from human_resources.timeline import Timeline
+from human_resources.dedupe import merge_people
+from human_resources.routers import replica_reads
+
+
+class HRChangeList(ChangeList):
+	"""Gives the model admin one chance to bulk load whatever its
+	list_display columns need for the rows on the current page, and
+	paginates by keyset and/or with estimated counts when the model admin
+	asks for it (see human_resources.pagination)"""
+	
+	def __init__(self, request, *args, **kwargs):
+		self.after = request.GET.get(AFTER_VAR)
+		self.before = request.GET.get(BEFORE_VAR)
+		self.keyset = None
+		super(HRChangeList, self).__init__(request, *args, **kwargs)
+	
+	def get_results(self, request):
+		instrument_list_display(self.model_admin)
+		if self.keyset is not None:
+			self.get_keyset_results(request)
+		elif getattr(self.model_admin, 'count_threshold', None) is not None:
+			self.get_estimated_results(request)
+		else:
+			super(HRChangeList, self).get_results(request)
+		with section('%s.prepare_result_list' %(self.model_admin.__class__.__name__)):
+			to_render = load_columns(self.model_admin, self.result_list)
+			self.model_admin.prepare_result_list(request, self.result_list, to_render)
+	
+	def count(self, queryset):
+		"""Returns (count, exact)"""
+		threshold = getattr(self.model_admin, 'count_threshold', None)
+		if threshold is None:
+			return queryset.count(), True
+		return estimated_count(queryset, threshold)
+	
+	def get_full_result_count(self):
+		if not self.query_set.query.where:
+			return self.result_count
+		return self.count(self.root_query_set)[0]
+	
+	def get_keyset_results(self, request):
+		"""The page after/before the cursor in the query string; the
+		pagination links carry the cursors of the first and last rows"""
+		
+		try:
+			result_list, has_previous, has_next = self.keyset.page(self.list_per_page, self.after, self.before)
+		except ValueError:
+			raise IncorrectLookupParameters
+		
+		self.result_count, self.result_count_exact = self.count(self.query_set)
+		self.full_result_count = self.get_full_result_count()
+		self.result_list = result_list
+		self.can_show_all = False
+		self.multi_page = has_previous or has_next
+		self.paginator = None
+		
+		self.first_page_url = has_previous and self.get_query_string()
+		self.previous_page_url = has_previous and self.get_query_string({BEFORE_VAR: self.keyset.cursor(result_list[0])})
+		self.next_page_url = has_next and self.get_query_string({AFTER_VAR: self.keyset.cursor(result_list[-1])})
+	
+	def get_estimated_results(self, request):
+		"""Page number pagination like the admin's own, but without exact
+		counts of large result sets"""
+		
+		paginator = EstimatedCountPaginator(self.query_set, self.list_per_page, count_threshold=self.model_admin.count_threshold)
+		self.result_count = paginator.count
+		self.result_count_exact = paginator.exact
+		self.full_result_count = self.get_full_result_count()
+		self.can_show_all = self.result_count_exact and self.result_count <= self.list_max_show_all
+		self.multi_page = self.result_count > self.list_per_page
+		
+		if (self.show_all and self.can_show_all) or not self.multi_page:
+			self.result_list = self.query_set._clone()
+		else:
+			try:
+				self.result_list = paginator.page(self.page_num + 1).object_list
+			except InvalidPage:
+				raise IncorrectLookupParameters
+		self.paginator = paginator
+	
+	def get_query_set(self, request):
+		"""Model admins with an indexed_search method answer the search box
+		from the search index instead of icontains over search_fields"""
+		
+		# the keyset cursors aren't field lookups
+		for var in (AFTER_VAR, BEFORE_VAR):
+			self.params.pop(var, None)
+		
+		indexed_search = getattr(self.model_admin, 'indexed_search', None)
+		if indexed_search is None or not self.query:
+			qs = super(HRChangeList, self).get_query_set(request)
+		else:
+			query = self.query
+			self.query = ''
+			try:
+				qs = super(HRChangeList, self).get_query_set(request)
+			finally:
+				self.query = query
+			qs = indexed_search(qs, query)
+		
+		if getattr(self.model_admin, 'keyset_pagination', False) and not self.model_admin.list_editable:
+			self.keyset = Keyset.for_queryset(qs)
+		return qs
 
 
 class HRAdmin(admin.ModelAdmin):
 	readonly_fields = ('date_added', 'date_modified')
+	# paginate with cursors instead of page numbers where the ordering allows
+	keyset_pagination = False
+	# count at most this many rows and estimate beyond; None counts exactly
+	count_threshold = None
+	change_list_template = 'human_resources/admin/hr_change_list.html'
+	
+	def get_changelist(self, request, **kwargs):
+		return HRChangeList
+	
+	def changelist_view(self, request, extra_context=None):
+		view = super(HRAdmin, self).changelist_view
+		if request.method == 'GET':
+			# read-only, unless actions or list_editable post to it
+			view = replica_reads()(view)
+		return view(request, extra_context=extra_context)
+	
+	def prepare_result_list(self, request, result_list, to_render):
+		"""Hook for set-based loading of the current changelist page.
+		Column callables should only read what is attached here.
+		to_render are the rows whose cached_column columns missed the
+		cache (see human_resources.column_cache); only they need loading
+		for those columns."""
+		pass
+	
+	lookup_per_page = 20
+	
+	def lookup_queryset(self, term):
+		"""Options offered by LookupListFilters on this model, matching
+		term through the search index where the admin has one. The ordering
+		must end with the primary key so the lookup can page by keyset."""
+		
+		qs = self.model._default_manager.order_by('-pk')
+		indexed_search = getattr(self, 'indexed_search', None)
+		if term and indexed_search is not None:
+			qs = indexed_search(qs, term)
+		return qs
+	
+	def lookup_label(self, obj):
+		return unicode(obj)
+	
+	def get_urls(self):
+		urls = super(HRAdmin, self).get_urls()
+		opts = self.model._meta
+		return patterns('',
+			url(r'^lookup/$', self.admin_site.admin_view(replica_reads()(self.lookup_view)), name='%s_%s_lookup' %(opts.app_label, opts.module_name)),
+		) + urls
+	
+	def lookup_view(self, request):
+		"""One page of the options matching ?term= as JSON, continued with
+		?after=<next>"""
+		
+		keyset = Keyset.for_queryset(self.lookup_queryset(request.GET.get('term', '').strip()))
+		try:
+			objects, has_previous, has_next = keyset.page(self.lookup_per_page, after=request.GET.get(AFTER_VAR))
+		except ValueError:
+			return HttpResponseBadRequest()
+		
+		return HttpResponse(json.dumps({
+			'results': [{'id': obj.pk, 'label': self.lookup_label(obj)} for obj in objects],
+			'next': keyset.cursor(objects[-1]) if has_next else None,
+		}), content_type='application/json')
 
 
 class HRTabularInline(admin.TabularInline):
@@ -55,50 +238,13 @@ class PersonNoteInline(HRTabularInline):
 
 class PersonAdmin(HRAdmin):
 	
-	TWITTER_CACHE_TIME = 60 * 5 # 5 min
-	twitter_api = twitter.Api()
-	
 	def twitter(self, item):
-		html = ''
-		
-		def construct_html():
-			statuses = self.twitter_api.GetUserTimeline(item.twitter_handle)
-			if statuses:
-				latest_tweet = statuses[0].text
-				latest_tweet_html = '<div style="font-weight:bold; margin-bottom:5px;">Latest Tweet:</div><div>'
-				latest_tweet_html = latest_tweet_html + '<div style="margin-bottom:5px;">"' + latest_tweet + '"</div>'
-				link_html = '<a target="_blank" href="http://twitter.com/#!/' + item.twitter_handle + '">@' + item.twitter_handle + '</a>'
-				html = latest_tweet_html + link_html
-			else:
-				html = '<a target="_blank" href="http://twitter.com/#!/' + item.twitter_handle + '">@' + item.twitter_handle + '</a>'
-			return html
-		
-		if item.twitter_handle:
-			# try to get the latest tweet
-			try:
-				# try to access cached status
-				if memcache_present:
-					cache_key = 'twitter_status_html_for_' + str(item.id)
-					
-					# try to get cached html variable
-					if cache.get(cache_key) is not None:
-						html = cache.get(cache_key)
-						
-					else:
-						html = construct_html()
-						cache.set(cache_key, html, self.TWITTER_CACHE_TIME)
-						
-				else:
-					html = construct_html()
-					
-			except twitter.TwitterError:
-				html = '<span>Twitter user not found</span>'
-		else:
-			html = ''
-		return html
+		# filled in from the cache by prepare_result_list, never fetched here
+		return getattr(item, 'twitter_status_html', '')
 	twitter.allow_tags = True
 	
 	
+	@cached_column
 	def latest_note(self, item):
 		def get_user_representation(user):
 			if user.first_name or user.last_name:
@@ -106,8 +252,8 @@ class PersonAdmin(HRAdmin):
 			else:
 				return user.username
 		
-		if item.notes.all():
-			latest_note = item.notes.all()[0]
+		latest_note = getattr(item, 'latest_note_cache', None)
+		if latest_note is not None:
 			return '<span style="font-weight:bold;">' + get_user_representation(latest_note.author) + ' on ' + latest_note.date_and_time.strftime("%B %d, %Y") + ': </span>' + latest_note.note
 		else:
 			return ''
@@ -117,51 +263,176 @@ class PersonAdmin(HRAdmin):
 		return u'%s, %s' %(item.last_name, item.first_name)
 	name.admin_order_field = 'last_name'
 	
+	@cached_column
 	def person_files(self, item):
-		html = ""
-		if item.files.exists():
-			for f in item.files.all():
-				html = html + '<li><a target="_blank" href="' + f.person_file.url + '">&darr; ' + f.name + '</a></li>'
-			html = "<ul>" + html + "</ul>"
-		return html
+		files = item.files.all()
+		if files:
+			return "<ul>" + "".join(['<li><a target="_blank" href="' + f.person_file.url + '">&darr; ' + f.name + '</a></li>' for f in files]) + "</ul>"
+		return ""
 	person_files.allow_tags = True
 		
 	
+	@cached_column
 	def contact_info(self, item):
-		html = ""
-		if item.email or item.mobile_phone or item.other_phone:
-			if item.email:
-				html = html + '<li><span style="font-weight:bold;">Email: </span><a href="mailto:' + item.email + '">' + item.email + '</a></li>'
-			if item.mobile_phone:
-				html = html + '<li><span style="font-weight:bold;">Mobile Phone: </span>' + item.mobile_phone + '</li>'
-			if item.other_phone:
-				html = html + '<li><span style="font-weight:bold;">Other Phone: </span>' + item.other_phone + '</li>'
-			html = "<ul>" + html + "</ul>"
-		return html
+		html = []
+		if item.email:
+			html.append('<li><span style="font-weight:bold;">Email: </span><a href="mailto:' + item.email + '">' + item.email + '</a></li>')
+		if item.mobile_phone:
+			html.append('<li><span style="font-weight:bold;">Mobile Phone: </span>' + item.mobile_phone + '</li>')
+		if item.other_phone:
+			html.append('<li><span style="font-weight:bold;">Other Phone: </span>' + item.other_phone + '</li>')
+		if html:
+			return "<ul>" + "".join(html) + "</ul>"
+		return ""
 	contact_info.allow_tags = True
 		
+	@cached_column
 	def web_links(self,	item):
-		html = ''
-		
-		for web_link in item.web_links.all():
-			html = html + '<li><a target="_blank" href="' + web_link.url + '">' + web_link.name + '</a></li>'
-		html = '<ul>' + html + '</ul>'
-		return html
+		return '<ul>' + ''.join(['<li><a target="_blank" href="' + web_link.url + '">' + web_link.name + '</a></li>' for web_link in item.web_links.all()]) + '</ul>'
 	web_links.allow_tags = True	
 	
+	@cached_column
 	def candidacies(self, item):
-		html = ''
+		candidacies = item.candidacy_set.all()
+		if candidacies:
+			return '<ul>' + ''.join([
+				'<li style="list-style-type: disc; list-style-position: inside; "><a href="/admin/human_resources/jobopportunity/' + str(candidacy.job_opportunity.id) + '/">' + str(candidacy.job_opportunity) + '</a></li>'
+				for candidacy in candidacies
+			]) + '</ul>'
+		return ''
+	candidacies.allow_tags = True
+	
+	def queryset(self, request):
+		"""Load every list_display column with a fixed number of queries:
+		one for the page (with the id of each person's latest note selected
+		alongside it), and in prepare_result_list one per prefetched relation
+		and one for the notes themselves, for the rows not cached"""
 		
-		if item.candidacy_set.all():
-			for candidacy in item.candidacy_set.all():
-				html = html + '<li style="list-style-type: disc; list-style-position: inside; "><a href="/admin/human_resources/jobopportunity/' + str(candidacy.job_opportunity.id) + '/">' + str(candidacy.job_opportunity) + '</a></li>'
-			html = '<ul>' + html + '</ul>'
+		qs = super(PersonAdmin, self).queryset(request)
 		
-		return html
-	candidacies.allow_tags = True
+		note_table = PersonNote._meta.db_table
+		person_table = Person._meta.db_table
+		latest_note_sql = 'SELECT %s.id FROM %s WHERE %s.person_id = %s.id ORDER BY %s.date_and_time DESC LIMIT 1' %(
+			note_table, note_table, note_table, person_table, note_table
+		)
+		
+		return qs.extra(
+			select={'latest_note_id': latest_note_sql}
+		)
+	
+	def prepare_result_list(self, request, result_list, to_render):
+		prefetch_related_objects(to_render, [
+			'candidacy_set__job_opportunity__position',
+			'web_links',
+			'files',
+		])
+		
+		note_ids = [item.latest_note_id for item in to_render if getattr(item, 'latest_note_id', None)]
+		notes = PersonNote.objects.select_related('author').in_bulk(note_ids) if note_ids else {}
+		for item in to_render:
+			item.latest_note_cache = notes.get(getattr(item, 'latest_note_id', None))
+		
+		statuses = get_refresher().get_cached_statuses([item.twitter_handle for item in result_list])
+		for item in result_list:
+			item.twitter_status_html = statuses.get(item.twitter_handle, '')
+	
+	def indexed_search(self, queryset, query):
+		return search_people(queryset, query)
+	
+	def lookup_queryset(self, term):
+		qs = Person.objects.only('first_name', 'last_name', 'email').order_by('last_name', 'pk')
+		if term:
+			qs = search_people(qs, term)
+		return qs
+	
+	def lookup_label(self, obj):
+		if obj.email:
+			return u'%s, %s <%s>' %(obj.last_name, obj.first_name, obj.email)
+		return u'%s, %s' %(obj.last_name, obj.first_name)
+	
+	MAX_IMPORT_ERRORS_SHOWN = 500
+	
+	def get_urls(self):
+		urls = super(PersonAdmin, self).get_urls()
+		return patterns('',
+			url(r'^import/$', self.admin_site.admin_view(self.import_view), name='human_resources_person_import'),
+			url(r'^files/(?P<name>[0-9a-f/]+(?:\.\w+)?)$', self.admin_site.admin_view(self.file_view), name='human_resources_person_file'),
+			url(r'^(\d+)/timeline/$', self.admin_site.admin_view(replica_reads()(self.timeline_view)), name='human_resources_person_timeline'),
+		) + urls
+	
+	def change_view(self, request, object_id, form_url='', extra_context=None):
+		extra_context = dict(extra_context or {})
+		if object_id.isdigit():
+			# read by the template only, so saving doesn't load it
+			extra_context['timeline'] = Timeline(int(object_id))
+		return super(PersonAdmin, self).change_view(request, object_id, form_url, extra_context)
+	
+	def timeline_view(self, request, object_id):
+		"""The activity timeline of a person, continued with ?after=<next>,
+		see human_resources.timeline"""
+		
+		person = get_object_or_404(Person.objects.only('first_name', 'last_name', 'status'), pk=object_id)
+		if not self.has_change_permission(request, person):
+			raise PermissionDenied
+		
+		try:
+			page = Timeline(person.pk).page(after=request.GET.get(AFTER_VAR))
+		except ValueError:
+			return HttpResponseBadRequest('Invalid cursor')
+		
+		return render_to_response('human_resources/admin/person_timeline.html', {
+			'title': u'Timeline of %s %s' %(person.first_name, person.last_name),
+			'person': person,
+			'page': page,
+			'opts': self.model._meta,
+		}, context_instance=RequestContext(request))
+	
+	def file_view(self, request, name):
+		"""Staff-only download of a stored person file"""
+		
+		f = File.objects.filter(person_file=name).only('name', 'person_file')[:1]
+		if f:
+			download_name = f[0].name + os.path.splitext(name)[1]
+		else:
+			download_name = None
+		return serve_person_file(request, name, download_name)
 	
+	def import_view(self, request):
+		"""Upload form for the streaming people import, see
+		human_resources.importer"""
+		
+		errors = []
+		stats = None
+		
+		if request.method == 'POST':
+			form = PeopleImportUploadForm(request.POST, request.FILES)
+			if form.is_valid():
+				def on_error(row_number, message):
+					if len(errors) < self.MAX_IMPORT_ERRORS_SHOWN:
+						errors.append((row_number, message))
+				
+				importer = PeopleImporter(on_error=on_error)
+				stats = importer.run(READERS[form.cleaned_data['format']](form.cleaned_data['file']))
+		else:
+			form = PeopleImportUploadForm()
+		
+		return render_to_response('human_resources/admin/import_people.html', {
+			'title': 'Import people',
+			'form': form,
+			'errors': errors,
+			'stats': stats,
+			'opts': self.model._meta,
+		}, context_instance=RequestContext(request))
+	
+	actions = [export_action(PersonExporter, 'csv'), export_action(PersonExporter, 'json')]
+	change_list_template = 'human_resources/admin/person_change_list.html'
+	change_form_template = 'human_resources/admin/person_change_form.html'
+	keyset_pagination = True
+	count_threshold = COUNT_THRESHOLD
 	inlines = [WebLinkInline, FileInline, PersonNoteInline]
 	list_filter = ('status', )
+	# indexed, together with the notes; see human_resources.search
+	search_fields = ('first_name', 'middle_name', 'last_name', 'email', 'city')
 	list_display = ('name', 'status', 'contact_info', 'candidacies', 'twitter', 'web_links', 'person_files', 'latest_note')
 	
 	fieldsets = (
@@ -238,19 +509,27 @@ class PositionAdmin(HRAdmin):
 			return ""
 	public_job_description.allow_tags = True
 	
+	@cached_column
 	def position_responsibilities(self, item):
-		html = ''
-		
-		if item.responsibilities.all():
-			for role in item.responsibilities.all():
-				html = html + '<li style="list-style-type: disc; list-style-position: inside; "><a href="/admin/human_resources/role/' + str(role.id) + '/">' + str(role.description) + '</a></li>'
-			html = '<ul>' + html + '</ul>'
-		
-		return html
+		responsibilities = item.responsibilities.all()
+		if responsibilities:
+			return '<ul>' + ''.join([
+				'<li style="list-style-type: disc; list-style-position: inside; "><a href="/admin/human_resources/role/' + str(role.id) + '/">' + str(role.description) + '</a></li>'
+				for role in responsibilities
+			]) + '</ul>'
+		return ''
 	position_responsibilities.allow_tags = True
 	
+	def prepare_result_list(self, request, result_list, to_render):
+		prefetch_related_objects(to_render, ['responsibilities'])
+	
+	def indexed_search(self, queryset, query):
+		return search_positions(queryset, query)
+	
 	inlines = [ResponsibilityInline, QualificationInline, NiceToHaveInline]
 	list_display = ('name', 'importance', 'private_description', 'public_job_description', 'position_responsibilities',)
+	# indexed; see human_resources.search
+	search_fields = ('name', 'private_description', 'public_description')
 	fieldsets = (
 		('General Info', {
 			"fields": ('name', 'importance', 'private_description', 'public_description'),
@@ -264,33 +543,47 @@ class PositionAdmin(HRAdmin):
 
 
 def publish_job_opportunity(modeladmin, request, queryset):
+	job_ids = list(queryset.values_list('pk', flat=True))
 	queryset.update(published_status=JobOpportunity.OPPORTUNITY_STATUS_CHOICES[1][0])
+	refresh_published_jobs(job_ids) # update() sends no post_save
 publish_job_opportunity.short_description = "Publish selected job opportunities"
 
 def unpublish_job_opportunity(modeladmin, request, queryset):
+	job_ids = list(queryset.values_list('pk', flat=True))
 	queryset.update(published_status=JobOpportunity.OPPORTUNITY_STATUS_CHOICES[0][0])
+	refresh_published_jobs(job_ids) # update() sends no post_save
 unpublish_job_opportunity.short_description = "Unpublish selected job opportunities"
 
 class JobOpportunityAdmin(HRAdmin):
 	
+	@cached_column
 	def contract_types_available(self, item):
-		html = ""
-		if item.contract_types.exists():
-			for c in item.contract_types.all():
-				html = html + '<li>' + c.name + '</li>'
-			html = '<ul>' + html + '</ul>'
-		return html
+		contract_types = item.contract_types.all()
+		if contract_types:
+			return '<ul>' + ''.join(['<li>' + c.name + '</li>' for c in contract_types]) + '</ul>'
+		return ""
 	contract_types_available.allow_tags = True
 	
+	@cached_column
 	def benefits_offered(self, item):
-		html = ""
-		if item.benefits.exists():
-			for b in item.benefits.all():
-				html = html + '<li>' + b.name + '</li>'
-			html = '<ul>' + html + '</ul>'
-		return html
+		benefits = item.benefits.all()
+		if benefits:
+			return '<ul>' + ''.join(['<li>' + b.name + '</li>' for b in benefits]) + '</ul>'
+		return ""
 	benefits_offered.allow_tags = True
 	
+	def prepare_result_list(self, request, result_list, to_render):
+		prefetch_related_objects(to_render, ['contract_types', 'benefits'])
+	
+	def lookup_queryset(self, term):
+		qs = JobOpportunity.objects.select_related('position').order_by('-pk')
+		if term:
+			qs = qs.filter(position__in=search_positions(Position.objects.all(), term).values('pk'))
+		return qs
+	
+	def lookup_label(self, obj):
+		return u'%s - %s' %(obj.position.name, obj.location)
+	
 	actions = [publish_job_opportunity, unpublish_job_opportunity]
 	filter_horizontal = ('contract_types','benefits')
 	inlines = [CandidacyInline]
@@ -312,9 +605,55 @@ class JobOpportunityAdmin(HRAdmin):
 		js = ['/dev_media/grappelli/tinymce/jscripts/tiny_mce/tiny_mce.js', '/dev_media/grappelli/tinymce_setup/tinymce_setup.js',]
 	
 
+def _change_stage(modeladmin, queryset, **kwargs):
+	if modeladmin.model is Evaluation:
+		kwargs['evaluations'] = queryset
+	else:
+		kwargs['candidacies'] = queryset
+	return change_stage(sender=modeladmin.model, **kwargs)
+
+def change_pipeline_stage(modeladmin, request, queryset):
+	"""Intermediate form applying one pipeline step to every selected row
+	at once, see human_resources.pipeline.change_stage"""
+	
+	if request.POST.get('apply'):
+		form = PipelineStageForm(request.POST)
+		if form.is_valid():
+			summary = _change_stage(modeladmin, queryset, author=request.user, **form.cleaned_data)
+			modeladmin.message_user(request, summary.summary())
+			return None
+	else:
+		form = PipelineStageForm()
+	
+	select_across = request.POST.get('select_across') == '1'
+	if select_across:
+		# the whole filtered changelist; the admin only needs one pk posted
+		selected = queryset.values_list('pk', flat=True)[:1]
+	else:
+		selected = queryset.values_list('pk', flat=True)
+	
+	return render_to_response('human_resources/admin/change_pipeline_stage.html', {
+		'title': 'Change pipeline stage',
+		'form': form,
+		'count': queryset.count(),
+		'selected': selected,
+		'select_across': select_across,
+		'action_checkbox_name': helpers.ACTION_CHECKBOX_NAME,
+		'opts': modeladmin.model._meta,
+	}, context_instance=RequestContext(request))
+change_pipeline_stage.short_description = "Change pipeline stage of selected %(verbose_name_plural)s"
+
+def close_candidacies(modeladmin, request, queryset):
+	summary = _change_stage(modeladmin, queryset, status=CANDIDACY_CLOSED)
+	modeladmin.message_user(request, summary.summary())
+close_candidacies.short_description = "Close candidacies of selected %(verbose_name_plural)s"
+
+
 class InterviewInline(HRTabularInline):
 	model = Interview
+	formset = InterviewInlineFormSet
 	extra = 0
+	fields = ('interview_type', 'date', 'duration', 'interviewers', 'room', 'notes')
 
 
 class EvaluationAdmin(admin.ModelAdmin):
@@ -327,74 +666,75 @@ class EvaluationAdmin(admin.ModelAdmin):
 				path = request.path
 				return HttpResponseRedirect(request.path + '?status__exact=1')
 		except: pass # no referrer
-		return super(EvaluationAdmin, self).changelist_view(request, extra_context=extra_context)
-	
-	
-	def qualifications(self, item):
-		html = ''		
-		# loop through all qualifications for this evaluation's candidacy's
-		# job opportunity
+		view = super(EvaluationAdmin, self).changelist_view
+		if request.method == 'GET':
+			view = replica_reads()(view)
+		return view(request, extra_context=extra_context)
+	
+	def get_changelist(self, request, **kwargs):
+		return HRChangeList
+	
+	def queryset(self, request):
+		qs = super(EvaluationAdmin, self).queryset(request)
+		return qs.select_related('candidacy__person', 'candidacy__job_opportunity__position')
+	
+	def prepare_result_list(self, request, result_list, to_render):
+		"""Build the satisfied/unsatisfied matrix of every evaluation on the
+		page that isn't cached with one query per requirement table and one
+		per through table"""
 		
-		qualifications = []
+		evaluation_ids = [item.pk for item in to_render]
+		position_ids = set(item.candidacy.job_opportunity.position_id for item in to_render)
 		
-		all_qualifications = item.candidacy.job_opportunity.position.qualifications.all()
+		def requirements_by_position(model):
+			by_position = {}
+			if position_ids:
+				for requirement in model.objects.filter(position__in=position_ids):
+					by_position.setdefault(requirement.position_id, []).append(requirement)
+			return by_position
 		
-		for q in all_qualifications:
-						
-			if q in item.satisfied_qualifications.all():
-				has_q = True
-			else:
-				has_q = False
-				
-			q_dic = {
-				"qualification": q,
-				"has_qualification": has_q
-			}
-			qualifications.append(q_dic)
-		
-		for q_dict in qualifications:
-			if q_dict['has_qualification']:
-				img_src = '/dev_media/grappelli/img/admin/icon-yes.gif'
-			else:
-				img_src = '/dev_media/grappelli/img/admin/icon-no.gif'
-			html = html + '<li style="margin-bottom:10px;"><img style="margin-right: 5px; " src="' + img_src + '" />' + q_dict['qualification'].description + '</li>'
+		def satisfied_pairs(field_name, target_name):
+			through = Evaluation._meta.get_field(field_name).rel.through
+			if not evaluation_ids:
+				return set()
+			return set(through.objects.filter(evaluation__in=evaluation_ids).values_list('evaluation', target_name))
 		
-		if qualifications:
-			html = '<ul>' + html + '</ul>'
-	
-		return html
+		qualifications = requirements_by_position(Qualification)
+		nice_to_haves = requirements_by_position(NiceToHave)
+		satisfied_qualifications = satisfied_pairs('satisfied_qualifications', 'qualification')
+		satisfied_nice_to_haves = satisfied_pairs('satisfied_nice_to_haves', 'nicetohave')
+		
+		for item in to_render:
+			position_id = item.candidacy.job_opportunity.position_id
+			item.qualification_matrix = [
+				(q, (item.pk, q.pk) in satisfied_qualifications) for q in qualifications.get(position_id, [])
+			]
+			item.nice_to_have_matrix = [
+				(n, (item.pk, n.pk) in satisfied_nice_to_haves) for n in nice_to_haves.get(position_id, [])
+			]
+	
+	
+	def requirement_list(self, matrix):
+		"""(requirement, satisfied) pairs as a list with yes/no icons"""
+		if not matrix:
+			return ''
+		return '<ul>' + ''.join([
+			'<li style="margin-bottom:10px;"><img style="margin-right: 5px; " src="' + (
+				'/dev_media/grappelli/img/admin/icon-yes.gif' if satisfied else '/dev_media/grappelli/img/admin/icon-no.gif'
+			) + '" />' + requirement.description + '</li>'
+			for requirement, satisfied in matrix
+		]) + '</ul>'
+	
+	@cached_column
+	def qualifications(self, item):
+		# qualifications of this evaluation's candidacy's job opportunity,
+		# already paired with whether they are satisfied by prepare_result_list
+		return self.requirement_list(item.qualification_matrix)
 	qualifications.allow_tags = True
 	
+	@cached_column
 	def nice_to_haves(self, item):
-		html = ''
-
-		nice_to_haves = []
-		
-		all_nice_to_haves = item.candidacy.job_opportunity.position.nice_to_haves.all()
-		
-		for n in all_nice_to_haves:
-			if n in item.satisfied_nice_to_haves.all():
-				has_n = True
-			else:
-				has_n = False
-			
-			n_dic = {
-				"nice_to_have": n,
-				"has_nice_to_have": has_n
-			}
-			nice_to_haves.append(n_dic)
-		
-		for n_dict in nice_to_haves:
-			if n_dict['has_nice_to_have']:
-				img_src = '/dev_media/grappelli/img/admin/icon-yes.gif'
-			else:
-				img_src = '/dev_media/grappelli/img/admin/icon-no.gif'
-			html = html + '<li style="margin-bottom:10px;"><img style="margin-right: 5px; " src="' + img_src + '" />' + n_dict['nice_to_have'].description + '</li>'
-		
-		if nice_to_haves:
-			html = '<ul>' + html + '</ul>'
-	
-		return html
+		return self.requirement_list(item.nice_to_have_matrix)
 	nice_to_haves.allow_tags = True
 	
 	def person(self, item):
@@ -419,8 +759,23 @@ class EvaluationAdmin(admin.ModelAdmin):
 		'fk': ['candidacy']
 	}
 	
+	def indexed_search(self, queryset, query):
+		return search_evaluations(queryset, query)
+	
+	actions = [change_pipeline_stage, close_candidacies, export_action(EvaluationExporter, 'csv'), export_action(EvaluationExporter, 'json')]
+	change_list_template = 'human_resources/admin/hr_change_list.html'
+	keyset_pagination = True
+	count_threshold = COUNT_THRESHOLD
 	inlines = [InterviewInline]
-	list_filter = ('status', 'candidacy__job_opportunity', 'candidacy__job_opportunity__position', 'candidacy__person', 'candidacy__rank')
+	# indexed, together with the candidate's notes; see human_resources.search
+	search_fields = ('interview__notes', 'candidacy__person__first_name', 'candidacy__person__last_name')
+	list_filter = (
+		'status',
+		('candidacy__job_opportunity', LookupListFilter),
+		'candidacy__job_opportunity__position',
+		('candidacy__person', LookupListFilter),
+		'candidacy__rank',
+	)
 	list_display = ('person', 'rank', 'job_opportunity', 'position', 'qualifications', 'nice_to_haves', 'status')
 	add_form = EvaluationAddForm
 	filter_horizontal = ('satisfied_qualifications', 'satisfied_nice_to_haves')
@@ -454,13 +809,97 @@ class EvaluationAdmin(admin.ModelAdmin):
 
 
 class CandidacyAdmin(HRAdmin):
+	actions = [change_pipeline_stage, close_candidacies, export_action(CandidacyExporter, 'csv'), export_action(CandidacyExporter, 'json')]
+	keyset_pagination = True
+	count_threshold = COUNT_THRESHOLD
 	list_display = ('person', 'job_opportunity', 'rank')
-	list_filter = ('person', 'job_opportunity', 'rank')
+	list_filter = (('person', LookupListFilter), ('job_opportunity', LookupListFilter), 'rank')
+
+
+class CandidacyScoreAdmin(admin.ModelAdmin):
+	"""Read-only leaderboards, computed by human_resources.scoring"""
+	
+	def person(self, item):
+		return item.candidacy.person
+	person.admin_order_field = 'candidacy__person__last_name'
+	
+	def queryset(self, request):
+		qs = super(CandidacyScoreAdmin, self).queryset(request)
+		return qs.select_related('candidacy__person', 'job_opportunity__position')
+	
+	def has_add_permission(self, request):
+		return False
+	
+	list_display = ('place', 'person', 'job_opportunity', 'score', 'qualifications_satisfied', 'nice_to_haves_satisfied', 'date_scored')
+	list_display_links = ('person',)
+	list_filter = ('job_opportunity',)
+	readonly_fields = ('candidacy', 'job_opportunity', 'score', 'place', 'qualifications_satisfied', 'nice_to_haves_satisfied', 'date_scored')
+	actions = None
+
+
+def merge_duplicates(modeladmin, request, queryset):
+	# pairs sharing a person make one group, kept as its oldest person
+	parents = {}
+	def root(pk):
+		while parents.get(pk, pk) != pk:
+			pk = parents[pk]
+		return pk
+	for person_id, duplicate_id in queryset.filter(dismissed=False).values_list('person', 'duplicate'):
+		a, b = root(person_id), root(duplicate_id)
+		if a != b:
+			parents[max(a, b)] = min(a, b)
+	
+	groups = {}
+	for pk in parents:
+		groups.setdefault(root(pk), []).append(pk)
+	
+	merged = 0
+	people = Person.objects.in_bulk(groups.keys())
+	for pk, duplicate_ids in groups.items():
+		if pk in people:
+			merged += merge_people(people[pk], duplicate_ids)
+	modeladmin.message_user(request, "Merged %s duplicate(s) into %s person(s)." %(merged, len(people)))
+merge_duplicates.short_description = "Merge selected duplicates"
+
+def dismiss_duplicates(modeladmin, request, queryset):
+	count = queryset.update(dismissed=True)
+	modeladmin.message_user(request, "Dismissed %s suggestion(s)." %(count))
+dismiss_duplicates.short_description = "Not duplicates: dismiss selected"
+
+
+class DuplicateSuggestionAdmin(admin.ModelAdmin):
+	"""Merge suggestions, found by the find_duplicates command, see
+	human_resources.dedupe"""
+	
+	def person_link(self, item):
+		return '<a href="/admin/human_resources/person/%s/">%s</a>' %(item.person_id, escape(item.person))
+	person_link.allow_tags = True
+	person_link.short_description = 'Person'
+	
+	def duplicate_link(self, item):
+		return '<a href="/admin/human_resources/person/%s/">%s</a>' %(item.duplicate_id, escape(item.duplicate))
+	duplicate_link.allow_tags = True
+	duplicate_link.short_description = 'Duplicate'
+	
+	def queryset(self, request):
+		qs = super(DuplicateSuggestionAdmin, self).queryset(request)
+		return qs.select_related('person', 'duplicate')
+	
+	def has_add_permission(self, request):
+		return False
+	
+	list_display = ('score', 'person_link', 'duplicate_link', 'reasons', 'date_found')
+	list_display_links = ('score',)
+	list_filter = ('dismissed',)
+	readonly_fields = ('person', 'duplicate', 'score', 'reasons', 'date_found')
+	actions = [merge_duplicates, dismiss_duplicates]
 
 admin.site.register(Candidacy, CandidacyAdmin)
+admin.site.register(CandidacyScore, CandidacyScoreAdmin)
 admin.site.register(ContractType)
 admin.site.register(Benefit)
 admin.site.register(JobOpportunity, JobOpportunityAdmin)
 admin.site.register(Position, PositionAdmin)
 admin.site.register(Evaluation, EvaluationAdmin)
-admin.site.register(Person, PersonAdmin)
\ No newline at end of file
+admin.site.register(Person, PersonAdmin)
+admin.site.register(DuplicateSuggestion, DuplicateSuggestionAdmin)
\ No newline at end of file
@@ -0,0 +1,146 @@
+"""
+Timings of the hot HR pages against whatever database is configured.
+
+Each benchmark is run a few times and reported with its wall times and
+query count, as a JSON document that can be compared across versions and
+databases (run it once with SQLite settings and once with PostgreSQL
+ones). Cached pages are measured both cold (cache generation bumped before
+every run) and warm.
+
+"""
+import datetime
+import time
+
+from django.contrib import admin
+from django.contrib.auth.models import User
+from django.db import connection, reset_queries
+from django.template import Context
+from django.template.loader import get_template
+from django.test.client import RequestFactory
+
+import human_resources
+from human_resources.forms import EvaluationChangeForm
+from human_resources.job_cache import bump_generation
+from human_resources.models import Person, Candidacy, Evaluation, PublishedJob
+
+
+def _user():
+	user, created = User.objects.get_or_create(username='hr_benchmark', defaults={
+		'is_staff': True,
+		'is_superuser': True,
+	})
+	return user
+
+
+def _request(path, user=None, **get):
+	request = RequestFactory().get(path, get)
+	request.user = user or _user()
+	return request
+
+
+def _changelist(model, **get):
+	model_admin = admin.site._registry[model]
+	opts = model._meta
+	def run():
+		response = model_admin.changelist_view(_request('/admin/%s/%s/' %(opts.app_label, opts.module_name), **get))
+		response.render()
+	return run
+
+
+def _plugin(cold):
+	from human_resources.plugins.cms_plugins import JobOpportunityPlugin
+	def run():
+		if cold:
+			bump_generation()
+		plugin = JobOpportunityPlugin()
+		context = plugin.render(Context({'request': _request('/')}), None, None)
+		get_template(plugin.render_template).render(context)
+	return run
+
+
+def _job_page(cold):
+	from human_resources.plugins.views import job_opportunity
+	slug = PublishedJob.objects.values_list('slug', flat=True)[:1]
+	if not slug:
+		return None
+	def run():
+		if cold:
+			bump_generation()
+		job_opportunity(_request('/jobs/%s/' %(slug[0])), slug[0])
+	return run
+
+
+def _evaluation_form():
+	evaluation = Evaluation.objects.order_by('-pk')[:1]
+	if not evaluation:
+		return None
+	def run():
+		form = EvaluationChangeForm(instance=Evaluation.objects.get(pk=evaluation[0].pk))
+		unicode(form)
+	return run
+
+
+BENCHMARKS = (
+	('person changelist', lambda: _changelist(Person)),
+	('person changelist, search', lambda: _changelist(Person, q='python')),
+	('evaluation changelist', lambda: _changelist(Evaluation, status__exact=1)),
+	('candidacy changelist', lambda: _changelist(Candidacy)),
+	('published jobs plugin, cold', lambda: _plugin(cold=True)),
+	('published jobs plugin, warm', lambda: _plugin(cold=False)),
+	('job page, cold', lambda: _job_page(cold=True)),
+	('job page, warm', lambda: _job_page(cold=False)),
+	('evaluation change form', _evaluation_form),
+)
+
+
+def _measure(run, runs):
+	times = []
+	queries = []
+	use_debug_cursor = connection.use_debug_cursor
+	connection.use_debug_cursor = True
+	try:
+		for i in range(runs):
+			reset_queries()
+			started = time.time()
+			run()
+			times.append(time.time() - started)
+			queries.append(len(connection.queries))
+	finally:
+		connection.use_debug_cursor = use_debug_cursor
+		reset_queries()
+
+	times.sort()
+	return {
+		'runs': runs,
+		'min_ms': round(times[0] * 1000, 3),
+		'median_ms': round(times[len(times) // 2] * 1000, 3),
+		'mean_ms': round(sum(times) / len(times) * 1000, 3),
+		'max_ms': round(times[-1] * 1000, 3),
+		'queries': max(queries),
+	}
+
+
+def run_benchmarks(runs=5, only=None):
+	results = {}
+	for name, build in BENCHMARKS:
+		if only and not any(o in name for o in only):
+			continue
+		run = build()
+		if run is None:
+			results[name] = {'skipped': 'no data'}
+			continue
+		run() # warm up imports, templates and caches
+		results[name] = _measure(run, runs)
+
+	return {
+		'version': '.'.join(str(part) for part in human_resources.VERSION),
+		'database': connection.vendor,
+		'date': datetime.datetime.now().isoformat(),
+		'counts': {
+			'people': Person.objects.count(),
+			'candidacies': Candidacy.objects.count(),
+			'evaluations': Evaluation.objects.count(),
+			'published_jobs': PublishedJob.objects.count(),
+		},
+		'results': results,
+	}
@@ -0,0 +1,267 @@
+"""
+Cache for the rendered HTML of the admin changelist columns.
+
+Column callables decorated with cached_column are rendered once per
+version of their row. A key holds the model, pk, column, the row's
+date_modified and a version token. The token is a per-object counter
+combined with a per-model one, and the signal handlers below bump them
+when related rows change. Snippets are looked up in a small in-process
+LRU first, then in the shared Django cache. Changed rows are re-rendered
+on their next page view; the rest are not touched.
+
+load_columns fetches a whole changelist page with one get_many and
+reports which rows still have columns to render, so the model admins'
+prepare_result_list can bulk load for those rows only.
+
+Rows read from a read replica (see human_resources.routers) may lag
+behind the version token. Snippets rendered from them are kept apart,
+in the shared cache only, for HR_REPLICA_COLUMN_CACHE_TIME. Pages read
+from a replica use the snippets rendered from the primary first.
+
+"""
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models.signals import post_save, post_delete, m2m_changed
+
+from human_resources.models import Person, WebLink, File, PersonNote, \
+Candidacy, JobOpportunity, Position, Responsibility, ContractType, Benefit, \
+Qualification, NiceToHave, Evaluation
+from human_resources.routers import REPLICA_DATABASES
+
+COLUMN_CACHE_TIME = getattr(settings, 'HR_COLUMN_CACHE_TIME', 60 * 60 * 24) # 1 day
+COLUMN_CACHE_LRU_SIZE = getattr(settings, 'HR_COLUMN_CACHE_LRU_SIZE', 10000)
+REPLICA_COLUMN_CACHE_TIME = getattr(settings, 'HR_REPLICA_COLUMN_CACHE_TIME', 60)
+
+
+class LRUCache(object):
+	"""A size bounded, thread safe dict dropping the least recently used
+	entries first"""
+
+	def __init__(self, size):
+		self.size = size
+		self.lock = threading.Lock()
+		self.data = OrderedDict()
+
+	def get_many(self, keys):
+		found = {}
+		with self.lock:
+			for key in keys:
+				if key in self.data:
+					found[key] = self.data[key] = self.data.pop(key)
+		return found
+
+	def set_many(self, values):
+		with self.lock:
+			for key, value in values.items():
+				self.data.pop(key, None)
+				self.data[key] = value
+			while len(self.data) > self.size:
+				self.data.popitem(last=False)
+
+	def clear(self):
+		with self.lock:
+			self.data.clear()
+
+lru = LRUCache(COLUMN_CACHE_LRU_SIZE)
+
+
+def _version_key(model, pk=None):
+	key = 'hr_columns_%s_%s' %(model._meta.app_label, model._meta.module_name)
+	if pk is not None:
+		key = '%s_%s' %(key, pk)
+	return key
+
+
+def _versions(model, pks):
+	"""The version token of every object, as {pk: token}"""
+	keys = [_version_key(model)] + [_version_key(model, pk) for pk in pks]
+	versions = cache.get_many(keys)
+
+	missing = [key for key in keys if key not in versions]
+	if missing:
+		# seeded from the clock so a counter that was evicted never restarts
+		# at a number whose snippets might still be cached
+		now = int(time.time())
+		for key in missing:
+			cache.add(key, now, COLUMN_CACHE_TIME)
+		versions.update(cache.get_many(missing))
+
+	model_version = versions.get(keys[0], 0)
+	return dict((pk, '%s.%s' %(model_version, versions.get(key, 0))) for pk, key in zip(pks, keys[1:]))
+
+
+def bump(model, pks=None):
+	"""Invalidate the cached columns of the given objects of model, or of
+	all of them"""
+	if pks is None:
+		keys = [_version_key(model)]
+	else:
+		keys = [_version_key(model, pk) for pk in set(pks) if pk is not None]
+	for key in keys:
+		try:
+			cache.incr(key)
+		except ValueError: # key expired or was never set
+			cache.add(key, int(time.time()), COLUMN_CACHE_TIME)
+
+
+def _key(model, item, column, replica=False):
+	return 'hr_column:%s.%s:%s:%s:%s:%s%s' %(
+		model._meta.app_label, model._meta.module_name, item.pk, column,
+		item.date_modified.strftime('%Y%m%d%H%M%S%f'), item.column_version,
+		':replica' if replica else '',
+	)
+
+
+def _from_replica(item):
+	return item._state.db in REPLICA_DATABASES
+
+
+def cached_column(func):
+	"""Decorator for model admin column callables whose output depends only
+	on the row and the related rows invalidated below"""
+
+	column = func.__name__
+
+	@wraps(func)
+	def wrapper(model_admin, item):
+		columns = getattr(item, 'cached_columns', None)
+		if columns is None: # not loaded by load_columns
+			return func(model_admin, item)
+		if column not in columns:
+			columns[column] = func(model_admin, item)
+			if _from_replica(item):
+				cache.set(_key(model_admin.model, item, column, replica=True), columns[column], REPLICA_COLUMN_CACHE_TIME)
+			else:
+				key = _key(model_admin.model, item, column)
+				lru.set_many({key: columns[column]})
+				cache.set(key, columns[column], COLUMN_CACHE_TIME)
+		return columns[column]
+	wrapper.cached_column = True
+	return wrapper
+
+
+def cached_column_names(model_admin):
+	return [
+		name for name in model_admin.list_display
+		if isinstance(name, basestring) and getattr(getattr(model_admin, name, None), 'cached_column', False)
+	]
+
+
+def load_columns(model_admin, result_list):
+	"""Attach the cached columns of every row of a changelist page as
+	item.cached_columns. Returns the rows that have columns to render."""
+
+	names = cached_column_names(model_admin)
+	result_list = list(result_list)
+	if not names or not result_list:
+		return result_list
+
+	model = model_admin.model
+	versions = _versions(model, [item.pk for item in result_list])
+
+	keys = {}
+	for item in result_list:
+		item.cached_columns = {}
+		item.column_version = versions[item.pk]
+		for name in names:
+			keys[_key(model, item, name)] = (item, name)
+
+	found = lru.get_many(keys)
+	if len(found) < len(keys):
+		shared = cache.get_many([key for key in keys if key not in found])
+		lru.set_many(shared)
+		found.update(shared)
+
+	if len(found) < len(keys) and _from_replica(result_list[0]):
+		replica_keys = dict(
+			(_key(model, item, name, replica=True), key)
+			for key, (item, name) in keys.items() if key not in found
+		)
+		for replica_key, html in cache.get_many(replica_keys.keys()).items():
+			found[replica_keys[replica_key]] = html
+
+	for key, html in found.items():
+		item, name = keys[key]
+		item.cached_columns[name] = html
+
+	return [item for item in result_list if len(item.cached_columns) < len(names)]
+
+
+# invalidation
+
+def person_related_changed(sender, instance, **kwargs):
+	bump(Person, [instance.person_id])
+
+def candidacy_changed(sender, instance, **kwargs):
+	bump(Person, [instance.person_id])
+	bump(Evaluation, Evaluation.objects.filter(candidacy=instance.pk).values_list('pk', flat=True))
+
+def job_opportunity_changed(sender, instance, **kwargs):
+	# shown by name in the candidacies of people and on every evaluation
+	bump(JobOpportunity, [instance.pk])
+	bump(Person)
+	bump(Evaluation)
+
+def position_changed(sender, instance, **kwargs):
+	bump(Position, [instance.pk])
+	bump(Person)
+	bump(Evaluation)
+
+def responsibility_changed(sender, instance, **kwargs):
+	bump(Position, [instance.position_id])
+
+def requirement_changed(sender, instance, **kwargs):
+	bump(Evaluation)
+
+def job_choice_changed(sender, instance, **kwargs):
+	bump(JobOpportunity)
+
+def job_m2m_changed(sender, instance, action, reverse, pk_set, **kwargs):
+	if not action.startswith('post_'):
+		return
+	if not reverse:
+		bump(JobOpportunity, [instance.pk])
+	else:
+		bump(JobOpportunity)
+
+def satisfied_changed(sender, instance, action, reverse, pk_set, **kwargs):
+	if not action.startswith('post_'):
+		return
+	if not reverse:
+		bump(Evaluation, [instance.pk])
+	elif pk_set:
+		bump(Evaluation, pk_set)
+	else:
+		bump(Evaluation)
+
+
+HANDLERS = (
+	(WebLink, person_related_changed),
+	(File, person_related_changed),
+	(PersonNote, person_related_changed),
+	(Candidacy, candidacy_changed),
+	(JobOpportunity, job_opportunity_changed),
+	(Position, position_changed),
+	(Responsibility, responsibility_changed),
+	(Qualification, requirement_changed),
+	(NiceToHave, requirement_changed),
+	(ContractType, job_choice_changed),
+	(Benefit, job_choice_changed),
+)
+
+for model, handler in HANDLERS:
+	post_save.connect(handler, sender=model, dispatch_uid='hr_column_cache_save_%s' % model.__name__)
+	post_delete.connect(handler, sender=model, dispatch_uid='hr_column_cache_delete_%s' % model.__name__)
+
+for field_name in ('benefits', 'contract_types'):
+	through = JobOpportunity._meta.get_field(field_name).rel.through
+	m2m_changed.connect(job_m2m_changed, sender=through, dispatch_uid='hr_column_cache_m2m_%s' % field_name)
+
+for field_name in ('satisfied_qualifications', 'satisfied_nice_to_haves'):
+	through = Evaluation._meta.get_field(field_name).rel.through
+	m2m_changed.connect(satisfied_changed, sender=through, dispatch_uid='hr_column_cache_m2m_%s' % field_name)
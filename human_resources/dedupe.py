@@ -0,0 +1,315 @@
+"""
+Duplicate people: detection and merging.
+
+find_duplicates reads every person once, and only the fields it
+compares. It normalizes names, emails and phone numbers and puts each
+person into a few blocks: one per normalized email, one per phone number,
+and a phonetic key of the name, in both name orders. Only people sharing
+a block are compared. In a block larger than BLOCK_WINDOW, each person is
+compared with their BLOCK_WINDOW neighbours by name only, the sorted
+neighbourhood method. A pass therefore grows with the number of people
+rather than its square. Pairs scoring at least HR_DEDUPE_THRESHOLD are
+stored as DuplicateSuggestions.
+
+merge_people folds duplicates into one person with a few bulk UPDATEs.
+
+"""
+import difflib
+import re
+import unicodedata
+from collections import defaultdict
+
+from django.conf import settings
+
+from human_resources.models import Person, PersonNote, WebLink, File, \
+Candidacy, Evaluation, SearchIndexEntry, DuplicateSuggestion
+from human_resources.column_cache import bump
+from human_resources.scoring import schedule_rescore
+from human_resources.transactions import commit_on_success
+
+DEDUPE_THRESHOLD = getattr(settings, 'HR_DEDUPE_THRESHOLD', 0.7)
+BLOCK_WINDOW = getattr(settings, 'HR_DEDUPE_BLOCK_WINDOW', 20)
+INSERT_BATCH_SIZE = 1000
+
+# names at least this similar count as the same name
+NAME_MATCH = 0.85
+
+NICKNAMES = {
+	'al': 'albert', 'alex': 'alexander', 'andy': 'andrew', 'ben': 'benjamin',
+	'beth': 'elizabeth', 'bill': 'william', 'bob': 'robert', 'chris': 'christopher',
+	'dan': 'daniel', 'dave': 'david', 'ed': 'edward', 'jen': 'jennifer',
+	'jenny': 'jennifer', 'jim': 'james', 'jimmy': 'james', 'joe': 'joseph',
+	'kate': 'katherine', 'kathy': 'katherine', 'katie': 'katherine', 'liz': 'elizabeth',
+	'matt': 'matthew', 'meg': 'margaret', 'mike': 'michael', 'nick': 'nicholas',
+	'pat': 'patricia', 'peggy': 'margaret', 'rick': 'richard', 'rob': 'robert',
+	'sam': 'samuel', 'steve': 'steven', 'sue': 'susan', 'tom': 'thomas',
+	'tony': 'anthony', 'will': 'william',
+}
+
+# fields a merge copies from a duplicate when the kept person leaves them blank
+MERGED_FIELDS = ('middle_name', 'email', 'mobile_phone', 'other_phone', 'address',
+	'address_two', 'city', 'state', 'zip_code', 'twitter_handle', 'google_plus_url',
+	'facebook_url', 'linked_in_url')
+
+
+def normalize_name(name):
+	"""Lowercase ASCII letters only"""
+	name = unicodedata.normalize('NFKD', unicode(name or '')).encode('ascii', 'ignore').lower()
+	return re.sub(r'[^a-z]', '', name)
+
+
+def normalize_first_name(name):
+	name = normalize_name(name)
+	return NICKNAMES.get(name, name)
+
+
+def normalize_email(email):
+	"""Lowercased, without a +tag, and without the dots gmail ignores"""
+	email = (email or '').strip().lower()
+	if '@' not in email:
+		return ''
+	local, domain = email.rsplit('@', 1)
+	local = local.split('+', 1)[0]
+	if domain in ('gmail.com', 'googlemail.com'):
+		local, domain = local.replace('.', ''), 'gmail.com'
+	return '%s@%s' %(local, domain)
+
+
+def normalize_phone(phone):
+	"""The digits, without a US country code"""
+	digits = re.sub(r'\D', '', phone or '')
+	if len(digits) == 11 and digits.startswith('1'):
+		digits = digits[1:]
+	return digits if len(digits) >= 7 else ''
+
+
+_SOUNDEX = dict(
+	(letter, str(code))
+	for code, letters in enumerate(('aeiouyhw', 'bfpv', 'cgjkqsxz', 'dt', 'l', 'mn', 'r'))
+	for letter in letters
+)
+
+def soundex(name):
+	"""American Soundex of a normalized name"""
+	if not name:
+		return ''
+	key = name[0]
+	last = _SOUNDEX[name[0]]
+	for letter in name[1:]:
+		code = _SOUNDEX[letter]
+		if code != '0' and code != last:
+			key += code
+		if letter not in 'hw':
+			last = code
+	return (key + '000')[:4]
+
+
+class Record(object):
+	"""The normalized fields of one person"""
+
+	__slots__ = ('pk', 'first', 'last', 'email', 'phones', 'zip_code', 'city')
+
+	FIELDS = ('pk', 'first_name', 'last_name', 'email', 'mobile_phone', 'other_phone', 'zip_code', 'city', 'state')
+
+	def __init__(self, pk, first_name, last_name, email, mobile_phone, other_phone, zip_code, city, state):
+		self.pk = pk
+		self.first = normalize_first_name(first_name)
+		self.last = normalize_name(last_name)
+		self.email = normalize_email(email)
+		self.phones = frozenset(phone for phone in (normalize_phone(mobile_phone), normalize_phone(other_phone)) if phone)
+		self.zip_code = zip_code
+		self.city = normalize_name(city) and '%s,%s' %(normalize_name(city), state)
+
+	def blocking_keys(self):
+		keys = []
+		if self.email:
+			keys.append('e:' + self.email)
+		keys.extend('p:' + phone for phone in self.phones)
+		# in both orders, so swapped first and last names meet
+		if self.last:
+			keys.append('n:%s:%s' %(soundex(self.last), self.first[:1]))
+		if self.first:
+			keys.append('n:%s:%s' %(soundex(self.first), self.last[:1]))
+		return keys
+
+	def sort_key(self):
+		return (self.last, self.first, self.pk)
+
+
+def name_similarity(a, b):
+	"""0 - 1, the better of the two name orders"""
+	name = a.first + ' ' + a.last
+	return max(
+		difflib.SequenceMatcher(None, name, b.first + ' ' + b.last).ratio(),
+		difflib.SequenceMatcher(None, name, b.last + ' ' + b.first).ratio(),
+	)
+
+
+def score(a, b):
+	"""(score between 0 and 1, reasons) of two Records. A shared email or
+	phone with a similar name clears the default threshold, and so does
+	(nearly) the same name in the same zip code or city, but not the same
+	name alone."""
+	total = 0.0
+	reasons = []
+	if a.email and a.email == b.email:
+		total += 0.6
+		reasons.append('email')
+	if a.phones & b.phones:
+		total += 0.4
+		reasons.append('phone')
+
+	names = name_similarity(a, b)
+	if names >= NAME_MATCH:
+		total += 0.55 * names
+		reasons.append('name (%d%%)' %(names * 100))
+	elif names < 0.5:
+		# shared contact details under another name: a family email or an
+		# office phone rather than the same person
+		total -= 0.3
+
+	if a.zip_code and a.zip_code == b.zip_code:
+		total += 0.2
+		reasons.append('zip code')
+	elif a.city and a.city == b.city:
+		total += 0.2
+		reasons.append('city')
+	return min(total, 1.0), reasons
+
+
+def candidate_pairs(records):
+	"""Every pair of records sharing a block, once, as (a, b) with a.pk <
+	b.pk"""
+	blocks = defaultdict(list)
+	for record in records:
+		for key in record.blocking_keys():
+			blocks[key].append(record)
+
+	seen = set()
+	for block in blocks.itervalues():
+		if len(block) < 2:
+			continue
+		window = len(block)
+		if window > BLOCK_WINDOW:
+			block.sort(key=Record.sort_key)
+			window = BLOCK_WINDOW
+		for i, a in enumerate(block):
+			for b in block[i + 1:i + 1 + window]:
+				pair = (a.pk, b.pk) if a.pk < b.pk else (b.pk, a.pk)
+				if pair not in seen:
+					seen.add(pair)
+					yield (a, b) if a.pk < b.pk else (b, a)
+
+
+def find_duplicates(threshold=DEDUPE_THRESHOLD):
+	"""Replace the open DuplicateSuggestions with a fresh pass over every
+	person. Returns the number of suggestions."""
+
+	records = [Record(*row) for row in Person.objects.order_by().values_list(*Record.FIELDS).iterator()]
+
+	found = []
+	for a, b in candidate_pairs(records):
+		pair_score, reasons = score(a, b)
+		if pair_score >= threshold:
+			found.append((a.pk, b.pk, pair_score, ', '.join(reasons)))
+
+	_store(found)
+	return len(found)
+
+
+@commit_on_success
+def _store(found):
+	dismissed = set(DuplicateSuggestion.objects.filter(dismissed=True).values_list('person', 'duplicate'))
+	DuplicateSuggestion.objects.filter(dismissed=False).delete()
+
+	suggestions = [
+		DuplicateSuggestion(person_id=person_id, duplicate_id=duplicate_id, score=pair_score, reasons=reasons)
+		for person_id, duplicate_id, pair_score, reasons in found
+		if (person_id, duplicate_id) not in dismissed
+	]
+	for i in range(0, len(suggestions), INSERT_BATCH_SIZE):
+		DuplicateSuggestion.objects.bulk_create(suggestions[i:i + INSERT_BATCH_SIZE])
+
+
+def _numbered(name, number, max_length):
+	suffix = ' (%s)' %(number)
+	return name[:max_length - len(suffix)] + suffix
+
+
+@commit_on_success
+def merge_people(person, duplicates):
+	"""
+	Fold the duplicates (people or pks) into person and delete them:
+	their notes, web links, files and candidacies move over, candidacies
+	for a job person already applied to have their evaluations moved to
+	person's candidacy, and blank fields of person are filled in from
+	them. Returns the number of people merged.
+
+	"""
+	duplicate_ids = sorted(set(getattr(d, 'pk', d) for d in duplicates) - set([person.pk]))
+	if not duplicate_ids:
+		return 0
+
+	for duplicate in Person.objects.filter(pk__in=duplicate_ids).order_by('pk'):
+		for name in MERGED_FIELDS:
+			if not getattr(person, name) and getattr(duplicate, name):
+				setattr(person, name, getattr(duplicate, name))
+
+	PersonNote.objects.filter(person__in=duplicate_ids).update(person=person.pk)
+	# the notes' search entries find the person they now belong to
+	SearchIndexEntry.objects.filter(person__in=duplicate_ids).exclude(source='person').update(person=person.pk)
+
+	# web links are unique per person, name and url: drop the repeats
+	links = set(WebLink.objects.filter(person=person.pk).values_list('name', 'url'))
+	repeated = []
+	for pk, name, url in WebLink.objects.filter(person__in=duplicate_ids).order_by('pk').values_list('pk', 'name', 'url'):
+		if (name, url) in links:
+			repeated.append(pk)
+		links.add((name, url))
+	WebLink.objects.filter(pk__in=repeated).delete()
+	WebLink.objects.filter(person__in=duplicate_ids).update(person=person.pk)
+
+	# files are unique per person and name: drop identical files (they are
+	# stored by content) and number the names of the others
+	files = dict(File.objects.filter(person=person.pk).values_list('name', 'person_file'))
+	max_length = File._meta.get_field('name').max_length
+	repeated = []
+	for pk, name, person_file in File.objects.filter(person__in=duplicate_ids).order_by('pk').values_list('pk', 'name', 'person_file'):
+		if files.get(name) == person_file:
+			repeated.append(pk)
+			continue
+		if name in files:
+			number = 2
+			while _numbered(name, number, max_length) in files:
+				number += 1
+			name = _numbered(name, number, max_length)
+			File.objects.filter(pk=pk).update(name=name)
+		files[name] = person_file
+	File.objects.filter(pk__in=repeated).delete()
+	File.objects.filter(person__in=duplicate_ids).update(person=person.pk)
+
+	# one candidacy per person and job
+	candidacies = dict(Candidacy.objects.filter(person=person.pk).values_list('job_opportunity', 'pk'))
+	folded = []
+	for pk, job_id, rank in Candidacy.objects.filter(person__in=duplicate_ids).order_by('pk').values_list('pk', 'job_opportunity', 'rank'):
+		if job_id in candidacies:
+			Evaluation.objects.filter(candidacy=pk).update(candidacy=candidacies[job_id])
+			if rank is not None:
+				Candidacy.objects.filter(pk=candidacies[job_id]).exclude(rank__gte=rank).update(rank=rank)
+			folded.append(pk)
+		else:
+			Candidacy.objects.filter(pk=pk).update(person=person.pk)
+			candidacies[job_id] = pk
+	for candidacy in Candidacy.objects.filter(pk__in=folded):
+		candidacy.delete()
+	# the candidacies that took over evaluations score anew
+	schedule_rescore(candidacy_ids=candidacies.values())
+
+	for duplicate in Person.objects.filter(pk__in=duplicate_ids):
+		duplicate.delete()
+	person.save()
+
+	# update() sends no signals
+	bump(Person, [person.pk])
+	bump(Evaluation, Evaluation.objects.filter(candidacy__person=person.pk).values_list('pk', flat=True))
+	return len(duplicate_ids)
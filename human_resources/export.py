@@ -0,0 +1,167 @@
+"""
+Streaming CSV and JSON exports for the admin.
+
+The selected rows are walked in primary key order a chunk at a time, each
+chunk read with one query plus the select_related/prefetch_related
+lookups its columns need, and written to the response as soon as it has
+been formatted. Memory use stays the same however many rows are exported.
+
+"""
+import csv
+import json
+from cStringIO import StringIO
+
+from django.http import HttpResponse
+
+try:
+	from django.http import StreamingHttpResponse
+except ImportError: # Django < 1.5 streams a plain HttpResponse given an iterator
+	StreamingHttpResponse = HttpResponse
+
+from human_resources.routers import reporting_database
+
+CHUNK_SIZE = 1000
+
+
+def chunked_queryset(queryset, chunk_size=CHUNK_SIZE):
+	"""Yield lists of the queryset's objects in pk order, seeking past the
+	last pk of the previous chunk instead of using OFFSET"""
+	queryset = queryset.order_by('pk')
+	last_pk = None
+	while True:
+		chunk_queryset = queryset if last_pk is None else queryset.filter(pk__gt=last_pk)
+		chunk = list(chunk_queryset[:chunk_size])
+		if not chunk:
+			break
+		yield chunk
+		last_pk = chunk[-1].pk
+
+
+def _names(objects):
+	return '; '.join(unicode(o) for o in objects)
+
+def _person_name(person):
+	return u'%s, %s' %(person.last_name, person.first_name)
+
+
+class Exporter(object):
+	"""Columns are (header, callable taking an object) pairs"""
+	name = None
+	columns = ()
+	select_related = ()
+	prefetch_related = ()
+
+	def prepare(self, queryset):
+		if self.select_related:
+			queryset = queryset.select_related(*self.select_related)
+		if self.prefetch_related:
+			queryset = queryset.prefetch_related(*self.prefetch_related)
+		return queryset
+
+	def headers(self):
+		return [header for header, value in self.columns]
+
+	def rows(self, queryset):
+		for chunk in chunked_queryset(self.prepare(queryset)):
+			yield [[value(obj) for header, value in self.columns] for obj in chunk]
+
+
+class PersonExporter(Exporter):
+	name = 'people'
+	prefetch_related = ('candidacy_set__job_opportunity__position',)
+	columns = (
+		('id', lambda p: p.pk),
+		('status', lambda p: p.get_status_display()),
+		('first_name', lambda p: p.first_name),
+		('middle_name', lambda p: p.middle_name),
+		('last_name', lambda p: p.last_name),
+		('email', lambda p: p.email),
+		('mobile_phone', lambda p: p.mobile_phone),
+		('other_phone', lambda p: p.other_phone),
+		('city', lambda p: p.city),
+		('state', lambda p: p.state),
+		('twitter_handle', lambda p: p.twitter_handle),
+		('candidacies', lambda p: _names(c.job_opportunity for c in p.candidacy_set.all())),
+		('date_added', lambda p: p.date_added.isoformat()),
+	)
+
+
+class CandidacyExporter(Exporter):
+	name = 'candidacies'
+	select_related = ('person', 'job_opportunity__position')
+	columns = (
+		('id', lambda c: c.pk),
+		('person_id', lambda c: c.person_id),
+		('person', lambda c: _person_name(c.person)),
+		('email', lambda c: c.person.email),
+		('job_opportunity', lambda c: unicode(c.job_opportunity)),
+		('position', lambda c: c.job_opportunity.position.name),
+		('rank', lambda c: c.rank),
+		('date_added', lambda c: c.date_added.isoformat()),
+	)
+
+
+class EvaluationExporter(Exporter):
+	name = 'evaluations'
+	select_related = ('candidacy__person', 'candidacy__job_opportunity__position')
+	prefetch_related = ('satisfied_qualifications', 'satisfied_nice_to_haves')
+	columns = (
+		('id', lambda e: e.pk),
+		('status', lambda e: e.get_status_display()),
+		('person_id', lambda e: e.candidacy.person_id),
+		('person', lambda e: _person_name(e.candidacy.person)),
+		('email', lambda e: e.candidacy.person.email),
+		('job_opportunity', lambda e: unicode(e.candidacy.job_opportunity)),
+		('position', lambda e: e.candidacy.job_opportunity.position.name),
+		('rank', lambda e: e.candidacy.rank),
+		('satisfied_qualifications', lambda e: '; '.join(q.description for q in e.satisfied_qualifications.all())),
+		('satisfied_nice_to_haves', lambda e: '; '.join(n.description for n in e.satisfied_nice_to_haves.all())),
+		('date_modified', lambda e: e.date_modified.isoformat()),
+	)
+
+
+def _encode(value):
+	if value is None:
+		return ''
+	return unicode(value).encode('utf-8')
+
+def stream_csv(exporter, queryset):
+	buf = StringIO()
+	writer = csv.writer(buf)
+	writer.writerow(exporter.headers())
+	for rows in exporter.rows(queryset):
+		writer.writerows([[_encode(v) for v in row] for row in rows])
+		yield buf.getvalue()
+		buf.seek(0)
+		buf.truncate()
+	yield buf.getvalue()
+
+def stream_json(exporter, queryset):
+	headers = exporter.headers()
+	separator = '[\n'
+	for rows in exporter.rows(queryset):
+		yield separator + ',\n'.join(json.dumps(dict(zip(headers, row))) for row in rows)
+		separator = ',\n'
+	yield '\n]\n' if separator != '[\n' else '[]\n'
+
+FORMATS = {
+	'csv': (stream_csv, 'text/csv'),
+	'json': (stream_json, 'application/json'),
+}
+
+
+def export_response(exporter, queryset, format):
+	stream, content_type = FORMATS[format]
+	response = StreamingHttpResponse(stream(exporter, queryset), content_type=content_type)
+	response['Content-Disposition'] = 'attachment; filename=%s.%s' %(exporter.name, format)
+	return response
+
+
+def export_action(exporter_class, format):
+	"""Build an admin action exporting the selected rows"""
+	def action(modeladmin, request, queryset):
+		# the rows are read while the response streams, after the view
+		return export_response(exporter_class(), queryset.using(reporting_database()), format)
+	action.__name__ = 'export_%s_%s' %(exporter_class.name, format)
+	action.short_description = "Export selected %s as %s" %(exporter_class.name, format.upper())
+	return action
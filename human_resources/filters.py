@@ -0,0 +1,66 @@
+from django.contrib.admin import FieldListFilter
+from django.core.exceptions import ValidationError
+from django.core.urlresolvers import reverse
+from django.utils.translation import ugettext as _
+
+VALUE_PLACEHOLDER = '__value__'
+
+
+class LookupListFilter(FieldListFilter):
+	"""
+	Changelist filter on a foreign key that renders no choices up front,
+	only "All" and the current selection. Matching options are fetched as
+	the user types from the lookup view of the related model's admin (see
+	HRAdmin.lookup_view), a page at a time, so the sidebar costs the same
+	however large the related table is.
+
+	Uses the same query string parameter as the admin's own related
+	filter, so existing links keep working.
+
+	"""
+	template = 'human_resources/admin/lookup_filter.html'
+
+	def __init__(self, field, request, params, model, model_admin, field_path):
+		self.related_field_name = field.rel.get_related_field().name
+		self.lookup_kwarg = '%s__%s__exact' %(field_path, self.related_field_name)
+		self.lookup_val = request.GET.get(self.lookup_kwarg, None)
+
+		related_model = field.rel.to
+		self.related_admin = model_admin.admin_site._registry[related_model]
+		self.lookup_url = reverse('%s:%s_%s_lookup' %(
+			model_admin.admin_site.name, related_model._meta.app_label, related_model._meta.module_name
+		))
+		super(LookupListFilter, self).__init__(field, request, params, model, model_admin, field_path)
+
+	def expected_parameters(self):
+		return [self.lookup_kwarg]
+
+	def has_output(self):
+		return True
+
+	def selected_label(self):
+		if self.lookup_val is None:
+			return None
+		try:
+			selected = self.related_admin.lookup_queryset('').filter(**{self.related_field_name: self.lookup_val})[:1]
+		except (ValueError, ValidationError):
+			return None
+		return self.related_admin.lookup_label(selected[0]) if selected else None
+
+	def choices(self, cl):
+		# the template swaps the placeholder for each fetched option's id
+		self.choice_query_string = cl.get_query_string({self.lookup_kwarg: VALUE_PLACEHOLDER})
+		self.value_placeholder = VALUE_PLACEHOLDER
+
+		yield {
+			'selected': self.lookup_val is None,
+			'query_string': cl.get_query_string({}, [self.lookup_kwarg]),
+			'display': _('All'),
+		}
+		label = self.selected_label()
+		if label is not None:
+			yield {
+				'selected': True,
+				'query_string': cl.get_query_string({self.lookup_kwarg: self.lookup_val}),
+				'display': label,
+			}
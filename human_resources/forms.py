@@ -1,6 +1,9 @@
 from django import forms
+from django.forms.models import BaseInlineFormSet
 
-from human_resources.models import Evaluation, Qualification, NiceToHave
+from human_resources.models import Evaluation, Qualification, NiceToHave, Person, \
+Interview, Candidacy, IMPORTANCE_CHOICES
+from human_resources.scheduling import Booking, schedule_for, INTERVIEWER
 
 class EvaluationAddForm(forms.ModelForm):
 	
@@ -26,4 +29,102 @@ class EvaluationChangeForm(forms.ModelForm):
 		
 		self.fields['satisfied_qualifications'].queryset = qualifications_queryset
 		self.fields['satisfied_nice_to_haves'].queryset = nice_to_haves_queryset
-	
\ No newline at end of file
+
+
+class PersonImportForm(forms.ModelForm):
+	"""Validates one row of a people import. The social media URL fields
+	are left out because validating them would fetch every URL."""
+	
+	class Meta:
+		model = Person
+		fields = ('status', 'first_name', 'middle_name', 'last_name', 'email',
+			'mobile_phone', 'other_phone', 'address', 'address_two', 'city',
+			'state', 'zip_code', 'twitter_handle')
+	
+	def __init__(self, *args, **kwargs):
+		super(PersonImportForm, self).__init__(*args, **kwargs)
+		# people are matched by email, so an import can't do without it
+		self.fields['email'].required = True
+		self.fields['status'].required = False
+	
+	def clean_status(self):
+		return self.cleaned_data.get('status') or Person._meta.get_field('status').default
+
+
+class PeopleImportUploadForm(forms.Form):
+	FORMAT_CHOICES = (
+		('csv', 'CSV'),
+		('jsonl', 'JSON lines'),
+	)
+	
+	file = forms.FileField()
+	format = forms.ChoiceField(choices=FORMAT_CHOICES)
+
+
+class PipelineStageForm(forms.Form):
+	"""One pipeline step for the selected evaluations or candidacies, see
+	human_resources.pipeline.change_stage"""
+	
+	UNCHANGED = [('', 'Unchanged')]
+	
+	status = forms.TypedChoiceField(choices=UNCHANGED + list(Evaluation.EVALUATION_STATUS_CHOICES), coerce=int, empty_value=None, required=False)
+	rank = forms.TypedChoiceField(choices=UNCHANGED + list(IMPORTANCE_CHOICES), coerce=int, empty_value=None, required=False)
+	interview_type = forms.TypedChoiceField(label="Schedule interview", choices=[('', 'None')] + list(Interview.INTERVIEW_TYPE), coerce=int, empty_value=None, required=False)
+	interview_date = forms.DateTimeField(required=False)
+	interview_notes = forms.CharField(widget=forms.Textarea, required=False)
+	note = forms.CharField(label="Add note", widget=forms.Textarea, required=False)
+	
+	def clean(self):
+		cleaned_data = self.cleaned_data
+		if cleaned_data.get('interview_type') is not None and not cleaned_data.get('interview_date'):
+			raise forms.ValidationError("Give the date of the interview.")
+		if all(cleaned_data.get(name) in (None, '') for name in ('status', 'rank', 'interview_type', 'note')):
+			raise forms.ValidationError("Choose at least one change.")
+		return cleaned_data
+
+
+class InterviewInlineFormSet(BaseInlineFormSet):
+	"""Rejects interviews overlapping another interview of one of their
+	interviewers, the candidate or the room, including the other rows
+	submitted, and suggests the next free slots"""
+	
+	def clean(self):
+		super(InterviewInlineFormSet, self).clean()
+		
+		rows = []
+		names = {}
+		for form in self.forms:
+			data = getattr(form, 'cleaned_data', None)
+			if not data or data.get('DELETE') or not data.get('date') or not data.get('duration'):
+				continue
+			interviewers = data.get('interviewers') or []
+			names.update((user.pk, user.get_full_name() or user.username) for user in interviewers)
+			rows.append((form, Booking(data['date'], data['duration'], [user.pk for user in interviewers], None, data.get('room', ''))))
+		if not rows:
+			return
+		
+		candidacy_id = getattr(self.instance, 'candidacy_id', None)
+		if candidacy_id:
+			for person_id in Candidacy.objects.filter(pk=candidacy_id).values_list('person', flat=True):
+				for form, booking in rows:
+					booking.person = person_id
+		
+		# the stored rows of this evaluation are checked as submitted
+		schedule = schedule_for([booking for form, booking in rows], [form.instance.pk for form in self.forms if form.instance.pk])
+		errors = []
+		# rows left alone are in the way of the others, but aren't reported
+		for form, booking in rows:
+			if not form.has_changed():
+				schedule.add(booking)
+		for form, booking in rows:
+			if not form.has_changed():
+				continue
+			conflicts = schedule.book(booking)
+			if conflicts:
+				messages = [conflict.message(names.get(conflict.key) if conflict.kind == INTERVIEWER else None) for conflict in conflicts]
+				slots = schedule.free_slots(booking)
+				if slots:
+					messages.append(u"free at %s" %(", ".join(slot.strftime('%m/%d/%y %H:%M') for slot in slots)))
+				errors.append(u"Interview at %s: %s." %(booking.start.strftime('%m/%d/%y %H:%M'), "; ".join(messages)))
+		if errors:
+			raise forms.ValidationError(errors)
\ No newline at end of file
@@ -0,0 +1,203 @@
+"""
+Seeded synthetic HR data at production-like volumes.
+
+Everything is written with bulk_create in chunks, so generating hundreds of
+thousands of rows stays quick and memory bounded. The same seed and
+settings always produce the same data. bulk_create sends no signals, so
+the derived tables (search index, leaderboards) are not maintained while
+generating; the generate_hr_data command rebuilds the published jobs and
+says how to rebuild the rest.
+
+"""
+import datetime
+import random
+
+from django.contrib.auth.models import User
+from django.db import transaction
+
+from human_resources.models import Person, PersonNote, Position, Qualification, \
+NiceToHave, ContractType, Benefit, JobOpportunity, Candidacy, Evaluation
+
+FIRST_NAMES = ('Ava', 'Ben', 'Chloe', 'Diego', 'Emma', 'Farah', 'Gabriel', 'Hana', 'Isaac', 'Julia',
+	'Kenji', 'Lena', 'Marco', 'Nadia', 'Omar', 'Priya', 'Quinn', 'Rosa', 'Sam', 'Tariq')
+LAST_NAMES = ('Anderson', 'Baker', 'Chen', 'Diaz', 'Evans', 'Fischer', 'Garcia', 'Hughes', 'Ito', 'Johnson',
+	'Kim', 'Lopez', 'Miller', 'Nguyen', 'Okafor', 'Patel', 'Rossi', 'Smith', 'Tanaka', 'Walker')
+CITIES = (('Tustin', 'CA'), ('Irvine', 'CA'), ('Austin', 'TX'), ('Denver', 'CO'), ('Portland', 'OR'),
+	('Chicago', 'IL'), ('Boston', 'MA'), ('Seattle', 'WA'))
+WORDS = ('python', 'django', 'design', 'sales', 'support', 'leadership', 'postgres', 'javascript',
+	'communication', 'marketing', 'writing', 'analysis', 'testing', 'operations', 'finance', 'remote')
+
+DEFAULTS = {
+	'people': 200000,
+	'notes_per_person': 5.0,
+	'positions': 500,
+	'qualifications_per_position': 8,
+	'nice_to_haves_per_position': 5,
+	'jobs': 5000,
+	'candidacies': 500000,
+	'evaluations_per_candidacy': 1.0,
+	'satisfied_ratio': 0.5,
+	'published_ratio': 0.2,
+	'chunk_size': 5000,
+}
+
+
+def _count(rng, mean):
+	"""An integer averaging `mean` over many calls"""
+	whole = int(mean)
+	return whole + (1 if rng.random() < mean - whole else 0)
+
+
+def _text(rng, words):
+	return ' '.join(rng.choice(WORDS) for i in range(words))
+
+
+class Generator(object):
+
+	def __init__(self, seed=0, log=None, **options):
+		self.rng = random.Random(seed)
+		self.options = dict(DEFAULTS)
+		self.options.update((k, v) for k, v in options.items() if v is not None)
+		self.log = log or (lambda message: None)
+		self.counts = {}
+
+	def _bulk_create(self, model, objects):
+		"""bulk_create in chunks; returns the pks of the new rows, which
+		Django 1.4 does not set on the objects"""
+		objects = list(objects)
+		last_pk = model.objects.order_by('-pk').values_list('pk', flat=True)[:1]
+		last_pk = last_pk[0] if last_pk else 0
+		chunk_size = self.options['chunk_size']
+		for i in range(0, len(objects), chunk_size):
+			with transaction.commit_on_success():
+				model.objects.bulk_create(objects[i:i + chunk_size])
+		self.counts[model.__name__] = self.counts.get(model.__name__, 0) + len(objects)
+		self.log("%s %s" %(len(objects), model._meta.verbose_name_plural))
+		return list(model.objects.filter(pk__gt=last_pk).order_by('pk').values_list('pk', flat=True))
+
+	def _chunked_create(self, model, build, items):
+		"""Build and bulk_create rows for `items` a chunk at a time, so the
+		unsaved objects never pile up"""
+		chunk_size = self.options['chunk_size']
+		for i in range(0, len(items), chunk_size):
+			objects = []
+			for item in items[i:i + chunk_size]:
+				objects.extend(build(item))
+			with transaction.commit_on_success():
+				model.objects.bulk_create(objects)
+			self.counts[model.__name__] = self.counts.get(model.__name__, 0) + len(objects)
+		self.log("%s %s" %(self.counts.get(model.__name__, 0), model._meta.verbose_name_plural))
+
+	def run(self):
+		o = self.options
+		rng = self.rng
+		now = datetime.datetime.now()
+		author, created = User.objects.get_or_create(username='hr_generator')
+
+		contract_type_ids = [ContractType.objects.get_or_create(name=name)[0].pk for name in ('Full-Time', 'Part-Time', 'Contract', 'Internship')]
+		benefit_ids = [Benefit.objects.get_or_create(name=name)[0].pk for name in ('Health', 'Dental', '401k', 'Equity')]
+
+		# positions and their requirements
+		first_position = Position.objects.count()
+		position_ids = self._bulk_create(Position, (
+			Position(
+				name='Generated position %s' %(first_position + i),
+				importance=rng.randint(1, 10),
+				private_description=_text(rng, 30),
+				public_description='<p>%s</p>' %(_text(rng, 60)),
+			) for i in range(o['positions'])
+		))
+		qualification_ids = dict((pk, []) for pk in position_ids)
+		nice_to_have_ids = dict((pk, []) for pk in position_ids)
+		for model, per_position, by_position in (
+				(Qualification, o['qualifications_per_position'], qualification_ids),
+				(NiceToHave, o['nice_to_haves_per_position'], nice_to_have_ids)):
+			self._bulk_create(model, (
+				model(position_id=pk, description='%s %s #%s' %(model._meta.verbose_name, _text(rng, 6), i))
+				for pk in position_ids for i in range(per_position)
+			))
+			for pk, position_id in model.objects.filter(position__in=position_ids).values_list('pk', 'position'):
+				by_position[position_id].append(pk)
+
+		# job opportunities, with unique locations so their slugs are unique
+		jobs = []
+		for i in range(o['jobs']):
+			city, state = rng.choice(CITIES)
+			jobs.append(JobOpportunity(
+				position_id=rng.choice(position_ids),
+				location='%s, %s (office %s)' %(city, state, i),
+				pay='$%s,000' %(rng.randint(40, 180)),
+				status=1 if rng.random() < 0.8 else rng.choice((2, 3)),
+				published_status=2 if rng.random() < o['published_ratio'] else 1,
+			))
+		job_ids = self._bulk_create(JobOpportunity, jobs)
+		del jobs
+		job_positions = dict(JobOpportunity.objects.filter(pk__in=job_ids).values_list('pk', 'position'))
+		self._chunked_create(JobOpportunity.contract_types.through, lambda job_id: [
+			JobOpportunity.contract_types.through(jobopportunity_id=job_id, contracttype_id=pk)
+			for pk in rng.sample(contract_type_ids, rng.randint(1, 2))
+		], job_ids)
+		self._chunked_create(JobOpportunity.benefits.through, lambda job_id: [
+			JobOpportunity.benefits.through(jobopportunity_id=job_id, benefit_id=pk)
+			for pk in rng.sample(benefit_ids, rng.randint(0, len(benefit_ids)))
+		], job_ids)
+
+		# people and their notes
+		first_person = Person.objects.count()
+		def build_person(i):
+			first, last = rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES)
+			city, state = rng.choice(CITIES)
+			return [Person(
+				status=rng.randint(0, 8),
+				first_name=first,
+				last_name=last,
+				email='%s.%s.%s@example.com' %(first.lower(), last.lower(), first_person + i),
+				city=city,
+				state=state,
+			)]
+		last_person = Person.objects.order_by('-pk').values_list('pk', flat=True)[:1]
+		self._chunked_create(Person, build_person, range(o['people']))
+		person_ids = list(Person.objects.filter(pk__gt=last_person[0] if last_person else 0).order_by('pk').values_list('pk', flat=True))
+
+		self._chunked_create(PersonNote, lambda person_id: [
+			PersonNote(
+				author_id=author.pk,
+				person_id=person_id,
+				date_and_time=now - datetime.timedelta(minutes=rng.randint(0, 60 * 24 * 365 * 3)),
+				note=_text(rng, rng.randint(5, 40)),
+			) for n in range(_count(rng, o['notes_per_person']))
+		], person_ids)
+
+		# candidacies: each person applies to a few distinct jobs
+		last_candidacy = Candidacy.objects.order_by('-pk').values_list('pk', flat=True)[:1]
+		per_person = float(o['candidacies']) / max(len(person_ids), 1)
+		self._chunked_create(Candidacy, lambda person_id: [
+			Candidacy(person_id=person_id, job_opportunity_id=job_id, rank=rng.randint(1, 10))
+			for job_id in rng.sample(job_ids, min(_count(rng, per_person), len(job_ids)))
+		], person_ids)
+		candidacies = list(Candidacy.objects.filter(
+			pk__gt=last_candidacy[0] if last_candidacy else 0
+		).order_by('pk').values_list('pk', 'job_opportunity'))
+
+		# evaluations, then their satisfied requirements
+		last_evaluation = Evaluation.objects.order_by('-pk').values_list('pk', flat=True)[:1]
+		self._chunked_create(Evaluation, lambda row: [
+			Evaluation(candidacy_id=row[0], status=rng.choice((1, 1, 1, 2)))
+			for n in range(_count(rng, o['evaluations_per_candidacy']))
+		], candidacies)
+		del candidacies
+		evaluations = list(Evaluation.objects.filter(
+			pk__gt=last_evaluation[0] if last_evaluation else 0
+		).order_by('pk').values_list('pk', 'candidacy__job_opportunity'))
+
+		ratio = o['satisfied_ratio']
+		for field_name, target, by_position in (
+				('satisfied_qualifications', 'qualification_id', qualification_ids),
+				('satisfied_nice_to_haves', 'nicetohave_id', nice_to_have_ids)):
+			through = Evaluation._meta.get_field(field_name).rel.through
+			self._chunked_create(through, lambda row: [
+				through(evaluation_id=row[0], **{target: pk})
+				for pk in by_position.get(job_positions.get(row[1]), []) if rng.random() < ratio
+			], evaluations)
+
+		return self.counts
@@ -0,0 +1,236 @@
+"""
+Streaming import of people, their web links and candidacies.
+
+Rows are read lazily from CSV or JSON lines and processed in fixed-size
+chunks, each in its own transaction: the chunk's rows are validated,
+matched against existing people by email with one query, and the new
+Person, WebLink and Candidacy rows are written with bulk_create. Only one
+chunk is ever held in memory.
+
+Besides the PersonImportForm fields a row may carry
+	job_opportunities	job opportunity ids or slugs, separated by ";"
+	web_links			"name|url" pairs, separated by ";"
+
+"""
+import csv
+import json
+import time
+from itertools import islice
+
+from django import forms
+from django.db import connection
+
+from human_resources.forms import PersonImportForm
+from human_resources.models import Person, WebLink, Candidacy, JobOpportunity
+from human_resources.search import index_objects
+from human_resources.transactions import commit_on_success
+
+CHUNK_SIZE = 500
+
+MULTI_VALUE_SEPARATOR = ';'
+WEB_LINK_SEPARATOR = '|'
+
+
+def read_csv(lines):
+	for row in csv.DictReader(lines):
+		yield dict((key, (value or '').decode('utf-8')) for key, value in row.items() if key)
+
+
+def read_jsonl(lines):
+	for line in lines:
+		line = line.strip()
+		if line:
+			yield json.loads(line)
+
+READERS = {
+	'csv': read_csv,
+	'jsonl': read_jsonl,
+}
+
+
+def _split(value):
+	if isinstance(value, (list, tuple)):
+		return [unicode(v).strip() for v in value if unicode(v).strip()]
+	return [v.strip() for v in (value or '').split(MULTI_VALUE_SEPARATOR) if v.strip()]
+
+
+class ImportStats(object):
+	def __init__(self):
+		self.rows = 0
+		self.errors = 0
+		self.people_created = 0
+		self.people_matched = 0
+		self.web_links_created = 0
+		self.candidacies_created = 0
+		self.chunks = 0
+		self.started = time.time()
+
+	@property
+	def seconds(self):
+		return time.time() - self.started
+
+	def summary(self):
+		seconds = self.seconds
+		return "%s rows in %s chunks (%.1f rows/s): %s people created, %s matched by email, %s web links, %s candidacies, %s errors" %(
+			self.rows, self.chunks, self.rows / seconds if seconds else 0, self.people_created,
+			self.people_matched, self.web_links_created, self.candidacies_created, self.errors
+		)
+
+
+class PeopleImporter(object):
+	"""
+	Imports an iterable of row dicts.
+
+	`on_error(row_number, message)` is called for every rejected row and
+	`on_chunk(rows_done)` after every committed chunk, so a caller can
+	report errors and record where to resume without the importer keeping
+	either in memory. `skip` rows are passed over unprocessed to resume an
+	earlier run.
+
+	"""
+
+	def __init__(self, chunk_size=CHUNK_SIZE, on_error=None, on_chunk=None):
+		self.chunk_size = chunk_size
+		self.on_error = on_error or (lambda row_number, message: None)
+		self.on_chunk = on_chunk or (lambda rows_done: None)
+		self.stats = ImportStats()
+
+	def run(self, rows, skip=0):
+		rows = iter(rows)
+		for i in range(skip):
+			if next(rows, None) is None:
+				break
+
+		row_number = skip
+		while True:
+			chunk = list(islice(rows, self.chunk_size))
+			if not chunk:
+				break
+			self.import_chunk(row_number + 1, chunk)
+			row_number += len(chunk)
+			self.stats.rows += len(chunk)
+			self.stats.chunks += 1
+			self.on_chunk(row_number)
+		return self.stats
+
+	def _error(self, row_number, message):
+		self.stats.errors += 1
+		self.on_error(row_number, message)
+
+	def _validate(self, first_row_number, chunk):
+		"""Returns a list of (row number, cleaned person data, job
+		references, web links) for the valid rows of the chunk"""
+		valid = []
+		url_field = forms.URLField()
+
+		for row_number, row in enumerate(chunk, first_row_number):
+			form = PersonImportForm(row)
+			if not form.is_valid():
+				self._error(row_number, '; '.join(
+					'%s: %s' %(field, ' '.join(errors)) for field, errors in form.errors.items()
+				))
+				continue
+
+			web_links = []
+			try:
+				for link in _split(row.get('web_links')):
+					name, sep, url = link.partition(WEB_LINK_SEPARATOR)
+					if not sep:
+						raise forms.ValidationError('web link "%s" is not "name|url"' %(link))
+					web_links.append((name.strip()[:25], url_field.clean(url.strip())))
+			except forms.ValidationError, e:
+				self._error(row_number, 'web_links: %s' %(' '.join(e.messages)))
+				continue
+
+			# emails are matched lowercased, so store them that way too
+			form.cleaned_data['email'] = form.cleaned_data['email'].lower()
+			valid.append((row_number, form.cleaned_data, _split(row.get('job_opportunities')), web_links))
+		return valid
+
+	def _resolve_jobs(self, valid):
+		references = set()
+		for row_number, data, jobs, web_links in valid:
+			references.update(jobs)
+		ids = [int(r) for r in references if r.isdigit()]
+		slugs = [r for r in references if not r.isdigit()]
+
+		resolved = {}
+		if ids:
+			for pk in JobOpportunity.objects.filter(pk__in=ids).values_list('pk', flat=True):
+				resolved[unicode(pk)] = pk
+		if slugs:
+			for pk, slug in JobOpportunity.objects.filter(slug__in=slugs).values_list('pk', 'slug'):
+				resolved[slug] = pk
+		return resolved
+
+	def _people_by_email(self, emails):
+		emails = list(emails)
+		people = {}
+		if not emails:
+			return people
+
+		# people added through the admin keep their email as typed
+		where = 'LOWER(%s.%s) IN (%s)' %(
+			connection.ops.quote_name(Person._meta.db_table),
+			connection.ops.quote_name(Person._meta.get_field('email').column),
+			', '.join(['%s'] * len(emails)),
+		)
+		# lowest pk wins when an email is shared by several people
+		for person in Person.objects.extra(where=[where], params=emails).order_by('-pk'):
+			people[person.email.lower()] = person
+		return people
+
+	@commit_on_success
+	def import_chunk(self, first_row_number, chunk):
+		valid = self._validate(first_row_number, chunk)
+		if not valid:
+			return
+
+		jobs = self._resolve_jobs(valid)
+		emails = set(data['email'] for row_number, data, job_refs, web_links in valid)
+		people = self._people_by_email(emails)
+
+		new_people = {}
+		for row_number, data, job_refs, web_links in valid:
+			email = data['email']
+			if email in people:
+				self.stats.people_matched += 1
+			elif email not in new_people:
+				new_people[email] = Person(**data)
+
+		if new_people:
+			Person.objects.bulk_create(new_people.values())
+			self.stats.people_created += len(new_people)
+			# bulk_create leaves pks unset, fetch them back by email
+			created = self._people_by_email(new_people.keys())
+			people.update(created)
+			index_objects(Person, created.values())
+
+		person_ids = [p.pk for p in people.values()]
+		existing_links = set(WebLink.objects.filter(person__in=person_ids).values_list('person', 'name', 'url'))
+		existing_candidacies = set(Candidacy.objects.filter(person__in=person_ids).values_list('person', 'job_opportunity'))
+
+		new_links = []
+		new_candidacies = []
+		for row_number, data, job_refs, web_links in valid:
+			person = people[data['email']]
+
+			for name, url in web_links:
+				if (person.pk, name, url) not in existing_links:
+					existing_links.add((person.pk, name, url))
+					new_links.append(WebLink(person=person, name=name, url=url))
+
+			for reference in job_refs:
+				job_id = jobs.get(reference)
+				if job_id is None:
+					self._error(row_number, 'job_opportunities: no job opportunity "%s"' %(reference))
+				elif (person.pk, job_id) not in existing_candidacies:
+					existing_candidacies.add((person.pk, job_id))
+					new_candidacies.append(Candidacy(person=person, job_opportunity_id=job_id))
+
+		if new_links:
+			WebLink.objects.bulk_create(new_links)
+		if new_candidacies:
+			Candidacy.objects.bulk_create(new_candidacies)
+		self.stats.web_links_created += len(new_links)
+		self.stats.candidacies_created += len(new_candidacies)
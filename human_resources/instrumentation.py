@@ -0,0 +1,238 @@
+"""
+Opt-in per-request query and latency instrumentation.
+
+Enable it with HR_INSTRUMENTATION = True and by adding
+	'human_resources.instrumentation.InstrumentationMiddleware'
+to MIDDLEWARE_CLASSES. For every instrumented request it counts the
+queries, their SQL time, repeated statements and the total latency, and
+attributes each query to the innermost section it ran in: the HR
+changelist column callables (e.g. "PersonAdmin.candidacies"),
+JobOpportunityPlugin.render or the job_opportunity view. The result is
+logged as one JSON line on the "human_resources.instrumentation" logger
+and folded into in-process totals served by stats_view.
+
+Queries are timed by a thin cursor wrapper; nothing is kept per query
+beyond a counter per statement, so it can stay on under load.
+
+"""
+import json
+import logging
+import re
+import threading
+import time
+from functools import wraps
+
+from django.conf import settings
+from django.contrib.admin.views.decorators import staff_member_required
+from django.db import connections
+from django.db.backends.util import CursorWrapper
+from django.http import HttpResponse
+
+ENABLED = getattr(settings, 'HR_INSTRUMENTATION', False)
+# requests on these paths are always reported, others only when they
+# entered an instrumented section
+PATHS = [re.compile(p) for p in getattr(settings, 'HR_INSTRUMENTATION_PATHS', (
+	r'^/admin/human_resources/\w+/$',
+))]
+DUPLICATES_LOGGED = 5
+
+logger = logging.getLogger('human_resources.instrumentation')
+
+_state = threading.local()
+
+
+class RequestStats(object):
+	def __init__(self, name):
+		self.name = name
+		self.started = time.time()
+		self.queries = 0
+		self.sql_time = 0.0
+		self.sections = {}
+		self.statements = {}
+		self.labels = [name]
+		self.reported = False
+
+	def record(self, sql, duration):
+		label = self.labels[-1]
+		self.queries += 1
+		self.sql_time += duration
+		section = self.sections.setdefault(label, [0, 0.0])
+		section[0] += 1
+		section[1] += duration
+		key = (label, sql)
+		self.statements[key] = self.statements.get(key, 0) + 1
+
+	def duplicates(self):
+		repeated = [(count, label, sql) for (label, sql), count in self.statements.items() if count > 1]
+		repeated.sort(reverse=True)
+		return repeated
+
+	def as_dict(self):
+		return {
+			'name': self.name,
+			'latency_ms': round((time.time() - self.started) * 1000, 2),
+			'queries': self.queries,
+			'sql_ms': round(self.sql_time * 1000, 2),
+			'sections': dict(
+				(label, {'queries': count, 'sql_ms': round(duration * 1000, 2)})
+				for label, (count, duration) in self.sections.items()
+			),
+			'duplicates': [
+				{'section': label, 'count': count, 'sql': sql[:200]}
+				for count, label, sql in self.duplicates()[:DUPLICATES_LOGGED]
+			],
+		}
+
+
+def current():
+	return getattr(_state, 'stats', None)
+
+
+class InstrumentedCursor(CursorWrapper):
+	def execute(self, sql, params=()):
+		self.set_dirty()
+		started = time.time()
+		try:
+			return self.cursor.execute(sql, params)
+		finally:
+			stats = current()
+			if stats is not None:
+				stats.record(sql, time.time() - started)
+
+	def executemany(self, sql, param_list):
+		self.set_dirty()
+		started = time.time()
+		try:
+			return self.cursor.executemany(sql, param_list)
+		finally:
+			stats = current()
+			if stats is not None:
+				stats.record(sql, time.time() - started)
+
+
+def _instrument_connections():
+	"""Route every cursor of this thread's connections through
+	InstrumentedCursor, using the debug cursor hook"""
+	for connection in connections.all():
+		if not getattr(connection, 'hr_instrumented', False):
+			connection.use_debug_cursor = True
+			connection.make_debug_cursor = lambda cursor, connection=connection: InstrumentedCursor(cursor, connection)
+			connection.hr_instrumented = True
+
+
+class section(object):
+	"""Context manager attributing the queries run inside it to `label`"""
+	def __init__(self, label):
+		self.label = label
+
+	def __enter__(self):
+		stats = current()
+		if stats is not None:
+			stats.labels.append(self.label)
+			stats.reported = True
+
+	def __exit__(self, *exc_info):
+		stats = current()
+		if stats is not None and len(stats.labels) > 1:
+			stats.labels.pop()
+
+
+def instrumented(label):
+	"""Decorator running a function inside section(label)"""
+	def decorator(func):
+		@wraps(func)
+		def wrapper(*args, **kwargs):
+			if current() is None:
+				return func(*args, **kwargs)
+			with section(label):
+				return func(*args, **kwargs)
+		return wrapper
+	return decorator
+
+
+def instrument_list_display(model_admin):
+	"""Wrap the model admin's list_display callables so their queries are
+	attributed to "<ModelAdmin>.<column>". Safe to call repeatedly."""
+	if not ENABLED or getattr(model_admin, 'hr_instrumented', False):
+		return
+	admin_name = model_admin.__class__.__name__
+	for name in model_admin.list_display:
+		method = getattr(model_admin, name, None) if isinstance(name, basestring) else None
+		if method is None or not callable(method):
+			continue
+		wrapper = instrumented('%s.%s' %(admin_name, name))(method)
+		# keep allow_tags, short_description, admin_order_field...
+		wrapper.__dict__.update(getattr(method, '__func__', method).__dict__)
+		setattr(model_admin, name, wrapper)
+	model_admin.hr_instrumented = True
+
+
+class Totals(object):
+	"""Running totals per request name, shared by the whole process"""
+	def __init__(self):
+		self.lock = threading.Lock()
+		self.data = {}
+
+	def add(self, stats_dict):
+		with self.lock:
+			totals = self.data.setdefault(stats_dict['name'], {
+				'requests': 0, 'queries': 0, 'sql_ms': 0.0, 'latency_ms': 0.0, 'max_latency_ms': 0.0, 'sections': {},
+			})
+			totals['requests'] += 1
+			totals['queries'] += stats_dict['queries']
+			totals['sql_ms'] += stats_dict['sql_ms']
+			totals['latency_ms'] += stats_dict['latency_ms']
+			totals['max_latency_ms'] = max(totals['max_latency_ms'], stats_dict['latency_ms'])
+			for label, section_stats in stats_dict['sections'].items():
+				section_totals = totals['sections'].setdefault(label, {'queries': 0, 'sql_ms': 0.0})
+				section_totals['queries'] += section_stats['queries']
+				section_totals['sql_ms'] += section_stats['sql_ms']
+
+	def snapshot(self):
+		with self.lock:
+			return json.loads(json.dumps(self.data))
+
+	def reset(self):
+		with self.lock:
+			self.data = {}
+
+totals = Totals()
+
+
+class InstrumentationMiddleware(object):
+	def process_request(self, request):
+		if not ENABLED:
+			return None
+		_instrument_connections()
+		stats = RequestStats(request.path)
+		stats.reported = any(p.match(request.path) for p in PATHS)
+		_state.stats = stats
+		return None
+
+	def process_view(self, request, view_func, view_args, view_kwargs):
+		# changelists are reported by path, everything else by view name
+		# so that slugs and ids don't multiply the totals
+		stats = current()
+		if stats is not None and not any(p.match(request.path) for p in PATHS):
+			name = getattr(view_func, '__name__', None)
+			if name:
+				stats.name = stats.labels[0] = name
+		return None
+
+	def process_response(self, request, response):
+		stats = current()
+		_state.stats = None
+		if stats is not None and stats.reported:
+			stats_dict = stats.as_dict()
+			totals.add(stats_dict)
+			logger.info(json.dumps(stats_dict, sort_keys=True))
+		return response
+
+
+@staff_member_required
+def stats_view(request):
+	"""JSON totals of this process since it started (or ?reset=1)"""
+	snapshot = totals.snapshot()
+	if request.GET.get('reset'):
+		totals.reset()
+	return HttpResponse(json.dumps(snapshot, indent=1, sort_keys=True), content_type='application/json')
@@ -0,0 +1,75 @@
+"""
+Versioned cache for the rendered public job pages.
+
+Every key embeds a generation number. Any change to the data those pages
+show bumps the generation, which orphans all previously cached fragments
+at once instead of deleting them one by one.
+
+"""
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models.signals import post_save, post_delete, m2m_changed
+
+from human_resources.models import JobOpportunity, Position, Qualification, \
+NiceToHave, ContractType, Benefit
+from human_resources.routers import primary_reads
+
+JOB_CACHE_TIME = getattr(settings, 'HR_JOB_CACHE_TIME', 60 * 60 * 24) # 1 day
+
+GENERATION_KEY = 'hr_jobs_generation'
+
+
+def _new_generation():
+	# seeded from the clock so a counter that was evicted never restarts
+	# at a number whose fragments might still be cached
+	cache.add(GENERATION_KEY, int(time.time()), JOB_CACHE_TIME)
+
+
+def get_generation():
+	generation = cache.get(GENERATION_KEY)
+	if generation is None:
+		_new_generation()
+		generation = cache.get(GENERATION_KEY) or int(time.time())
+	return generation
+
+
+def bump_generation():
+	try:
+		cache.incr(GENERATION_KEY)
+	except ValueError: # key expired or was never set
+		_new_generation()
+
+
+def published_jobs_key():
+	return 'hr_jobs:%s:published_jobs' %(get_generation())
+
+
+def job_page_key(slug):
+	return 'hr_jobs:%s:job_page:%s' %(get_generation(), slug)
+
+
+def get_or_render(key, render):
+	"""Return the cached html for key, calling render() to build and cache
+	it on a miss"""
+	html = cache.get(key)
+	if html is None:
+		# cached for everyone, so never from a replica that may lag
+		with primary_reads():
+			html = render()
+		cache.set(key, html, JOB_CACHE_TIME)
+	return html
+
+
+def invalidate_job_pages(sender, **kwargs):
+	bump_generation()
+
+
+for model in (JobOpportunity, Position, Qualification, NiceToHave, ContractType, Benefit):
+	post_save.connect(invalidate_job_pages, sender=model, dispatch_uid='hr_job_cache_save_%s' % model.__name__)
+	post_delete.connect(invalidate_job_pages, sender=model, dispatch_uid='hr_job_cache_delete_%s' % model.__name__)
+
+for field_name in ('benefits', 'contract_types'):
+	through = JobOpportunity._meta.get_field(field_name).rel.through
+	m2m_changed.connect(invalidate_job_pages, sender=through, dispatch_uid='hr_job_cache_m2m_%s' % field_name)
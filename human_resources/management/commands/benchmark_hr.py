@@ -0,0 +1,27 @@
+import json
+from optparse import make_option
+
+from django.core.management.base import BaseCommand
+
+from human_resources.benchmark import run_benchmarks
+
+
+class Command(BaseCommand):
+	args = '[benchmark name fragment ...]'
+	help = "Times the HR admin changelists, public job pages and evaluation form, and writes the results as JSON."
+	
+	option_list = BaseCommand.option_list + (
+		make_option('--runs', dest='runs', type='int', default=5,
+			help='Timed runs per benchmark (default 5)'),
+		make_option('--output', dest='output', default=None,
+			help='Write the JSON results to this file instead of stdout'),
+	)
+	
+	def handle(self, *args, **options):
+		results = json.dumps(run_benchmarks(runs=options['runs'], only=args), indent=1, sort_keys=True)
+		
+		if options['output']:
+			with open(options['output'], 'w') as f:
+				f.write(results + "\n")
+		else:
+			self.stdout.write(results + "\n")
\ No newline at end of file
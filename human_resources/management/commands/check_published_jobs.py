@@ -0,0 +1,16 @@
+from django.core.management.base import NoArgsCommand, CommandError
+
+from human_resources.published_jobs import check_published_jobs
+
+
+class Command(NoArgsCommand):
+	help = "Reports PublishedJob rows that differ from their job opportunities."
+	
+	def handle_noargs(self, **options):
+		problems = check_published_jobs()
+		for job_id, problem in problems:
+			self.stdout.write("Job #%s: %s\n" %(job_id, problem))
+		
+		if problems:
+			raise CommandError("%s inconsistencies found, run rebuild_published_jobs to fix them." %(len(problems)))
+		self.stdout.write("PublishedJob is consistent.\n")
@@ -0,0 +1,20 @@
+from django.core.management.base import NoArgsCommand, CommandError
+
+from human_resources.query_plans import check_query_plans
+
+
+class Command(NoArgsCommand):
+	help = "EXPLAINs the hot HR lookups and fails if any falls back to a sequential scan."
+	
+	def handle_noargs(self, **options):
+		regressions = []
+		
+		for name, plan_lines, sequential in check_query_plans():
+			self.stdout.write("%s%s\n" %(name, ' (SEQUENTIAL SCAN)' if sequential else ''))
+			for line in plan_lines:
+				self.stdout.write("    %s\n" %(line))
+			if sequential:
+				regressions.append(name)
+		
+		if regressions:
+			raise CommandError("Sequential scans in: %s" %(', '.join(regressions)))
\ No newline at end of file
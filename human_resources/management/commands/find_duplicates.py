@@ -0,0 +1,14 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from human_resources.dedupe import find_duplicates
+
+
+class Command(BaseCommand):
+	help = "Compares every person with the people sharing an email, a phone number or a similar name, and stores the likely duplicates as merge suggestions for the admin."
+	
+	def handle(self, *args, **options):
+		started = time.time()
+		count = find_duplicates()
+		self.stdout.write("Found %s likely duplicate(s) in %.1fs.\n" %(count, time.time() - started))
\ No newline at end of file
@@ -0,0 +1,34 @@
+import json
+from optparse import make_option
+
+from django.core.management.base import BaseCommand
+
+from human_resources.generator import Generator, DEFAULTS
+from human_resources.published_jobs import rebuild_published_jobs
+
+
+def _option(name, default):
+	kind = 'float' if isinstance(default, float) else 'int'
+	return make_option('--' + name.replace('_', '-'), dest=name, type=kind, default=None,
+		help='default %s' %(default))
+
+
+class Command(BaseCommand):
+	help = "Generates seeded synthetic people, notes, positions, jobs, candidacies and evaluations."
+	
+	option_list = BaseCommand.option_list + (
+		make_option('--seed', dest='seed', type='int', default=0),
+	) + tuple(_option(name, default) for name, default in sorted(DEFAULTS.items()))
+	
+	def handle(self, *args, **options):
+		generator_options = dict((name, options.get(name)) for name in DEFAULTS)
+		generator = Generator(
+			seed=options['seed'],
+			log=lambda message: self.stdout.write(message + "\n"),
+			**generator_options
+		)
+		counts = generator.run()
+		rebuild_published_jobs()
+		
+		self.stdout.write(json.dumps(counts, sort_keys=True) + "\n")
+		self.stdout.write("Run rebuild_search_index and rescore_candidacies to bring the derived tables up to date.\n")
\ No newline at end of file
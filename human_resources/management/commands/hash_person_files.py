@@ -0,0 +1,33 @@
+import os
+
+from django.core.files.storage import default_storage
+from django.core.management.base import NoArgsCommand
+
+from human_resources.models import File
+
+
+class Command(NoArgsCommand):
+	help = "Moves person files uploaded before content-addressed storage into it."
+	
+	def handle_noargs(self, **options):
+		storage = File._meta.get_field('person_file').storage
+		moved = missing = 0
+		
+		for f in File.objects.order_by('pk').iterator():
+			old_name = f.person_file.name
+			if storage.is_hashed(old_name):
+				continue
+			if not default_storage.exists(old_name):
+				missing += 1
+				self.stderr.write("File #%s: %s not found\n" %(f.pk, old_name))
+				continue
+			
+			content = default_storage.open(old_name, 'rb')
+			try:
+				# streams into the content-addressed storage and saves f
+				f.person_file.save(os.path.basename(old_name), content)
+			finally:
+				content.close()
+			moved += 1
+		
+		self.stdout.write("Moved %s file(s), %s missing. The old copies were left in place.\n" %(moved, missing))
\ No newline at end of file
@@ -0,0 +1,60 @@
+import os
+import sys
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+
+from human_resources.importer import PeopleImporter, READERS, CHUNK_SIZE
+
+
+class Command(BaseCommand):
+	args = '<file>'
+	help = "Imports people, web links and candidacies from a CSV or JSON lines file in chunks."
+	
+	option_list = BaseCommand.option_list + (
+		make_option('--format', dest='format', default=None,
+			help='csv or jsonl, guessed from the file extension by default'),
+		make_option('--chunk-size', dest='chunk_size', type='int', default=CHUNK_SIZE,
+			help='Rows per transaction (default %s)' %(CHUNK_SIZE)),
+		make_option('--resume', action='store_true', dest='resume', default=False,
+			help='Skip the rows committed by an earlier, interrupted run'),
+		make_option('--errors', dest='errors', default=None,
+			help='Write the per-row error report to this file instead of stderr'),
+	)
+	
+	def handle(self, *args, **options):
+		if len(args) != 1:
+			raise CommandError("Give exactly one file to import.")
+		path = args[0]
+		
+		format = options['format'] or os.path.splitext(path)[1].lstrip('.').lower()
+		if format not in READERS:
+			raise CommandError("Unknown format '%s', use --format with one of %s." %(format, ', '.join(READERS)))
+		
+		# rows committed so far are recorded next to the input file
+		state_path = path + '.import-state'
+		skip = 0
+		if options['resume'] and os.path.exists(state_path):
+			skip = int(open(state_path).read().strip() or 0)
+			self.stdout.write("Resuming after row %s.\n" %(skip))
+		
+		errors = open(options['errors'], 'a') if options['errors'] else sys.stderr
+		
+		def on_error(row_number, message):
+			errors.write((u"row %s: %s\n" %(row_number, message)).encode('utf-8'))
+		
+		def on_chunk(rows_done):
+			tmp_path = state_path + '.tmp'
+			with open(tmp_path, 'w') as f:
+				f.write(str(rows_done))
+			os.rename(tmp_path, state_path)
+		
+		importer = PeopleImporter(chunk_size=options['chunk_size'], on_error=on_error, on_chunk=on_chunk)
+		with open(path, 'rb') as f:
+			stats = importer.run(READERS[format](f), skip=skip)
+		
+		if errors is not sys.stderr:
+			errors.close()
+		if os.path.exists(state_path):
+			os.remove(state_path)
+		self.stdout.write(stats.summary() + "\n")
\ No newline at end of file
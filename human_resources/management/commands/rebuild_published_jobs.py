@@ -0,0 +1,11 @@
+from django.core.management.base import NoArgsCommand
+
+from human_resources.published_jobs import rebuild_published_jobs
+
+
+class Command(NoArgsCommand):
+	help = "Rebuilds the PublishedJob read model from every job opportunity."
+	
+	def handle_noargs(self, **options):
+		count = rebuild_published_jobs()
+		self.stdout.write("Rebuilt %s published job(s).\n" %(count))
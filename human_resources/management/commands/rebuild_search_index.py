@@ -0,0 +1,11 @@
+from django.core.management.base import NoArgsCommand
+
+from human_resources.search import rebuild_index
+
+
+class Command(NoArgsCommand):
+	help = "Rebuilds the admin search index from every person, note, interview and position."
+	
+	def handle_noargs(self, **options):
+		count = rebuild_index()
+		self.stdout.write("Wrote %s search index entries.\n" %(count))
\ No newline at end of file
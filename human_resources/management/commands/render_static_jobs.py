@@ -0,0 +1,41 @@
+import time
+from optparse import make_option
+
+from django.core.management.base import NoArgsCommand, CommandError
+
+from human_resources import static_pages
+
+
+class Command(NoArgsCommand):
+	help = "Renders every published job page and the published jobs listing into HR_STATIC_JOBS_ROOT, or only the queued changes."
+	
+	option_list = NoArgsCommand.option_list + (
+		make_option('--pending', action='store_true', dest='pending', default=False,
+			help='Only render the pages queued by changes to the published jobs'),
+		make_option('--watch', dest='watch', type='float', default=None,
+			help='Keep rendering the queued pages, checking every this many seconds'),
+	)
+	
+	def handle_noargs(self, **options):
+		if static_pages.STATIC_JOBS_ROOT is None:
+			raise CommandError("Set HR_STATIC_JOBS_ROOT to the directory the static job pages should be written to.")
+		
+		if options['watch'] is not None:
+			while True:
+				try:
+					count = static_pages.render_pending()
+				except Exception, e:
+					# requeued, retried on the next round
+					self.stderr.write("Rendering the queued job pages failed: %s\n" %(e))
+				else:
+					if count:
+						self.stdout.write("Rendered %s queued job page(s) and the listing.\n" %(count))
+				time.sleep(options['watch'])
+		
+		if options['pending']:
+			count = static_pages.render_pending()
+			self.stdout.write("Rendered %s queued job page(s)%s.\n" %(count, ' and the listing' if count else ''))
+			return
+		
+		count = static_pages.render_all_jobs()
+		self.stdout.write("Rendered %s job page(s) and the listing into %s.\n" %(count, static_pages.STATIC_JOBS_ROOT))
\ No newline at end of file
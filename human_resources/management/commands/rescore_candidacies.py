@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+
+from human_resources.scoring import rescore_all, rescore_jobs
+
+
+class Command(BaseCommand):
+	args = '[job opportunity id ...]'
+	help = "Recomputes the candidacy fit scores and leaderboards of the given, or all, job opportunities."
+	
+	def handle(self, *args, **options):
+		if args:
+			rescore_jobs([int(job_id) for job_id in args])
+			count = len(set(args))
+		else:
+			count = rescore_all()
+		self.stdout.write("Rescored %s job opportunities.\n" %(count))
\ No newline at end of file
@@ -1,4 +1,5 @@
 import datetime
+import json
 
 from django.core.urlresolvers import reverse
 from django.db import models
@@ -7,12 +8,8 @@ from django.contrib.localflavor.us.models import PhoneNumberField, USStateField
 
 from django_extensions.db.fields import AutoSlugField
 
-try:
-	from django.conf import settings
-	HR_UPLOAD_TO = settings.HR_UPLOAD_TO
-
-except AttributeError:
-	HR_UPLOAD_TO = settings.MEDIA_ROOT
+from human_resources.storage import HR_UPLOAD_TO, person_file_storage
+from human_resources.transactions import commit_on_success
 
 IMPORTANCE_CHOICES = (
 	(1, 1),
@@ -112,7 +109,8 @@ class WebLink(HRModel):
 class File(HRModel):
 	person = models.ForeignKey("Person", related_name="files")
 	name = models.CharField(max_length=25)
-	person_file = models.FileField("File", upload_to=HR_UPLOAD_TO+"/person_files")
+	# content addressed, see human_resources.storage
+	person_file = models.FileField("File", upload_to="", storage=person_file_storage)
 	
 	def __unicode__(self):
 		return "%s: %s" %(self.person, self.name)
@@ -174,13 +172,14 @@ class Position(HRModel):
 	class Meta:
 		ordering = ('-importance',)
 		
-	def save(self):
+	def save(self, *args, **kwargs):
 		"""
-		When saving a position, considering changing the evluation status of all its related 
-		job opportunity's evaluations to status="Candidacy closed"
+		A position has no status of its own: its evaluations are closed when
+		one of its job opportunities is filled or closed, see
+		JobOpportunity.save
 		
 		"""
-		super(Position, self).save()
+		super(Position, self).save(*args, **kwargs)
 	
 	def __unicode__(self):
 		return "%s" %(self.name)
@@ -235,6 +234,25 @@ class JobOpportunity(HRModel):
 	contract_types = models.ManyToManyField("ContractType")
 	
 	
+	@commit_on_success
+	def save(self, *args, **kwargs):
+		"""
+		Filling or closing an open job opportunity closes all of its
+		evaluations, in the same transaction. Saving a job that already was
+		filled or closed leaves evaluations reopened since alone.
+		
+		"""
+		previous_status = None
+		if self.pk is not None:
+			previous_status = JobOpportunity.objects.filter(pk=self.pk).values_list('status', flat=True)[:1]
+			previous_status = previous_status[0] if previous_status else None
+		
+		super(JobOpportunity, self).save(*args, **kwargs)
+		
+		if self.status in (2, 3) and previous_status not in (2, 3):
+			from human_resources.pipeline import close_evaluations_for_jobs
+			close_evaluations_for_jobs(JobOpportunity.objects.filter(pk=self.pk), sender=JobOpportunity)
+	
 	def get_absolute_url(self):
 		return ('/jobs/%s/' %(self.slug))
 		#return reverse('job_page', kwargs={"position_slug": self.position.slug, "location_slug": self.location_slug, "job_id": self.pk})
@@ -267,11 +285,21 @@ class Interview(HRModel):
 		(2, "In-person"),
 	)
 	
+	# in minutes; human_resources.scheduling relies on the upper bound
+	DURATION_CHOICES = [(minutes, "%d:%02d" %(minutes // 60, minutes % 60)) for minutes in range(15, 8 * 60 + 1, 15)]
+	
 	interview_type = models.PositiveSmallIntegerField(choices=INTERVIEW_TYPE)
 	date = models.DateTimeField(default=datetime.datetime.now)
+	duration = models.PositiveSmallIntegerField(choices=DURATION_CHOICES, default=60)
+	interviewers = models.ManyToManyField(User, blank=True, related_name="interviews")
+	room = models.CharField(max_length=50, blank=True)
 	notes = models.TextField(blank=True)
 	evaluation = models.ForeignKey("Evaluation")
 	
+	@property
+	def end(self):
+		return self.date + datetime.timedelta(minutes=self.duration)
+	
 	def __unicode__(self):
 		return "%s %s Interview (%s)" %(self.evaluation.candidacy, self.interview_type, self.date.strftime("%m/%d/%y"))
 
@@ -289,4 +317,138 @@ class Evaluation(HRModel):
 	
 	
 	def __unicode__(self):
-		return "%s Evaluation for %s (%s)" %(self.candidacy.job_opportunity, self.candidacy.person, self.get_status_display())
\ No newline at end of file
+		return "%s Evaluation for %s (%s)" %(self.candidacy.job_opportunity, self.candidacy.person, self.get_status_display())
+
+
+class PublishedJob(models.Model):
+	"""
+	Denormalized, read-only copy of a published JobOpportunity with
+	everything the public pages show. Rows are maintained by
+	human_resources.published_jobs and should never be edited directly.
+	
+	"""
+	job = models.OneToOneField("JobOpportunity", primary_key=True, related_name="published_job")
+	slug = models.SlugField(max_length=150, unique=True)
+	position_name = models.CharField(max_length=75)
+	public_description = models.TextField(blank=True)
+	location = models.CharField(max_length=150)
+	pay = models.CharField(max_length=125, blank=True)
+	# JSON encoded lists of names/descriptions
+	contract_types = models.TextField(default='[]')
+	benefits = models.TextField(default='[]')
+	qualifications = models.TextField(default='[]')
+	nice_to_haves = models.TextField(default='[]')
+	job_date_modified = models.DateTimeField()
+	# when the row was last rebuilt, i.e. when anything it shows changed
+	date_refreshed = models.DateTimeField(default=datetime.datetime.now, db_index=True)
+	
+	class Meta:
+		ordering = ('-job_date_modified',)
+	
+	def get_absolute_url(self):
+		return ('/jobs/%s/' %(self.slug))
+	
+	def contract_type_list(self):
+		return json.loads(self.contract_types)
+	
+	def benefit_list(self):
+		return json.loads(self.benefits)
+	
+	def qualification_list(self):
+		return json.loads(self.qualifications)
+	
+	def nice_to_have_list(self):
+		return json.loads(self.nice_to_haves)
+	
+	def __unicode__(self):
+		return "%s - %s" %(self.position_name, self.location)
+
+
+class JobSlug(models.Model):
+	"""
+	Every slug a job opportunity has had, so links to its page survive
+	edits of its position or location. The current slug is recorded too.
+	Maintained by human_resources.slug_routes.
+	
+	"""
+	slug = models.SlugField(max_length=150, unique=True)
+	job = models.ForeignKey("JobOpportunity", related_name="slug_history")
+	date_added = models.DateTimeField(auto_now_add=True)
+	
+	def __unicode__(self):
+		return self.slug
+
+
+class SearchIndexEntry(models.Model):
+	"""
+	One term of the local inverted index used by the admin search. `source`
+	and `source_id` identify the indexed row; the nullable foreign keys say
+	which person, evaluation or position a match on it should find.
+	Maintained by human_resources.search.
+	
+	"""
+	term = models.CharField(max_length=50, db_index=True)
+	source = models.CharField(max_length=20)
+	source_id = models.PositiveIntegerField(db_index=True)
+	person = models.ForeignKey("Person", blank=True, null=True, related_name="+")
+	evaluation = models.ForeignKey("Evaluation", blank=True, null=True, related_name="+")
+	position = models.ForeignKey("Position", blank=True, null=True, related_name="+")
+	
+	class Meta:
+		verbose_name_plural = 'search index entries'
+	
+	def __unicode__(self):
+		return "%s (%s #%s)" %(self.term, self.source, self.source_id)
+
+
+class CandidacyScore(models.Model):
+	"""
+	Computed fit of a candidacy for its job opportunity, and its place on
+	that job's leaderboard. Maintained by human_resources.scoring.
+	
+	"""
+	candidacy = models.OneToOneField("Candidacy", primary_key=True, related_name="score")
+	job_opportunity = models.ForeignKey("JobOpportunity", related_name="candidacy_scores")
+	score = models.FloatField(default=0)
+	place = models.PositiveIntegerField(db_index=True)
+	qualifications_satisfied = models.PositiveIntegerField(default=0)
+	nice_to_haves_satisfied = models.PositiveIntegerField(default=0)
+	date_scored = models.DateTimeField(auto_now=True)
+	
+	class Meta:
+		ordering = ('job_opportunity', 'place')
+		unique_together = ('job_opportunity', 'place')
+	
+	def __unicode__(self):
+		return "#%s %s (%.1f)" %(self.place, self.candidacy, self.score)
+
+
+class DuplicateSuggestion(models.Model):
+	"""
+	Two people that look like the same person. `person` has the lower pk
+	and is the one kept by a merge. Found by human_resources.dedupe;
+	dismissed pairs are not suggested again.
+	
+	"""
+	person = models.ForeignKey("Person", related_name="duplicate_suggestions")
+	duplicate = models.ForeignKey("Person", related_name="+")
+	score = models.FloatField(db_index=True)
+	reasons = models.CharField(max_length=255, blank=True)
+	dismissed = models.BooleanField(default=False)
+	date_found = models.DateTimeField(auto_now_add=True)
+	
+	class Meta:
+		ordering = ('-score',)
+		unique_together = ('person', 'duplicate')
+	
+	def __unicode__(self):
+		return "%s / %s (%.2f)" %(self.person, self.duplicate, self.score)
+
+# connects the signal handlers that need the models above
+from human_resources import published_jobs
+from human_resources import search
+from human_resources import job_cache
+from human_resources import scoring
+from human_resources import column_cache
+from human_resources import static_pages
+from human_resources import slug_routes
\ No newline at end of file
@@ -0,0 +1,222 @@
+"""
+Changelist pagination that stays fast on large tables.
+
+Keyset (seek) pagination: instead of ?p=<n>, which has the database read
+and throw away every row before the page, the changelist links carry the
+ordering values of the last (or first) row shown and the next page is
+fetched with a WHERE on them. Every page costs the same however deep it
+is. It applies when the changelist is ordered by local, non-relational
+fields ending with the primary key, which is what the declared orderings
+give (the admin appends -pk itself); sorting by a related column falls
+back to page numbers.
+
+Estimated counts: counting stops at a threshold, above which the count
+shown is the planner's estimate (PostgreSQL and MySQL; other backends
+still count exactly).
+
+"""
+import base64
+import json
+import operator
+import re
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.paginator import Paginator
+from django.db import connections
+from django.db.models import Q
+from django.db.models.fields import FieldDoesNotExist
+from django.db.models.sql.datastructures import EmptyResultSet
+
+AFTER_VAR = 'after'
+BEFORE_VAR = 'before'
+COUNT_THRESHOLD = getattr(settings, 'HR_CHANGELIST_COUNT_THRESHOLD', 10000)
+
+
+def _planner_estimate(queryset):
+	"""Rows the database expects queryset to return, without running it;
+	None where the backend has no cheap estimate"""
+	connection = connections[queryset.db]
+	if connection.vendor not in ('postgresql', 'mysql'):
+		return None
+
+	sql, params = queryset.order_by().values_list('pk').query.sql_with_params()
+	cursor = connection.cursor()
+	cursor.execute('EXPLAIN ' + sql, params)
+
+	if connection.vendor == 'postgresql':
+		match = re.search(r'rows=(\d+)', cursor.fetchone()[0])
+		return int(match.group(1)) if match else None
+
+	columns = [column[0] for column in cursor.description]
+	row = cursor.fetchone()
+	if row is None or 'rows' not in columns:
+		return None
+	return int(row[columns.index('rows')] or 0)
+
+
+def estimated_count(queryset, threshold=COUNT_THRESHOLD):
+	"""Returns (count, exact). At most threshold + 1 rows are counted;
+	above the threshold the planner's estimate is returned instead."""
+	try:
+		sql, params = queryset.order_by().values_list('pk')[:threshold + 1].query.sql_with_params()
+	except EmptyResultSet:
+		return 0, True
+
+	cursor = connections[queryset.db].cursor()
+	cursor.execute('SELECT COUNT(*) FROM (%s) hr_capped' %(sql), params)
+	count = cursor.fetchone()[0]
+	if count <= threshold:
+		return count, True
+
+	estimate = _planner_estimate(queryset)
+	if estimate is None:
+		return queryset.count(), True
+	return max(estimate, count), False
+
+
+class EstimatedCountPaginator(Paginator):
+	"""Page number pagination counting with estimated_count"""
+
+	def __init__(self, object_list, per_page, count_threshold=COUNT_THRESHOLD, **kwargs):
+		super(EstimatedCountPaginator, self).__init__(object_list, per_page, **kwargs)
+		self.count_threshold = count_threshold
+		self.exact = True
+
+	def _get_count(self):
+		if self._count is None:
+			self._count, self.exact = estimated_count(self.object_list, self.count_threshold)
+		return self._count
+	count = property(_get_count)
+
+
+class Keyset(object):
+	"""The ordering of a queryset as (field name, descending, nullable)
+	triples ending with the primary key, and the seek filters for it"""
+
+	def __init__(self, queryset, fields):
+		self.queryset = queryset
+		self.fields = fields
+		# NULLs sort above every value on PostgreSQL and Oracle, below elsewhere
+		self.nulls_high = connections[queryset.db].vendor in ('postgresql', 'oracle')
+
+	@classmethod
+	def for_queryset(cls, queryset):
+		"""A Keyset for the ordering of queryset, or None if it can't be
+		seeked on"""
+
+		query = queryset.query
+		if query.extra_order_by or not query.order_by:
+			return None
+
+		opts = queryset.model._meta
+		fields = []
+		for name in query.order_by:
+			descending = name.startswith('-')
+			name = name.lstrip('-')
+			if name in ('pk', opts.pk.name):
+				fields.append(('pk', descending, False))
+				return cls(queryset, fields)
+			if '__' in name or '.' in name or name == '?':
+				return None
+			try:
+				field = opts.get_field(name)
+			except FieldDoesNotExist:
+				return None
+			if field.rel:
+				return None
+			fields.append((name, descending, field.null))
+
+		# without the primary key the ordering isn't unique
+		return None
+
+	def cursor(self, obj):
+		"""The cursor for the page after (or before) obj"""
+		values = [getattr(obj, name) for name, descending, nullable in self.fields]
+		return base64.urlsafe_b64encode(json.dumps([None if v is None else unicode(v) for v in values]))
+
+	def values(self, cursor):
+		"""The ordering values in cursor; raises ValueError if it isn't
+		one of ours"""
+		try:
+			values = json.loads(base64.urlsafe_b64decode(str(cursor)))
+		except TypeError:
+			raise ValueError("Invalid cursor")
+		if not isinstance(values, list) or len(values) != len(self.fields):
+			raise ValueError("Invalid cursor")
+
+		try:
+			return [
+				None if value is None else self._field(name).to_python(value)
+				for (name, descending, nullable), value in zip(self.fields, values)
+			]
+		except ValidationError:
+			raise ValueError("Invalid cursor")
+
+	def _field(self, name):
+		opts = self.queryset.model._meta
+		if name != 'pk':
+			return opts.get_field(name)
+		# a one to one primary key converts like the key it points to
+		field = opts.pk
+		while field.rel:
+			field = field.rel.get_related_field()
+		return field
+
+	def _beyond(self, name, nullable, value, greater):
+		"""Q for the rows whose name sorts strictly above (greater) or below
+		value, with NULLs where the database puts them; None if none can"""
+		if value is None:
+			if greater == self.nulls_high:
+				return None
+			return Q(**{name + '__isnull': False})
+
+		q = Q(**{'%s__%s' %(name, 'gt' if greater else 'lt'): value})
+		if nullable and greater == self.nulls_high:
+			q = q | Q(**{name + '__isnull': True})
+		return q
+
+	def seek(self, values, forward=True):
+		"""The queryset filtered to the rows after (or, not forward, before)
+		the row with these ordering values"""
+
+		clauses = []
+		equal = []
+		for (name, descending, nullable), value in zip(self.fields, values):
+			# going forward through a descending column means smaller values
+			beyond = self._beyond(name, nullable, value, greater=(descending != forward))
+			if beyond is not None:
+				clauses.append(reduce(operator.and_, equal + [beyond]))
+			equal.append(Q(**{name + '__isnull': True}) if value is None else Q(**{name: value}))
+
+		if not clauses:
+			return self.queryset.none()
+		queryset = self.queryset.filter(reduce(operator.or_, clauses))
+
+		name, descending, nullable = self.fields[0]
+		if not nullable:
+			# redundant bound on the leading column, so the database range
+			# scans its index instead of testing the OR on every row
+			lookup = 'gte' if descending != forward else 'lte'
+			queryset = queryset.filter(**{'%s__%s' %(name, lookup): values[0]})
+		return queryset
+
+	def page(self, per_page, after=None, before=None):
+		"""Returns (objects, has_previous, has_next) for the page after the
+		cursor after, before the cursor before, or the first page"""
+
+		if before is not None:
+			rows = list(self.seek(self.values(before), forward=False).reverse()[:per_page + 1])
+			if len(rows) <= per_page:
+				# back at the start
+				return self.page(per_page)
+			rows = rows[:per_page]
+			rows.reverse()
+			return rows, True, True
+
+		if after is None:
+			queryset = self.queryset
+		else:
+			queryset = self.seek(self.values(after))
+		rows = list(queryset[:per_page + 1])
+		return rows[:per_page], after is not None, len(rows) > per_page
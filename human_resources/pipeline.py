@@ -0,0 +1,191 @@
+"""
+Set-based changes to the hiring pipeline.
+
+These run as a handful of UPDATE statements and bulk inserts inside one
+transaction and, once it is committed, send one aggregated signal (see
+human_resources.signals), never a post_save per object, so they stay
+cheap on jobs with tens of thousands of evaluations.
+
+"""
+import datetime
+
+from human_resources.models import Candidacy, Evaluation, Interview, \
+JobOpportunity, Person, PersonNote
+from human_resources.signals import evaluations_closed
+from human_resources.search import index_objects
+from human_resources.column_cache import bump
+from human_resources.scheduling import Booking, schedule_for
+from human_resources.transactions import commit_on_success, on_commit
+
+UPDATE_BATCH_SIZE = 1000
+
+IN_CONSIDERATION = Evaluation.EVALUATION_STATUS_CHOICES[0][0]
+CANDIDACY_CLOSED = Evaluation.EVALUATION_STATUS_CHOICES[1][0]
+# job opportunity statuses that end every candidacy for the job
+FINISHED_JOB_STATUSES = (JobOpportunity.POSITION_STATUS[1][0], JobOpportunity.POSITION_STATUS[2][0])
+
+
+def _batches(ids, size=UPDATE_BATCH_SIZE):
+	for i in range(0, len(ids), size):
+		yield ids[i:i + size]
+
+
+@commit_on_success
+def close_evaluations(evaluations, sender=None):
+	"""Move every open evaluation of the given queryset to "Candidacy
+	closed" with batched UPDATEs. Returns the number closed."""
+	rows = list(evaluations.filter(status=IN_CONSIDERATION).values_list('pk', 'candidacy__job_opportunity'))
+	if not rows:
+		return 0
+
+	evaluation_ids = [pk for pk, job_id in rows]
+	now = datetime.datetime.now()
+	for batch in _batches(evaluation_ids):
+		# update() skips auto_now, so keep date_modified honest by hand
+		Evaluation.objects.filter(pk__in=batch, status=IN_CONSIDERATION).update(status=CANDIDACY_CLOSED, date_modified=now)
+
+	on_commit(lambda: evaluations_closed.send(
+		sender=sender or Evaluation,
+		evaluation_ids=evaluation_ids,
+		job_opportunity_ids=sorted(set(job_id for pk, job_id in rows)),
+	))
+	return len(evaluation_ids)
+
+
+def close_evaluations_for_jobs(job_opportunities, sender=None):
+	"""Close the evaluations of those of the given jobs that are filled or
+	closed"""
+	job_ids = job_opportunities.filter(status__in=FINISHED_JOB_STATUSES).values('pk')
+	return close_evaluations(Evaluation.objects.filter(candidacy__job_opportunity__in=job_ids), sender=sender)
+
+
+class PipelineSummary(object):
+	def __init__(self):
+		self.evaluations = 0
+		self.candidacies = 0
+		self.evaluations_updated = 0
+		self.candidacies_ranked = 0
+		self.interviews_created = 0
+		self.interview_conflicts = 0
+		self.notes_created = 0
+
+	def summary(self):
+		changes = [
+			"%s evaluation(s) changed status" %(self.evaluations_updated),
+			"%s candidacy(ies) re-ranked" %(self.candidacies_ranked),
+			"%s interview(s) scheduled%s" %(self.interviews_created,
+				self.interview_conflicts and " (%s overlapping other interviews of the candidate)" %(self.interview_conflicts) or ""),
+			"%s note(s) added" %(self.notes_created),
+		]
+		return "%s evaluation(s) of %s candidacy(ies): %s" %(self.evaluations, self.candidacies, ", ".join(changes))
+
+
+def _bulk_create_fetch(model, objects, field_name, ids, **values):
+	"""bulk_create objects and return them as saved rows. Django does not
+	set their pks, so the rows pointing at ids through field_name are read
+	back from above the previous last pk, matching the field values all of
+	them share; rows other transactions committed meanwhile would have to
+	match those too."""
+	last_pk = model.objects.order_by('-pk').values_list('pk', flat=True)[:1]
+	last_pk = last_pk[0] if last_pk else 0
+	for batch in _batches(objects):
+		model.objects.bulk_create(batch)
+
+	created = []
+	for batch in _batches(ids):
+		created.extend(model.objects.filter(pk__gt=last_pk, **dict(values, **{field_name + '__in': batch})))
+	return created
+
+
+@commit_on_success
+def change_stage(evaluations=None, candidacies=None, status=None, rank=None, interview_type=None,
+		interview_date=None, interview_notes='', note=None, author=None, sender=None):
+	"""
+	Apply one pipeline step to a queryset of evaluations (and their
+	candidacies) or of candidacies (and all their evaluations), in one
+	transaction:
+
+	status		the new status of the evaluations
+	rank		the new rank of the candidacies
+	interview_type, interview_date, interview_notes
+				an Interview to add to every evaluation
+	note, author	a PersonNote to add to every candidate
+
+	Returns a PipelineSummary.
+
+	"""
+	if note and author is None:
+		raise ValueError("Notes need an author")
+
+	summary = PipelineSummary()
+	now = datetime.datetime.now()
+
+	if evaluations is not None:
+		rows = list(evaluations.values_list('pk', 'candidacy__job_opportunity', 'candidacy', 'candidacy__person'))
+		evaluation_rows = [(pk, job_id) for pk, job_id, candidacy_id, person_id in rows]
+		evaluation_people = dict((pk, person_id) for pk, job_id, candidacy_id, person_id in rows)
+		candidacy_rows = sorted(set((candidacy_id, person_id) for pk, job_id, candidacy_id, person_id in rows))
+	else:
+		candidacy_rows = sorted(set(candidacies.values_list('pk', 'person')))
+		evaluation_rows = []
+		evaluation_people = {}
+		for batch in _batches([pk for pk, person_id in candidacy_rows]):
+			for pk, job_id, person_id in Evaluation.objects.filter(candidacy__in=batch).values_list('pk', 'candidacy__job_opportunity', 'candidacy__person'):
+				evaluation_rows.append((pk, job_id))
+				evaluation_people[pk] = person_id
+
+	evaluation_ids = [pk for pk, job_id in evaluation_rows]
+	candidacy_ids = [pk for pk, person_id in candidacy_rows]
+	person_ids = sorted(set(person_id for pk, person_id in candidacy_rows))
+	summary.evaluations = len(evaluation_ids)
+	summary.candidacies = len(candidacy_ids)
+
+	if status is not None:
+		changed = []
+		for batch in _batches(evaluation_ids):
+			batch_rows = list(Evaluation.objects.filter(pk__in=batch).exclude(status=status).values_list('pk', 'candidacy__job_opportunity'))
+			# update() skips auto_now, so keep date_modified honest by hand
+			Evaluation.objects.filter(pk__in=[pk for pk, job_id in batch_rows]).update(status=status, date_modified=now)
+			changed.extend(batch_rows)
+		summary.evaluations_updated = len(changed)
+
+		if status == CANDIDACY_CLOSED and changed:
+			on_commit(lambda: evaluations_closed.send(
+				sender=sender or Evaluation,
+				evaluation_ids=[pk for pk, job_id in changed],
+				job_opportunity_ids=sorted(set(job_id for pk, job_id in changed)),
+			))
+
+	if rank is not None:
+		for batch in _batches(candidacy_ids):
+			summary.candidacies_ranked += Candidacy.objects.filter(pk__in=batch).exclude(rank=rank).update(rank=rank, date_modified=now)
+
+	if interview_type is not None:
+		interviews = [
+			Interview(evaluation_id=pk, interview_type=interview_type, date=interview_date or now, notes=interview_notes)
+			for pk in evaluation_ids
+		]
+		if interviews:
+			# booked anyway, but reported: one schedule load for all of them
+			schedule = schedule_for([Booking(interview_date or now, interviews[0].duration)])
+			for interview in interviews:
+				if schedule.book(Booking(interview.date, interview.duration, person=evaluation_people[interview.evaluation_id])):
+					summary.interview_conflicts += 1
+		if interview_notes:
+			index_objects(Interview, _bulk_create_fetch(Interview, interviews, 'evaluation', evaluation_ids,
+				interview_type=interview_type, date=interview_date or now, notes=interview_notes))
+		else:
+			for batch in _batches(interviews):
+				Interview.objects.bulk_create(batch)
+		summary.interviews_created = len(interviews)
+
+	if note:
+		notes = [PersonNote(author=author, person_id=person_id, date_and_time=now, note=note) for person_id in person_ids]
+		# bulk_create sends no post_save, so index the notes and drop the
+		# people's cached latest note column here
+		index_objects(PersonNote, _bulk_create_fetch(PersonNote, notes, 'person', person_ids,
+			author=author, date_and_time=now, note=note))
+		on_commit(lambda: bump(Person, person_ids))
+		summary.notes_created = len(notes)
+
+	return summary
@@ -0,0 +1,100 @@
+"""
+Read-only JSON API over the published jobs.
+
+	api/jobs/          published jobs, newest first, ?after=<next> for more
+	api/jobs/<slug>/   a single published job
+
+Both answer conditional requests before doing any real work: the ETag
+and Last-Modified come from a single aggregate over
+PublishedJob.date_refreshed, which is stamped every time a row is rebuilt
+because something it shows changed. The list ETag also includes the
+number of published jobs, so an unpublished job changes it. Clients
+should send If-None-Match; If-Modified-Since alone can't see removals.
+
+"""
+import hashlib
+import json
+import urllib
+
+from django.conf import settings
+from django.db.models import Count, Max
+from django.http import HttpResponse, HttpResponseBadRequest, Http404
+from django.views.decorators.http import condition, require_safe
+
+from human_resources.models import PublishedJob
+from human_resources.pagination import Keyset, AFTER_VAR
+from human_resources.routers import replica_reads
+
+API_PAGE_SIZE = getattr(settings, 'HR_JOBS_API_PAGE_SIZE', 50)
+
+
+def _validators(request, slug=None):
+	"""(etag, last modified) of the list or of one job, computed once per
+	request"""
+	if not hasattr(request, '_hr_job_validators'):
+		if slug is None:
+			state = PublishedJob.objects.aggregate(last_refreshed=Max('date_refreshed'), count=Count('pk'))
+			last_refreshed, key = state['last_refreshed'], '%s:%s' %(state['last_refreshed'], state['count'])
+		else:
+			last_refreshed = PublishedJob.objects.filter(slug=slug).values_list('date_refreshed', flat=True)[:1]
+			last_refreshed = last_refreshed[0] if last_refreshed else None
+			key = '%s:%s' %(slug, last_refreshed)
+
+		etag = hashlib.md5(key.encode('utf-8')).hexdigest() if last_refreshed is not None else None
+		request._hr_job_validators = (etag, last_refreshed)
+	return request._hr_job_validators
+
+
+def _etag(request, slug=None):
+	return _validators(request, slug)[0]
+
+
+def _last_modified(request, slug=None):
+	return _validators(request, slug)[1]
+
+
+def job_data(job):
+	return {
+		'id': job.pk,
+		'slug': job.slug,
+		'url': job.get_absolute_url(),
+		'position': job.position_name,
+		'description': job.public_description,
+		'location': job.location,
+		'pay': job.pay,
+		'contract_types': job.contract_type_list(),
+		'benefits': job.benefit_list(),
+		'qualifications': job.qualification_list(),
+		'nice_to_haves': job.nice_to_have_list(),
+		'date_modified': job.job_date_modified.isoformat(),
+	}
+
+
+def _json_response(data):
+	return HttpResponse(json.dumps(data), content_type='application/json')
+
+
+@replica_reads()
+@require_safe
+@condition(etag_func=_etag, last_modified_func=_last_modified)
+def job_list(request):
+	keyset = Keyset.for_queryset(PublishedJob.objects.order_by('-job_date_modified', '-pk'))
+	try:
+		jobs, has_previous, has_next = keyset.page(API_PAGE_SIZE, after=request.GET.get(AFTER_VAR))
+	except ValueError:
+		return HttpResponseBadRequest('Invalid cursor')
+
+	return _json_response({
+		'results': [job_data(job) for job in jobs],
+		'next': has_next and request.build_absolute_uri('?' + urllib.urlencode({AFTER_VAR: keyset.cursor(jobs[-1])})) or None,
+	})
+
+
+@replica_reads()
+@require_safe
+@condition(etag_func=_etag, last_modified_func=_last_modified)
+def job_detail(request, slug):
+	job = PublishedJob.objects.filter(slug=slug)[:1]
+	if not job:
+		raise Http404
+	return _json_response(job_data(job[0]))
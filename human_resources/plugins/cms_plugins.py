@@ -1,10 +1,14 @@
 from django.utils.translation import ugettext_lazy as _
+from django.template.loader import render_to_string
+from django.utils.safestring import mark_safe
 
 from cms.plugin_base import CMSPluginBase
 from cms.plugin_pool import plugin_pool
 from cms.models import CMSPlugin
 
-from human_resources.models import JobOpportunity
+from human_resources.models import PublishedJob
+from human_resources.job_cache import get_or_render, published_jobs_key
+from human_resources.instrumentation import instrumented
 
 class JobOpportunityPlugin(CMSPluginBase):
 	module = _('Human Resources')
@@ -14,13 +18,16 @@ class JobOpportunityPlugin(CMSPluginBase):
 	#text_enabled = True
 	admin_preview = False
 	
+	@instrumented('JobOpportunityPlugin.render')
 	def render(self, context, instance, placeholder):
 		request = context["request"]
 		
-		jobs = JobOpportunity.objects.filter(published_status=2)
+		def render_jobs():
+			jobs = PublishedJob.objects.all()
+			return render_to_string('human_resources/cms/published_jobs_list.html', {"jobs": jobs})
 		
 		context.update({
-			"jobs": jobs,
+			"published_jobs_html": mark_safe(get_or_render(published_jobs_key(), render_jobs)),
 		})
 		
 		return context
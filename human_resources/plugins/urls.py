@@ -1,5 +1,10 @@
 from django.conf.urls.defaults import *
 
-urlpatterns = patterns('human_resources.plugins.views',
+urlpatterns = patterns('human_resources.plugins.api',
+	url(r'^api/jobs/$', 'job_list', name="job_api_list"),
+	url(r'^api/jobs/(?P<slug>[-\w]+)/$', 'job_detail', name="job_api_detail"),
+)
+
+urlpatterns += patterns('human_resources.plugins.views',
 	url(r'^(?P<slug>[-\w]+)/', 'job_opportunity', name="job_page"),	
 )
\ No newline at end of file
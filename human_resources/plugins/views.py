@@ -1,24 +1,38 @@
-from django.http import HttpResponse
+from django.http import HttpResponse, HttpResponsePermanentRedirect, Http404
 from django.shortcuts import render_to_response
 from django.template import RequestContext
+from django.template.loader import render_to_string
 from django.shortcuts import get_object_or_404
+from django.utils.safestring import mark_safe
 
-from human_resources.models import JobOpportunity
+from human_resources.models import PublishedJob
+from human_resources.job_cache import get_or_render, job_page_key
+from human_resources.instrumentation import instrumented
+from human_resources.slug_routes import routes
+from human_resources.routers import replica_reads
 
+@instrumented('job_opportunity')
+@replica_reads()
 def job_opportunity(request, slug):
-	job = get_object_or_404(
-		JobOpportunity,
-		slug=slug,
-		published_status=JobOpportunity.OPPORTUNITY_STATUS_CHOICES[1][0]
-	)
+	route = routes.resolve(slug)
+	if route is None:
+		raise Http404
+	job_id, current_slug = route
+	if current_slug != slug:
+		return HttpResponsePermanentRedirect(PublishedJob(slug=current_slug).get_absolute_url())
+	
+	def render_job():
+		job = get_object_or_404(PublishedJob, pk=job_id)
+		
+		other_jobs = PublishedJob.objects.exclude(pk=job_id)
+		context = {
+			"job": job,
+			"other_jobs": other_jobs,
+		}
+		return render_to_string("human_resources/job_detail.html", context)
 	
-	other_jobs = JobOpportunity.objects.filter(published_status=JobOpportunity.OPPORTUNITY_STATUS_CHOICES[1][0]).exclude(slug=slug)
-	context = {
-		"job": job,
-		"other_jobs": other_jobs,
-	}
 	return render_to_response(
 		"human_resources/job_page.html",
-		context,
+		{"job_html": mark_safe(get_or_render(job_page_key(slug), render_job))},
 		context_instance=RequestContext(request)
 	)
\ No newline at end of file
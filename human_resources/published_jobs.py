@@ -0,0 +1,167 @@
+"""
+Maintains the PublishedJob read model.
+
+Whenever a job opportunity or anything it shows publicly changes, the
+affected jobs are re-serialized into PublishedJob rows (or removed from
+it if they are no longer published). The public pages only read those rows.
+
+"""
+import json
+
+from django.db.models.signals import post_save, pre_delete, post_delete, m2m_changed
+
+from human_resources.models import JobOpportunity, Position, Qualification, \
+NiceToHave, ContractType, Benefit, PublishedJob
+from human_resources.job_cache import bump_generation
+from human_resources.signals import published_jobs_changed
+from human_resources.transactions import commit_on_success, on_commit
+
+PUBLISHED = JobOpportunity.OPPORTUNITY_STATUS_CHOICES[1][0]
+REBUILD_CHUNK_SIZE = 500
+
+
+def _published_jobs(job_ids=None):
+	jobs = JobOpportunity.objects.filter(published_status=PUBLISHED)
+	if job_ids is not None:
+		jobs = jobs.filter(pk__in=job_ids)
+	return jobs.select_related('position').prefetch_related(
+		'contract_types',
+		'benefits',
+		'position__qualifications',
+		'position__nice_to_haves',
+	)
+
+
+def serialize_job(job):
+	"""Build the (unsaved) PublishedJob row for a published job, reading
+	only from what _published_jobs prefetched"""
+	return PublishedJob(
+		job_id=job.pk,
+		slug=job.slug,
+		position_name=job.position.name,
+		public_description=job.position.public_description,
+		location=job.location,
+		pay=job.pay,
+		contract_types=json.dumps([c.name for c in job.contract_types.all()]),
+		benefits=json.dumps([b.name for b in job.benefits.all()]),
+		qualifications=json.dumps([q.description for q in job.position.qualifications.all()]),
+		nice_to_haves=json.dumps([n.description for n in job.position.nice_to_haves.all()]),
+		job_date_modified=job.date_modified,
+	)
+
+
+def _row_values(row):
+	return dict((f.attname, getattr(row, f.attname)) for f in PublishedJob._meta.fields if f.attname != 'date_refreshed')
+
+
+@commit_on_success
+def refresh_published_jobs(job_ids):
+	"""Re-serialize the given jobs, dropping any that are not published"""
+	job_ids = set(job_ids)
+	if not job_ids:
+		return
+
+	old_slugs = set(PublishedJob.objects.filter(pk__in=job_ids).values_list('slug', flat=True))
+	rows = [serialize_job(job) for job in _published_jobs(job_ids)]
+	PublishedJob.objects.filter(pk__in=job_ids).delete()
+	PublishedJob.objects.bulk_create(rows)
+
+	slugs = set(row.slug for row in rows)
+
+	def committed():
+		# only now can a page render see the new rows; anything cached
+		# from the old ones meanwhile goes with the generation
+		bump_generation()
+		published_jobs_changed.send(sender=PublishedJob, slugs=slugs, removed_slugs=old_slugs - slugs)
+	on_commit(committed)
+
+
+def rebuild_published_jobs():
+	"""Rebuild the whole read model, a chunk of jobs at a time. Returns the
+	number of published jobs."""
+	job_ids = list(JobOpportunity.objects.values_list('pk', flat=True))
+	PublishedJob.objects.exclude(pk__in=job_ids).delete()
+
+	for i in range(0, len(job_ids), REBUILD_CHUNK_SIZE):
+		refresh_published_jobs(job_ids[i:i + REBUILD_CHUNK_SIZE])
+
+	return PublishedJob.objects.count()
+
+
+def check_published_jobs():
+	"""Compare the read model with what a rebuild would produce. Returns
+	a list of (job id, problem) tuples, empty when consistent."""
+	problems = []
+	stored = dict((row.pk, row) for row in PublishedJob.objects.all())
+
+	for job in _published_jobs():
+		row = stored.pop(job.pk, None)
+		if row is None:
+			problems.append((job.pk, 'missing'))
+			continue
+		expected = _row_values(serialize_job(job))
+		actual = _row_values(row)
+		for field_name in sorted(expected):
+			if expected[field_name] != actual[field_name]:
+				problems.append((job.pk, 'stale %s' %(field_name)))
+
+	for job_id in sorted(stored):
+		problems.append((job_id, 'not published'))
+
+	return problems
+
+
+def job_saved(sender, instance, **kwargs):
+	refresh_published_jobs([instance.pk])
+
+def position_data_saved(sender, instance, **kwargs):
+	if isinstance(instance, Position):
+		position_id = instance.pk
+	else:
+		position_id = instance.position_id
+	refresh_published_jobs(JobOpportunity.objects.filter(position=position_id).values_list('pk', flat=True))
+
+def _deal_data_job_ids(instance):
+	if isinstance(instance, ContractType):
+		jobs = JobOpportunity.objects.filter(contract_types=instance)
+	else:
+		jobs = JobOpportunity.objects.filter(benefits=instance)
+	return list(jobs.values_list('pk', flat=True))
+
+def deal_data_saved(sender, instance, **kwargs):
+	refresh_published_jobs(_deal_data_job_ids(instance))
+
+def deal_data_deleting(sender, instance, **kwargs):
+	# the M2M rows are gone by post_delete, so remember the jobs now
+	instance._published_job_ids = _deal_data_job_ids(instance)
+
+def deal_data_deleted(sender, instance, **kwargs):
+	refresh_published_jobs(getattr(instance, '_published_job_ids', []))
+
+def deal_data_changed(sender, instance, action, reverse, pk_set, **kwargs):
+	if not reverse:
+		if action.startswith('post_'):
+			refresh_published_jobs([instance.pk])
+	elif action in ('post_add', 'post_remove'):
+		refresh_published_jobs(pk_set)
+	elif action == 'pre_clear':
+		deal_data_deleting(sender, instance)
+	elif action == 'post_clear':
+		deal_data_deleted(sender, instance)
+
+
+post_save.connect(job_saved, sender=JobOpportunity, dispatch_uid='hr_published_jobs_job_save')
+post_delete.connect(job_saved, sender=JobOpportunity, dispatch_uid='hr_published_jobs_job_delete')
+
+for model in (Position, Qualification, NiceToHave):
+	post_save.connect(position_data_saved, sender=model, dispatch_uid='hr_published_jobs_save_%s' % model.__name__)
+	post_delete.connect(position_data_saved, sender=model, dispatch_uid='hr_published_jobs_delete_%s' % model.__name__)
+
+for model in (ContractType, Benefit):
+	post_save.connect(deal_data_saved, sender=model, dispatch_uid='hr_published_jobs_save_%s' % model.__name__)
+	pre_delete.connect(deal_data_deleting, sender=model, dispatch_uid='hr_published_jobs_pre_delete_%s' % model.__name__)
+	post_delete.connect(deal_data_deleted, sender=model, dispatch_uid='hr_published_jobs_delete_%s' % model.__name__)
+
+for field_name in ('benefits', 'contract_types'):
+	through = JobOpportunity._meta.get_field(field_name).rel.through
+	m2m_changed.connect(deal_data_changed, sender=through, dispatch_uid='hr_published_jobs_m2m_%s' % field_name)
@@ -0,0 +1,102 @@
+"""
+EXPLAIN checks for the hot lookups.
+
+Each entry of HOT_QUERIES builds the queryset behind one hot access path
+together with the table it must reach through an index. explain_query runs
+the backend's EXPLAIN on it and reports whether that table is read with a
+sequential scan. On PostgreSQL sequential scans are disabled while
+explaining, so a small or unanalyzed database still shows whether a usable
+index exists at all.
+
+The composite indexes themselves are created from human_resources/sql/
+by syncdb; on an existing database apply them with
+	manage.py sqlcustom human_resources | manage.py dbshell
+Databases indexed before keyset pagination also have
+human_resources_evaluation_status_modified, on (status, date_modified).
+human_resources_evaluation_status_modified_id serves everything it did,
+so drop it.
+
+"""
+import datetime
+import re
+
+from django.db import connection
+
+from human_resources.models import Evaluation, JobOpportunity, Person, \
+PersonNote, PublishedJob, Interview
+from human_resources.pagination import Keyset
+
+PUBLISHED = JobOpportunity.OPPORTUNITY_STATUS_CHOICES[1][0]
+
+HOT_QUERIES = (
+	('published job by slug',
+		lambda: JobOpportunity.objects.filter(published_status=PUBLISHED, slug='a-job'), JobOpportunity),
+	('published job page',
+		lambda: PublishedJob.objects.filter(slug='a-job'), PublishedJob),
+	('evaluations in consideration',
+		lambda: Evaluation.objects.filter(status=1).order_by('-date_modified')[:100], Evaluation),
+	('people by status',
+		lambda: Person.objects.filter(status=1).order_by('-last_name')[:100], Person),
+	('people page after a cursor',
+		lambda: Keyset.for_queryset(Person.objects.order_by('-last_name', '-pk')).seek([u'M', 1000])[:101], Person),
+	('latest note of a person',
+		lambda: PersonNote.objects.filter(person=1).order_by('-date_and_time')[:1], PersonNote),
+	('person timeline notes after a cursor',
+		lambda: Keyset.for_queryset(PersonNote.objects.filter(person=1).order_by('-date_and_time', '-pk')).seek([datetime.datetime(2012, 1, 1), 1000])[:26], PersonNote),
+	('person timeline interviews',
+		lambda: Interview.objects.filter(evaluation__in=[1, 2, 3]).order_by('-date', '-pk')[:26], Interview),
+	('interviews of a day',
+		lambda: Interview.objects.filter(date__gte=datetime.datetime(2012, 1, 1), date__lt=datetime.datetime(2012, 1, 2)), Interview),
+)
+
+
+def _vendor():
+	return connection.vendor
+
+
+def _explain_sql(sql):
+	vendor = _vendor()
+	if vendor == 'sqlite':
+		return 'EXPLAIN QUERY PLAN ' + sql
+	return 'EXPLAIN ' + sql
+
+
+def _is_sequential_scan(plan_lines, table):
+	vendor = _vendor()
+	if vendor == 'postgresql':
+		return any(re.search(r'Seq Scan on "?%s"?\b' %(table), line) for line in plan_lines)
+	if vendor == 'sqlite':
+		# "SCAN TABLE t" (older) / "SCAN t" (newer) without an index
+		pattern = re.compile(r'\bSCAN (TABLE )?"?%s"?\b' %(table))
+		return any(pattern.search(line) and 'INDEX' not in line for line in plan_lines)
+	if vendor == 'mysql':
+		# the table column, then the access type column saying ALL
+		return any(re.search(r'\b%s ALL\b' %(table), line) for line in plan_lines)
+	return False
+
+
+def explain_query(queryset, model):
+	"""Returns (plan lines, whether model's table is scanned sequentially)"""
+	sql, params = queryset.query.sql_with_params()
+	cursor = connection.cursor()
+
+	if _vendor() == 'postgresql':
+		cursor.execute('SET enable_seqscan = off')
+	try:
+		cursor.execute(_explain_sql(sql), params)
+		plan_lines = [' '.join(unicode(column) for column in row) for row in cursor.fetchall()]
+	finally:
+		if _vendor() == 'postgresql':
+			cursor.execute('SET enable_seqscan = on')
+
+	return plan_lines, _is_sequential_scan(plan_lines, model._meta.db_table)
+
+
+def check_query_plans():
+	"""Explain every hot query. Returns a list of (name, plan lines,
+	sequential scan) tuples."""
+	results = []
+	for name, build_queryset, model in HOT_QUERIES:
+		plan_lines, sequential = explain_query(build_queryset(), model)
+		results.append((name, plan_lines, sequential))
+	return results
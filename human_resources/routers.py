@@ -0,0 +1,256 @@
+"""
+Read replicas for the human_resources models.
+
+	DATABASE_ROUTERS = ['human_resources.routers.ReplicaRouter']
+	MIDDLEWARE_CLASSES += ('human_resources.routers.ReplicaMiddleware',)
+	HR_REPLICA_DATABASES = ['replica']
+
+Writes always go to the primary (HR_PRIMARY_DATABASE, 'default'). Reads
+go to a replica only inside replica_reads(). That covers the public job
+pages, the jobs API, the GET views of the HR changelists, the person
+timeline and the exports. Everything else reads from the primary as
+before. Anything cached for everyone (the job page fragments shown by
+the pages and the published jobs plugin, the slug routing table) is built
+inside primary_reads(), so a lagging replica never ends up in a shared
+cache.
+
+Read-your-writes: a write pins the thread to the primary for
+HR_REPLICA_STICKY_SECONDS. The middleware carries the pin over to the
+user's next requests in a cookie, whichever process serves them.
+
+Lag: each process checks a replica's lag at most every
+HR_REPLICA_LAG_CHECK_INTERVAL seconds. A replica further behind than
+HR_REPLICA_MAX_LAG seconds, or one that can't be asked, is skipped until
+the next check. With no replica left, reads fall back to the primary.
+
+To try it locally, add a second alias pointing at the same SQLite file
+or PostgreSQL database and list it in HR_REPLICA_DATABASES; its lag is
+always 0. Give it TEST_MIRROR = 'default' for the test runner.
+
+"""
+import logging
+import random
+import threading
+import time
+from functools import wraps
+
+from django.conf import settings
+from django.db import connections
+
+PRIMARY_DATABASE = getattr(settings, 'HR_PRIMARY_DATABASE', 'default')
+REPLICA_DATABASES = list(getattr(settings, 'HR_REPLICA_DATABASES', []))
+STICKY_SECONDS = getattr(settings, 'HR_REPLICA_STICKY_SECONDS', 10)
+MAX_LAG = getattr(settings, 'HR_REPLICA_MAX_LAG', 30)
+LAG_CHECK_INTERVAL = getattr(settings, 'HR_REPLICA_LAG_CHECK_INTERVAL', 5)
+
+STICKY_COOKIE = 'hr_primary_until'
+APP_LABEL = 'human_resources'
+
+logger = logging.getLogger('human_resources.routers')
+
+_state = threading.local()
+
+
+def replica_lag(alias):
+	"""Seconds the database behind alias is behind its primary; 0 where
+	it isn't a replica"""
+	connection = connections[alias]
+	cursor = connection.cursor()
+
+	if connection.vendor == 'postgresql':
+		# PostgreSQL 10 renamed the xlog functions to wal
+		if getattr(connection, 'pg_version', 0) >= 100000:
+			receive, replay = 'pg_last_wal_receive_lsn', 'pg_last_wal_replay_lsn'
+		else:
+			receive, replay = 'pg_last_xlog_receive_location', 'pg_last_xlog_replay_location'
+		# nothing left to replay means caught up, however old the last
+		# replayed transaction is; NULL on a primary
+		cursor.execute(
+			"SELECT CASE WHEN %s() = %s() THEN 0 "
+			"ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()) END" %(receive, replay)
+		)
+		return float(cursor.fetchone()[0] or 0)
+
+	if connection.vendor == 'mysql':
+		cursor.execute('SHOW SLAVE STATUS')
+		row = cursor.fetchone()
+		if row is None:
+			return 0.0
+		lag = row[[column[0] for column in cursor.description].index('Seconds_Behind_Master')]
+		# NULL when replication is stopped
+		return float('inf') if lag is None else float(lag)
+
+	return 0.0
+
+
+class ReplicaHealth(object):
+	"""Per process, rate limited lag checks"""
+
+	def __init__(self):
+		self.lock = threading.Lock()
+		# alias -> (time checked, usable)
+		self.checked = {}
+
+	def _check(self, alias):
+		try:
+			lag = replica_lag(alias)
+		except Exception:
+			logger.exception("Checking the lag of database %s failed, reading from %s", alias, PRIMARY_DATABASE)
+			return False
+		if lag > MAX_LAG:
+			logger.warning("Database %s is %.1fs behind, reading from %s", alias, lag, PRIMARY_DATABASE)
+			return False
+		return True
+
+	def usable(self, alias):
+		checked = self.checked.get(alias)
+		if checked is None or time.time() - checked[0] >= LAG_CHECK_INTERVAL:
+			with self.lock:
+				checked = self.checked.get(alias)
+				if checked is None or time.time() - checked[0] >= LAG_CHECK_INTERVAL:
+					checked = self.checked[alias] = (time.time(), self._check(alias))
+		return checked[1]
+
+health = ReplicaHealth()
+
+
+def pin(seconds=STICKY_SECONDS):
+	"""Read from the primary for the next seconds"""
+	_state.pinned_until = max(getattr(_state, 'pinned_until', 0), time.time() + seconds)
+	_state.wrote = True
+
+
+def pinned():
+	return getattr(_state, 'pinned_until', 0) > time.time()
+
+
+class _ReadsFrom(object):
+	"""Context manager and decorator; template responses returned by a
+	decorated view are rendered inside it too"""
+
+	name = None
+
+	def __enter__(self):
+		setattr(_state, self.name, getattr(_state, self.name, 0) + 1)
+
+	def __exit__(self, *exc_info):
+		setattr(_state, self.name, getattr(_state, self.name) - 1)
+
+	def __call__(self, func):
+		@wraps(func)
+		def wrapper(*args, **kwargs):
+			with self:
+				response = func(*args, **kwargs)
+				if hasattr(response, 'render') and not getattr(response, 'is_rendered', True):
+					response.render()
+				return response
+		return wrapper
+
+
+class replica_reads(_ReadsFrom):
+	"""human_resources reads inside go to a replica, unless pinned. One
+	replica serves everything inside, so the reads agree with each other."""
+	name = 'replica_reads'
+
+	def __enter__(self):
+		if not getattr(_state, self.name, 0):
+			_state.replica = choose_replica()
+		super(replica_reads, self).__enter__()
+
+
+class primary_reads(_ReadsFrom):
+	"""human_resources reads inside go to the primary, even inside
+	replica_reads"""
+	name = 'primary_reads'
+
+
+def choose_replica():
+	"""A replica that isn't lagging too far behind, or None"""
+	usable = [alias for alias in REPLICA_DATABASES if health.usable(alias)]
+	return random.choice(usable) if usable else None
+
+
+def read_database():
+	"""The alias a human_resources read would use here and now"""
+	if not getattr(_state, 'replica_reads', 0) or getattr(_state, 'primary_reads', 0) or pinned():
+		return PRIMARY_DATABASE
+	return getattr(_state, 'replica', None) or PRIMARY_DATABASE
+
+
+def reporting_database():
+	"""The alias for a report that reads outside the current view, e.g. a
+	streamed export"""
+	with replica_reads():
+		return read_database()
+
+
+class ReplicaRouter(object):
+
+	def db_for_read(self, model, **hints):
+		if model._meta.app_label != APP_LABEL:
+			return None
+		instance = hints.get('instance')
+		if instance is not None and instance._state.db in REPLICA_DATABASES \
+		and not getattr(_state, 'primary_reads', 0) and not pinned():
+			# related rows of a row read from a replica, e.g. while an
+			# export streams, come from the same replica
+			return instance._state.db
+		return read_database()
+
+	def db_for_write(self, model, **hints):
+		if model._meta.app_label != APP_LABEL:
+			return None
+		pin()
+		return PRIMARY_DATABASE
+
+	def allow_relation(self, obj1, obj2, **hints):
+		# the replicas hold the same rows as the primary
+		databases = [PRIMARY_DATABASE] + REPLICA_DATABASES
+		if obj1._state.db in databases and obj2._state.db in databases:
+			return True
+		return None
+
+	def allow_syncdb(self, db, model):
+		# replicas get their tables through replication
+		if db in REPLICA_DATABASES:
+			return False
+		return None
+
+
+class ReplicaMiddleware(object):
+	"""Keeps a user who just wrote reading from the primary on their next
+	requests too. A request handled inside another one, e.g. through the
+	test client, starts from the outer request's pin and hands its own back
+	when it's done; a pin is never lowered."""
+
+	def process_request(self, request):
+		try:
+			pinned_until = float(request.COOKIES.get(STICKY_COOKIE, 0))
+		except ValueError:
+			pinned_until = 0
+		depth = getattr(_state, 'requests', 0)
+		outer = (getattr(_state, 'pinned_until', 0), getattr(_state, 'wrote', False))
+		request._replica_state = (depth, outer)
+		if depth:
+			pinned_until = max(pinned_until, outer[0])
+		_state.requests = depth + 1
+		_state.pinned_until = pinned_until
+		_state.wrote = False
+		return None
+
+	def process_response(self, request, response):
+		if getattr(_state, 'wrote', False):
+			response.set_cookie(STICKY_COOKIE, '%.3f' %(_state.pinned_until), max_age=int(STICKY_SECONDS) + 1, httponly=True)
+
+		# missing when an earlier middleware answered the request
+		if hasattr(request, '_replica_state'):
+			depth, (pinned_until, wrote) = request._replica_state
+			del request._replica_state
+			_state.requests = depth
+			if depth:
+				_state.pinned_until = max(pinned_until, getattr(_state, 'pinned_until', 0))
+				_state.wrote = wrote or getattr(_state, 'wrote', False)
+			else:
+				_state.pinned_until = 0
+				_state.wrote = False
+		return response
@@ -0,0 +1,169 @@
+"""
+Interview conflict detection.
+
+A Schedule loads the interviews of a time range (typically a day) with two
+queries and indexes them per resource: every interviewer, every candidate
+and every room. Each index keeps its interviews sorted by start. An
+interview is never longer than MAX_DURATION, so the ones overlapping
+[start, end) all start in (start - MAX_DURATION, end), and two bisections
+find them: a check costs O(log n) plus the few interviews in that window.
+Interviews booked through the Schedule are added to its indexes, so a
+whole hiring day can be checked and booked in one pass.
+
+"""
+import bisect
+import datetime
+from collections import defaultdict
+
+from django.conf import settings
+
+from human_resources.models import Interview
+
+MAX_DURATION = datetime.timedelta(minutes=max(minutes for minutes, label in Interview.DURATION_CHOICES))
+# free slots are offered between these hours
+INTERVIEW_HOURS = getattr(settings, 'HR_INTERVIEW_HOURS', (9, 17))
+
+INTERVIEWER = 'interviewer'
+CANDIDATE = 'candidate'
+ROOM = 'room'
+
+
+class Booking(object):
+	"""An interview as far as scheduling is concerned"""
+
+	def __init__(self, start, duration, interviewers=(), person=None, room='', interview_id=None):
+		self.start = start
+		self.duration = duration
+		self.end = start + datetime.timedelta(minutes=duration)
+		self.interviewers = list(interviewers)
+		self.person = person
+		self.room = room
+		self.interview_id = interview_id
+
+	def resources(self):
+		resources = [(INTERVIEWER, user_id) for user_id in self.interviewers]
+		if self.person is not None:
+			resources.append((CANDIDATE, self.person))
+		if self.room:
+			resources.append((ROOM, self.room.strip().lower()))
+		return resources
+
+
+class Conflict(object):
+
+	def __init__(self, resource, booking):
+		self.kind, self.key = resource
+		self.booking = booking
+
+	def message(self, name=None):
+		return u"%s is already booked from %s to %s" %(
+			name or u'%s %s' %(self.kind.capitalize(), self.key),
+			self.booking.start.strftime('%m/%d/%y %H:%M'), self.booking.end.strftime('%H:%M'),
+		)
+
+	def __unicode__(self):
+		return self.message()
+
+
+class IntervalIndex(object):
+	"""Bookings of one resource, sorted by start"""
+
+	def __init__(self):
+		self.starts = []
+		self.bookings = []
+
+	def add(self, booking):
+		i = bisect.bisect_right(self.starts, booking.start)
+		self.starts.insert(i, booking.start)
+		self.bookings.insert(i, booking)
+
+	def overlapping(self, start, end):
+		lo = bisect.bisect_right(self.starts, start - MAX_DURATION)
+		hi = bisect.bisect_left(self.starts, end)
+		return [booking for booking in self.bookings[lo:hi] if booking.end > start]
+
+
+class Schedule(object):
+	"""The interviews starting in [start, end), indexed per resource.
+	Interviews in exclude (ids) are left out, e.g. the ones being
+	rescheduled."""
+
+	def __init__(self, start, end, exclude=()):
+		self.start = start
+		self.end = end
+		self.indexes = defaultdict(IntervalIndex)
+		self.load(exclude)
+
+	def load(self, exclude):
+		# interviews that started before the range may still run into it
+		interviews = Interview.objects.filter(date__gte=self.start - MAX_DURATION, date__lt=self.end)
+		if exclude:
+			interviews = interviews.exclude(pk__in=list(exclude))
+
+		interviewers = defaultdict(list)
+		through = Interview.interviewers.through
+		for interview_id, user_id in through.objects.filter(interview__in=interviews.values('pk')).values_list('interview', 'user'):
+			interviewers[interview_id].append(user_id)
+
+		for pk, date, duration, room, person_id in interviews.values_list('pk', 'date', 'duration', 'room', 'evaluation__candidacy__person'):
+			self.add(Booking(date, duration, interviewers[pk], person_id, room, pk))
+
+	def add(self, booking):
+		for resource in booking.resources():
+			self.indexes[resource].add(booking)
+
+	def conflicts(self, booking):
+		"""Every conflict of booking with the interviews in the schedule"""
+		conflicts = []
+		for resource in booking.resources():
+			if resource in self.indexes:
+				conflicts.extend(
+					Conflict(resource, other) for other in self.indexes[resource].overlapping(booking.start, booking.end)
+					if other is not booking
+				)
+		return conflicts
+
+	def book(self, booking):
+		"""Add booking unless it conflicts; returns the conflicts"""
+		conflicts = self.conflicts(booking)
+		if not conflicts:
+			self.add(booking)
+		return conflicts
+
+	def free_slots(self, booking, count=3):
+		"""Up to count start times from booking.start on, within the schedule
+		and INTERVIEW_HOURS, at which booking's resources are all free"""
+
+		duration = booking.end - booking.start
+		start_hour, end_hour = INTERVIEW_HOURS
+		slots = []
+		start = booking.start
+		while len(slots) < count and start + duration <= self.end:
+			day = start.replace(hour=0, minute=0, second=0, microsecond=0)
+			opening = day + datetime.timedelta(hours=start_hour)
+			closing = day + datetime.timedelta(hours=end_hour)
+			if start < opening:
+				start = opening
+				continue
+			if start + duration > closing:
+				start = opening + datetime.timedelta(days=1)
+				continue
+
+			conflicts = self.conflicts(Booking(start, booking.duration, booking.interviewers, booking.person, booking.room))
+			if conflicts:
+				# any later start that is still before the end of one of
+				# them overlaps it too
+				start = max(conflict.booking.end for conflict in conflicts)
+			else:
+				slots.append(start)
+				start += duration
+		return slots
+
+
+def schedule_for(bookings, exclude=()):
+	"""A Schedule covering the days of the given bookings"""
+	starts = [booking.start for booking in bookings]
+	first = min(starts).replace(hour=0, minute=0, second=0, microsecond=0)
+	last = max(starts).replace(hour=0, minute=0, second=0, microsecond=0)
+	# bookings late in the last day may run past midnight
+	return Schedule(first, last + datetime.timedelta(days=1) + MAX_DURATION, exclude)
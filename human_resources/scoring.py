@@ -0,0 +1,313 @@
+"""
+Weighted fit scores for candidacies, ranked per job opportunity.
+
+For a job, every candidacy becomes a row and every qualification and
+nice-to-have of the position a column of a boolean matrix, filled from
+the satisfied qualifications/nice-to-haves of the candidacy's evaluations.
+The scores are that matrix times the requirement weights, computed for
+all candidacies of the job at once (with NumPy when it is installed) and
+stored in CandidacyScore together with each candidacy's place.
+
+Saving a candidacy or evaluation only rescores the candidacies it touches
+and moves the places that changed. The changes are collected and applied
+once: at the end of the request, after the outermost
+human_resources.transactions.commit_on_success, or right away outside of
+both. A changed requirement rescores the position's jobs whole.
+
+"""
+import datetime
+import logging
+import threading
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.signals import request_started, request_finished
+from django.db.models import F, Max
+from django.db.models.signals import post_save, post_delete, m2m_changed
+
+from human_resources.models import Candidacy, CandidacyScore, Evaluation, \
+JobOpportunity, NiceToHave, Qualification
+from human_resources.transactions import commit_on_success, on_commit
+
+try:
+	import numpy
+	numpy_present = True
+except ImportError:
+	numpy_present = False
+
+QUALIFICATION_WEIGHT = getattr(settings, 'HR_QUALIFICATION_WEIGHT', 2.0)
+NICE_TO_HAVE_WEIGHT = getattr(settings, 'HR_NICE_TO_HAVE_WEIGHT', 1.0)
+
+logger = logging.getLogger('human_resources.scoring')
+
+_state = threading.local()
+
+
+def _satisfied_pairs(field_name, target_name, **lookups):
+	"""(candidacy id, requirement id) for every requirement satisfied by an
+	evaluation matching lookups"""
+	through = Evaluation._meta.get_field(field_name).rel.through
+	return set(through.objects.filter(**lookups).values_list('evaluation__candidacy', target_name))
+
+
+def _score_matrix(candidacy_ids, columns, satisfied, weights, split):
+	"""Scores (0 - 100) per candidacy, and how many of the columns before
+	and from `split` each one satisfies, as three lists"""
+	total_weight = float(sum(weights)) or 1.0
+
+	if numpy_present:
+		matrix = numpy.zeros((len(candidacy_ids), len(columns)), dtype=numpy.bool_)
+		rows = dict((pk, i) for i, pk in enumerate(candidacy_ids))
+		column_index = dict((key, j) for j, key in enumerate(columns))
+		hits = [(rows[c], column_index[key]) for c, key in satisfied if c in rows and key in column_index]
+		if hits:
+			hit_rows, hit_columns = zip(*hits)
+			matrix[list(hit_rows), list(hit_columns)] = True
+		scores = matrix.dot(numpy.array(weights, dtype=numpy.float64)) * (100.0 / total_weight)
+		return scores.tolist(), matrix[:, :split].sum(axis=1).tolist(), matrix[:, split:].sum(axis=1).tolist()
+
+	scores, before, after = [], [], []
+	for candidacy_id in candidacy_ids:
+		hit = [(candidacy_id, key) in satisfied for key in columns]
+		scores.append(sum(w for w, h in zip(weights, hit) if h) * 100.0 / total_weight)
+		before.append(sum(hit[:split]))
+		after.append(sum(hit[split:]))
+	return scores, before, after
+
+
+def _rank(row):
+	# best score first, earlier candidacies first among equals
+	return (-row.score, row.candidacy_id)
+
+
+def _score_rows(job_id, candidacy_ids, whole_job=False):
+	"""Unsaved CandidacyScore rows, without places, for the given
+	candidacies of the job (all of them with whole_job)"""
+	position_id = JobOpportunity.objects.filter(pk=job_id).values_list('position', flat=True)
+	if not position_id or not candidacy_ids:
+		return []
+
+	qualification_ids = list(Qualification.objects.filter(position=position_id[0]).order_by('pk').values_list('pk', flat=True))
+	nice_to_have_ids = list(NiceToHave.objects.filter(position=position_id[0]).order_by('pk').values_list('pk', flat=True))
+
+	columns = [('q', pk) for pk in qualification_ids] + [('n', pk) for pk in nice_to_have_ids]
+	split = len(qualification_ids)
+	weights = [QUALIFICATION_WEIGHT] * split + [NICE_TO_HAVE_WEIGHT] * (len(columns) - split)
+
+	if whole_job:
+		lookups = {'evaluation__candidacy__job_opportunity': job_id}
+	else:
+		lookups = {'evaluation__candidacy__in': candidacy_ids}
+	satisfied = set((c, ('q', pk)) for c, pk in _satisfied_pairs('satisfied_qualifications', 'qualification', **lookups))
+	satisfied.update((c, ('n', pk)) for c, pk in _satisfied_pairs('satisfied_nice_to_haves', 'nicetohave', **lookups))
+
+	scores, qualification_counts, nice_to_have_counts = _score_matrix(candidacy_ids, columns, satisfied, weights, split)
+
+	rows = []
+	for i, candidacy_id in enumerate(candidacy_ids):
+		rows.append(CandidacyScore(
+			candidacy_id=candidacy_id,
+			job_opportunity_id=job_id,
+			score=scores[i],
+			qualifications_satisfied=qualification_counts[i],
+			nice_to_haves_satisfied=nice_to_have_counts[i],
+		))
+	return rows
+
+
+def score_job(job_id):
+	"""Returns unsaved CandidacyScore rows for every candidacy of the job,
+	best first"""
+	candidacy_ids = list(Candidacy.objects.filter(job_opportunity=job_id).order_by('pk').values_list('pk', flat=True))
+	rows = _score_rows(job_id, candidacy_ids, whole_job=True)
+	rows.sort(key=_rank)
+	for place, row in enumerate(rows, 1):
+		row.place = place
+	return rows
+
+
+@commit_on_success
+def rescore_jobs(job_ids):
+	"""Recompute the leaderboards of the given jobs"""
+	for job_id in set(job_ids):
+		rows = score_job(job_id)
+		CandidacyScore.objects.filter(job_opportunity=job_id).delete()
+		if rows:
+			CandidacyScore.objects.bulk_create(rows)
+
+
+def rescore_all():
+	job_ids = list(JobOpportunity.objects.values_list('pk', flat=True))
+	for job_id in job_ids:
+		rescore_jobs([job_id])
+	return len(job_ids)
+
+
+def place_job(job_id):
+	"""Renumber a job's leaderboard after some of its scores changed. The
+	rows in between the ones that changed shift by the same amount, so
+	each such run moves with two UPDATEs."""
+	rows = [
+		CandidacyScore(candidacy_id=pk, score=score, place=place)
+		for pk, score, place in CandidacyScore.objects.filter(job_opportunity=job_id).values_list('candidacy', 'score', 'place')
+	]
+	if not rows:
+		return
+	top = max(row.place for row in rows)
+	final = dict((row.candidacy_id, place) for place, row in enumerate(sorted(rows, key=_rank), 1))
+
+	# [first place, last place, shift] of neighbouring rows moving alike
+	runs = []
+	in_run = False
+	for row in sorted(rows, key=lambda row: row.place):
+		shift = final[row.candidacy_id] - row.place
+		if not shift:
+			in_run = False
+		elif in_run and runs[-1][2] == shift:
+			runs[-1][1] = row.place
+		else:
+			runs.append([row.place, row.place, shift])
+			in_run = True
+
+	# (job, place) is unique, checked row by row on some databases, so park
+	# every run above the board before moving any into place
+	board = CandidacyScore.objects.filter(job_opportunity=job_id)
+	for first, last, shift in runs:
+		board.filter(place__range=(first, last)).update(place=F('place') + top)
+	for first, last, shift in runs:
+		board.filter(place__range=(first + top, last + top)).update(place=F('place') + (shift - top))
+
+
+def rescore_candidacies(job_id, candidacy_ids):
+	"""Rescore some candidacies of a job and move the places that change.
+	Returns the other jobs any of them were scored for before."""
+	rows = _score_rows(job_id, sorted(candidacy_ids))
+	if not rows:
+		return set()
+
+	stored = dict(CandidacyScore.objects.filter(pk__in=candidacy_ids).values_list('candidacy', 'job_opportunity'))
+	# candidacies moved to this job from another start over here
+	moved_from = set(job for pk, job in stored.items() if job != job_id)
+	if moved_from:
+		CandidacyScore.objects.filter(pk__in=[pk for pk, job in stored.items() if job != job_id]).delete()
+
+	top = CandidacyScore.objects.filter(job_opportunity=job_id).aggregate(top=Max('place'))['top'] or 0
+	now = datetime.datetime.now()
+	new_rows = []
+	for row in rows:
+		if stored.get(row.candidacy_id) == job_id:
+			# update() skips auto_now
+			CandidacyScore.objects.filter(pk=row.candidacy_id).update(
+				score=row.score,
+				qualifications_satisfied=row.qualifications_satisfied,
+				nice_to_haves_satisfied=row.nice_to_haves_satisfied,
+				date_scored=now,
+			)
+		else:
+			row.place = top + len(new_rows) + 1
+			new_rows.append(row)
+	if new_rows:
+		CandidacyScore.objects.bulk_create(new_rows)
+
+	place_job(job_id)
+	return moved_from
+
+
+class PendingScores(object):
+	"""What the changes seen so far leave to rescore"""
+
+	def __init__(self):
+		self.candidacy_ids = set()
+		# jobs that lost candidacies
+		self.place_job_ids = set()
+		# jobs whose requirements changed
+		self.job_ids = set()
+
+
+def schedule_rescore(candidacy_ids=(), place_job_ids=(), job_ids=()):
+	"""Add to this thread's pending rescoring; the first addition arranges
+	for it to be applied. Changes that send no signals, e.g. update(),
+	report what they touched here."""
+	pending = getattr(_state, 'pending', None)
+	first = pending is None
+	if first:
+		pending = _state.pending = PendingScores()
+	pending.candidacy_ids.update(candidacy_ids)
+	pending.place_job_ids.update(place_job_ids)
+	pending.job_ids.update(job_ids)
+	if first and not getattr(_state, 'in_request', False):
+		on_commit(flush)
+
+
+@commit_on_success
+def flush():
+	"""Apply the pending rescoring"""
+	pending = getattr(_state, 'pending', None)
+	_state.pending = None
+	if pending is None:
+		return
+
+	by_job = defaultdict(set)
+	for pk, job_id in Candidacy.objects.filter(pk__in=list(pending.candidacy_ids)).values_list('pk', 'job_opportunity'):
+		by_job[job_id].add(pk)
+
+	rescore_jobs(pending.job_ids)
+	place_job_ids = set(pending.place_job_ids)
+	for job_id, candidacy_ids in by_job.items():
+		if job_id not in pending.job_ids:
+			place_job_ids.update(rescore_candidacies(job_id, candidacy_ids))
+			place_job_ids.discard(job_id)
+	for job_id in place_job_ids - pending.job_ids:
+		place_job(job_id)
+
+
+def candidacy_saved(sender, instance, **kwargs):
+	schedule_rescore(candidacy_ids=[instance.pk])
+
+def candidacy_deleted(sender, instance, **kwargs):
+	# its score went with it
+	schedule_rescore(place_job_ids=[instance.job_opportunity_id])
+
+def evaluation_changed(sender, instance, **kwargs):
+	schedule_rescore(candidacy_ids=[instance.candidacy_id])
+
+def satisfied_changed(sender, instance, action, reverse, pk_set, **kwargs):
+	if not action.startswith('post_'):
+		return
+	if not reverse:
+		evaluation_changed(sender, instance)
+	elif pk_set:
+		schedule_rescore(candidacy_ids=Evaluation.objects.filter(pk__in=pk_set).values_list('candidacy', flat=True))
+
+def requirement_changed(sender, instance, **kwargs):
+	schedule_rescore(job_ids=JobOpportunity.objects.filter(position=instance.position_id).values_list('pk', flat=True))
+
+
+def request_began(sender, **kwargs):
+	_state.in_request = True
+	_state.pending = None
+
+def request_ended(sender, **kwargs):
+	_state.in_request = False
+	try:
+		flush()
+	except Exception:
+		# the response is out already; the scores catch up on the next change
+		logger.exception("Rescoring candidacies failed")
+
+
+request_started.connect(request_began, dispatch_uid='hr_scoring_request_started')
+request_finished.connect(request_ended, dispatch_uid='hr_scoring_request_finished')
+
+post_save.connect(candidacy_saved, sender=Candidacy, dispatch_uid='hr_scoring_candidacy_save')
+post_delete.connect(candidacy_deleted, sender=Candidacy, dispatch_uid='hr_scoring_candidacy_delete')
+post_save.connect(evaluation_changed, sender=Evaluation, dispatch_uid='hr_scoring_evaluation_save')
+post_delete.connect(evaluation_changed, sender=Evaluation, dispatch_uid='hr_scoring_evaluation_delete')
+
+for model in (Qualification, NiceToHave):
+	post_save.connect(requirement_changed, sender=model, dispatch_uid='hr_scoring_save_%s' % model.__name__)
+	post_delete.connect(requirement_changed, sender=model, dispatch_uid='hr_scoring_delete_%s' % model.__name__)
+
+for field_name in ('satisfied_qualifications', 'satisfied_nice_to_haves'):
+	through = Evaluation._meta.get_field(field_name).rel.through
+	m2m_changed.connect(satisfied_changed, sender=through, dispatch_uid='hr_scoring_m2m_%s' % field_name)
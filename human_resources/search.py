@@ -0,0 +1,127 @@
+"""
+Local inverted index behind the admin search boxes.
+
+Each indexed row (a person, a person note, an interview or a position) is
+split into terms that are stored in SearchIndexEntry together with the
+person, evaluation or position a match should find. Searches look terms
+up by prefix through the index on `term`, so they never scan the indexed
+text itself.
+
+"""
+import re
+
+from django.db.models import Q
+from django.db.models.signals import post_save, post_delete
+from django.utils.html import strip_tags
+
+from human_resources.models import Person, PersonNote, Interview, Position, \
+SearchIndexEntry
+from human_resources.transactions import commit_on_success
+
+TERM_RE = re.compile(r'\w+', re.UNICODE)
+MIN_TERM_LENGTH = 2
+MAX_TERM_LENGTH = SearchIndexEntry._meta.get_field('term').max_length
+REBUILD_CHUNK_SIZE = 1000
+
+
+def terms(*texts):
+	"""Lowercased, de-duplicated words of the given texts, html removed"""
+	found = set()
+	for text in texts:
+		if text:
+			for term in TERM_RE.findall(strip_tags(text).lower()):
+				if len(term) >= MIN_TERM_LENGTH:
+					found.add(term[:MAX_TERM_LENGTH])
+	return found
+
+
+def _person_document(person):
+	return terms(person.first_name, person.middle_name, person.last_name, person.email, person.city), {'person_id': person.pk}
+
+def _note_document(note):
+	return terms(note.note), {'person_id': note.person_id}
+
+def _interview_document(interview):
+	return terms(interview.notes), {'evaluation_id': interview.evaluation_id}
+
+def _position_document(position):
+	return terms(position.name, position.private_description, position.public_description), {'position_id': position.pk}
+
+DOCUMENTS = {
+	Person: ('person', _person_document),
+	PersonNote: ('personnote', _note_document),
+	Interview: ('interview', _interview_document),
+	Position: ('position', _position_document),
+}
+
+
+def _entries(instance):
+	source, document = DOCUMENTS[type(instance)]
+	found, targets = document(instance)
+	return [SearchIndexEntry(term=term, source=source, source_id=instance.pk, **targets) for term in found]
+
+
+@commit_on_success
+def index_objects(model, objects):
+	"""(Re)index a batch of objects of one model"""
+	source = DOCUMENTS[model][0]
+	objects = list(objects)
+	SearchIndexEntry.objects.filter(source=source, source_id__in=[o.pk for o in objects]).delete()
+	entries = []
+	for instance in objects:
+		entries.extend(_entries(instance))
+	SearchIndexEntry.objects.bulk_create(entries)
+
+
+def unindex_object(model, pk):
+	SearchIndexEntry.objects.filter(source=DOCUMENTS[model][0], source_id=pk).delete()
+
+
+def rebuild_index():
+	"""Reindex every document, a chunk at a time. Returns the number of
+	entries written."""
+	SearchIndexEntry.objects.all().delete()
+	for model in DOCUMENTS:
+		pks = list(model.objects.order_by().values_list('pk', flat=True))
+		for i in range(0, len(pks), REBUILD_CHUNK_SIZE):
+			index_objects(model, model.objects.filter(pk__in=pks[i:i + REBUILD_CHUNK_SIZE]))
+	return SearchIndexEntry.objects.count()
+
+
+def _matches(term, target):
+	"""Subquery of the `target` ids of entries with a term starting with term"""
+	return SearchIndexEntry.objects.filter(term__startswith=term, **{target + '__isnull': False}).values(target)
+
+
+def search_people(queryset, query):
+	"""People whose own fields or notes contain every term of query"""
+	for term in terms(query):
+		queryset = queryset.filter(pk__in=_matches(term, 'person'))
+	return queryset
+
+
+def search_evaluations(queryset, query):
+	"""Evaluations where every term of query is found in their interview
+	notes or in the candidate's indexed fields and notes"""
+	for term in terms(query):
+		queryset = queryset.filter(Q(pk__in=_matches(term, 'evaluation')) | Q(candidacy__person__in=_matches(term, 'person')))
+	return queryset
+
+
+def search_positions(queryset, query):
+	"""Positions whose name or descriptions contain every term of query"""
+	for term in terms(query):
+		queryset = queryset.filter(pk__in=_matches(term, 'position'))
+	return queryset
+
+
+def object_saved(sender, instance, **kwargs):
+	index_objects(sender, [instance])
+
+def object_deleted(sender, instance, **kwargs):
+	unindex_object(sender, instance.pk)
+
+
+for model in DOCUMENTS:
+	post_save.connect(object_saved, sender=model, dispatch_uid='hr_search_save_%s' % model.__name__)
+	post_delete.connect(object_deleted, sender=model, dispatch_uid='hr_search_delete_%s' % model.__name__)
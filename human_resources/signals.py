@@ -0,0 +1,13 @@
+from django.dispatch import Signal
+
+# Sent once per set-based close, after it is committed, instead of a
+# post_save per evaluation. `evaluation_ids` lists every evaluation that
+# was moved to "Candidacy closed", `job_opportunity_ids` the jobs they
+# belonged to.
+evaluations_closed = Signal(providing_args=['evaluation_ids', 'job_opportunity_ids'])
+
+# Sent by refresh_published_jobs once its rebuilt PublishedJob rows are
+# committed.
+# `slugs` are the slugs of the rows now published, `removed_slugs` the
+# slugs that were published before and no longer are.
+published_jobs_changed = Signal(providing_args=['slugs', 'removed_slugs'])
\ No newline at end of file
@@ -0,0 +1,88 @@
+"""
+Slug history and the in-process routing table of the public job pages.
+
+Every slug a job opportunity is saved with is kept in JobSlug. The
+routing table maps each slug of a published job, current or old, to the
+job's id and current slug. It is loaded on first use and reloaded after
+the published jobs change: right away in the process that made the
+change (published_jobs_changed), and in the others when they see a new
+job cache generation, which is a cache read rather than a query. The job
+page view resolves slugs from it, so unknown slugs 404 and old slugs
+redirect without a database round-trip.
+
+"""
+import threading
+
+from django.db.models.signals import pre_save, post_save
+
+from human_resources.models import JobOpportunity, JobSlug, PublishedJob
+from human_resources.job_cache import get_generation
+from human_resources.signals import published_jobs_changed
+from human_resources.routers import primary_reads
+
+
+class SlugRoutes(object):
+
+	def __init__(self):
+		self.lock = threading.Lock()
+		self.generation = None
+		# (any slug -> job id, job id -> current slug)
+		self.table = ({}, {})
+
+	def load(self):
+		generation = get_generation()
+		with primary_reads():
+			current = dict(PublishedJob.objects.values_list('pk', 'slug'))
+			slugs = dict(JobSlug.objects.filter(job__in=PublishedJob.objects.values('pk')).values_list('slug', 'job'))
+		slugs.update((slug, job_id) for job_id, slug in current.items())
+
+		# swap in whole so readers never see a half loaded table
+		self.table = (slugs, current)
+		self.generation = generation
+
+	def invalidate(self):
+		self.generation = None
+
+	def resolve(self, slug):
+		"""(job id, current slug) for a published job's slug, else None"""
+		if self.generation is None or self.generation != get_generation():
+			with self.lock:
+				if self.generation is None or self.generation != get_generation():
+					self.load()
+
+		slugs, current = self.table
+		job_id = slugs.get(slug)
+		if job_id is None or job_id not in current:
+			return None
+		return job_id, current[job_id]
+
+routes = SlugRoutes()
+
+
+def record_slug(job_id, slug):
+	"""Add slug to the history of the job; a slug taken over from another
+	job now leads to this one"""
+	if not slug:
+		return
+	entry, created = JobSlug.objects.get_or_create(slug=slug, defaults={'job_id': job_id})
+	if not created and entry.job_id != job_id:
+		JobSlug.objects.filter(pk=entry.pk).update(job=job_id)
+
+
+def job_saving(sender, instance, raw=False, **kwargs):
+	# the slug is overwritten during save, so keep the one stored so far
+	if instance.pk and not raw:
+		for slug in JobOpportunity.objects.filter(pk=instance.pk).values_list('slug', flat=True):
+			record_slug(instance.pk, slug)
+
+def job_saved(sender, instance, raw=False, **kwargs):
+	if not raw:
+		record_slug(instance.pk, instance.slug)
+
+def published_jobs_changed_handler(sender, **kwargs):
+	routes.invalidate()
+
+
+pre_save.connect(job_saving, sender=JobOpportunity, dispatch_uid='hr_slug_routes_job_pre_save')
+post_save.connect(job_saved, sender=JobOpportunity, dispatch_uid='hr_slug_routes_job_save')
+published_jobs_changed.connect(published_jobs_changed_handler, dispatch_uid='hr_slug_routes_published_jobs_changed')
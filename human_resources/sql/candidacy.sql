@@ -0,0 +1,4 @@
+-- CandidacyAdmin changelist, keyset paginated on -rank, -id
+CREATE INDEX human_resources_candidacy_rank_id ON human_resources_candidacy (rank, id);
+-- person timeline: candidacies of a person, newest first
+CREATE INDEX human_resources_candidacy_person_added_id ON human_resources_candidacy (person_id, date_added, id);
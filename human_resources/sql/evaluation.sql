@@ -0,0 +1,4 @@
+-- EvaluationAdmin changelist, forced to ?status__exact=1, ordered by -date_modified and keyset paginated on -date_modified, -id
+CREATE INDEX human_resources_evaluation_status_modified_id ON human_resources_evaluation (status, date_modified, id);
+-- person timeline: evaluations of the person's candidacies, newest first
+CREATE INDEX human_resources_evaluation_candidacy_added_id ON human_resources_evaluation (candidacy_id, date_added, id);
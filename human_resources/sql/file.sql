@@ -0,0 +1,2 @@
+-- person timeline: files of a person, newest first
+CREATE INDEX human_resources_file_person_added_id ON human_resources_file (person_id, date_added, id);
@@ -0,0 +1,4 @@
+-- person timeline: interviews of the person's evaluations, newest first
+CREATE INDEX human_resources_interview_evaluation_date_id ON human_resources_interview (evaluation_id, date, id);
+-- interview conflict checks: the interviews of a day range
+CREATE INDEX human_resources_interview_date ON human_resources_interview (date);
@@ -0,0 +1,2 @@
+-- public job pages: published jobs looked up by slug
+CREATE INDEX human_resources_jobopportunity_published_slug ON human_resources_jobopportunity (published_status, slug);
@@ -0,0 +1,2 @@
+-- people import, matching emails case-insensitively
+CREATE INDEX human_resources_person_lower_email ON human_resources_person (LOWER(email));
@@ -0,0 +1,4 @@
+-- PersonAdmin changelist, filtered by status and ordered by -last_name
+CREATE INDEX human_resources_person_status_last_name ON human_resources_person (status, last_name);
+-- PersonAdmin changelist, keyset paginated on -last_name, -id
+CREATE INDEX human_resources_person_last_name_id ON human_resources_person (last_name, id);
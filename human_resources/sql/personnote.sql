@@ -0,0 +1,2 @@
+-- latest note of a person (PersonAdmin.latest_note subquery) and the notes of the person timeline
+CREATE INDEX human_resources_personnote_person_date ON human_resources_personnote (person_id, date_and_time);
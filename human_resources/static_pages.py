@@ -0,0 +1,197 @@
+"""
+Static copies of the public careers pages.
+
+With HR_STATIC_JOBS_ROOT set, every committed change to the published
+jobs is queued in <root>/.pending. Run render_static_jobs --watch <seconds>
+as a worker, or render_static_jobs --pending from cron, to re-render the
+affected job pages and the published jobs listing
+(HR_STATIC_JOBS_LISTING_URL, the CMS page holding the plugin) into
+<root>/<url path>/index.html. Unpublished jobs and old slugs have their
+files removed. Files are written to a temporary file next to their
+destination and renamed into place, so the web server never serves a
+half written page. Serve the root directly and fall back to Django when
+a file is missing, e.g. with nginx:
+
+	location /jobs/ {
+		root /srv/hr_static;
+		try_files $uri/index.html @django;
+	}
+
+Pages are rendered through the full middleware and URL stack as an
+anonymous visitor, in the worker rather than in the request that changed
+them. The render_static_jobs command without options rebuilds everything.
+
+"""
+import fcntl
+import logging
+import os
+import shutil
+import tempfile
+
+from django.conf import settings
+from django.test.client import Client
+
+from human_resources.models import PublishedJob
+from human_resources.signals import published_jobs_changed
+
+STATIC_JOBS_ROOT = getattr(settings, 'HR_STATIC_JOBS_ROOT', None)
+STATIC_JOBS_LISTING_URL = getattr(settings, 'HR_STATIC_JOBS_LISTING_URL', '/jobs/')
+
+QUEUE_NAME = '.pending'
+
+logger = logging.getLogger('human_resources.static_pages')
+
+
+def file_for(url):
+	"""Where the static copy of the page at url lives"""
+	parts = [part for part in url.split('/') if part and part not in ('.', '..')]
+	return os.path.join(STATIC_JOBS_ROOT, *(parts + ['index.html']))
+
+
+def job_pages_dir():
+	"""The directory holding one sub directory per job page"""
+	return os.path.dirname(os.path.dirname(file_for(PublishedJob(slug='_').get_absolute_url())))
+
+
+def write_atomically(path, content):
+	directory = os.path.dirname(path)
+	if not os.path.isdir(directory):
+		os.makedirs(directory)
+
+	fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.tmp-')
+	try:
+		with os.fdopen(fd, 'wb') as f:
+			f.write(content)
+			f.flush()
+			os.fsync(f.fileno())
+		os.chmod(tmp_path, 0644)
+		os.rename(tmp_path, path)
+	except:
+		if os.path.exists(tmp_path):
+			os.remove(tmp_path)
+		raise
+
+
+def render_page(url, client=None):
+	"""Render url and write it to its static file. Returns whether it was
+	written; pages that don't render with 200 are left alone."""
+	response = (client or Client()).get(url)
+	if response.status_code != 200:
+		logger.warning("Not writing a static copy of %s: status %s", url, response.status_code)
+		return False
+	write_atomically(file_for(url), response.content)
+	return True
+
+
+def remove_page(url):
+	path = file_for(url)
+	if os.path.exists(path):
+		os.remove(path)
+	directory = os.path.dirname(path)
+	if os.path.isdir(directory) and not os.listdir(directory):
+		os.rmdir(directory)
+
+
+def render_jobs(slugs, removed_slugs=()):
+	"""Re-render the pages of the given slugs and the listing, and remove
+	the pages of removed_slugs"""
+	client = Client()
+	for slug in removed_slugs:
+		remove_page(PublishedJob(slug=slug).get_absolute_url())
+	for job in PublishedJob.objects.filter(slug__in=list(slugs)).only('slug'):
+		render_page(job.get_absolute_url(), client)
+	render_page(STATIC_JOBS_LISTING_URL, client)
+
+
+def render_all_jobs():
+	"""Render every published job and the listing, and remove the pages of
+	jobs that aren't published anymore. Returns the number of job pages."""
+	slugs = set(PublishedJob.objects.values_list('slug', flat=True))
+
+	stale = []
+	directory = job_pages_dir()
+	if os.path.isdir(directory):
+		for name in os.listdir(directory):
+			if name not in slugs and os.path.isfile(os.path.join(directory, name, 'index.html')):
+				stale.append(name)
+	for name in stale:
+		shutil.rmtree(os.path.join(directory, name))
+
+	render_jobs(slugs)
+	return len(slugs)
+
+
+def queue_path():
+	return os.path.join(STATIC_JOBS_ROOT, QUEUE_NAME)
+
+
+def _is_open(f, path):
+	"""Whether f is still the file at path"""
+	try:
+		return os.path.samestat(os.fstat(f.fileno()), os.stat(path))
+	except OSError:
+		return False
+
+
+def enqueue(slugs, removed_slugs=()):
+	"""Queue the pages of slugs for rendering and those of removed_slugs
+	for removal"""
+	lines = ''.join('render %s\n' %(slug) for slug in slugs) + ''.join('remove %s\n' %(slug) for slug in removed_slugs)
+	if not os.path.isdir(STATIC_JOBS_ROOT):
+		os.makedirs(STATIC_JOBS_ROOT)
+	path = queue_path()
+	while True:
+		with open(path, 'a') as f:
+			fcntl.flock(f, fcntl.LOCK_EX)
+			# unless render_pending took this file away meanwhile
+			if _is_open(f, path):
+				f.write(lines)
+				return
+
+
+def render_pending():
+	"""Render what is queued. Returns the number of job pages rendered or
+	removed."""
+	path = queue_path()
+	taken = '%s.%s' %(path, os.getpid())
+	try:
+		os.rename(path, taken)
+	except OSError:
+		# nothing queued
+		return 0
+
+	with open(taken) as f:
+		# wait for a writer that opened the queue before it was taken
+		fcntl.flock(f, fcntl.LOCK_EX)
+		lines = f.read().splitlines()
+
+	# the last change of a slug wins
+	changes = {}
+	for line in lines:
+		action, slug = line.split(' ', 1)
+		changes[slug] = action
+	slugs = [slug for slug, action in changes.items() if action == 'render']
+	removed_slugs = [slug for slug, action in changes.items() if action == 'remove']
+
+	try:
+		render_jobs(slugs, removed_slugs)
+	except:
+		enqueue(slugs, removed_slugs)
+		raise
+	finally:
+		os.remove(taken)
+	return len(changes)
+
+
+def published_jobs_changed_handler(sender, slugs, removed_slugs, **kwargs):
+	if STATIC_JOBS_ROOT is None or not (slugs or removed_slugs):
+		return
+	try:
+		enqueue(slugs, removed_slugs)
+	except Exception:
+		# the database is already updated; the pages only stay stale until
+		# the next change or render_static_jobs
+		logger.exception("Queueing the static job pages failed")
+
+
+published_jobs_changed.connect(published_jobs_changed_handler, dispatch_uid='hr_static_pages_published_jobs_changed')
@@ -0,0 +1,187 @@
+"""
+Content-addressed storage for person files, and serving them.
+
+Uploads are hashed while they are streamed to a staging file and then
+renamed to a name derived from their SHA-1, sharded over two directory
+levels (ab/cd/abcd...ext). The same document uploaded for several people
+is therefore stored once. Files are only reachable through the
+authenticated download view in PersonAdmin, which hands the transfer off
+to the web server when HR_SENDFILE_BACKEND is set.
+
+"""
+import errno
+import hashlib
+import mimetypes
+import os
+import re
+import tempfile
+
+from django.conf import settings
+from django.core.files.storage import FileSystemStorage
+from django.core.servers.basehttp import FileWrapper
+from django.core.urlresolvers import reverse
+from django.http import HttpResponse, HttpResponseNotFound
+
+try:
+	HR_UPLOAD_TO = settings.HR_UPLOAD_TO
+
+except AttributeError:
+	HR_UPLOAD_TO = settings.MEDIA_ROOT
+
+PERSON_FILES_ROOT = getattr(settings, 'HR_PERSON_FILES_ROOT', os.path.join(HR_UPLOAD_TO, 'person_files'))
+
+# None (serve from Django), 'x-sendfile' (Apache, lighttpd) or
+# 'x-accel-redirect' (nginx, with an internal location serving
+# PERSON_FILES_ROOT under HR_SENDFILE_URL_PREFIX)
+SENDFILE_BACKEND = getattr(settings, 'HR_SENDFILE_BACKEND', None)
+SENDFILE_URL_PREFIX = getattr(settings, 'HR_SENDFILE_URL_PREFIX', '/protected/person_files/')
+
+CHUNK_SIZE = 64 * 1024
+HASHED_NAME_RE = re.compile(r'^[0-9a-f]{2}/[0-9a-f]{2}/[0-9a-f]{40}(\.\w+)?$')
+
+# read once: os.umask can only be read by setting it, which isn't thread safe
+UMASK = os.umask(0)
+os.umask(UMASK)
+
+
+class ContentAddressedStorage(FileSystemStorage):
+
+	def __init__(self, location=PERSON_FILES_ROOT, **kwargs):
+		super(ContentAddressedStorage, self).__init__(location=location, **kwargs)
+
+	def hashed_name(self, digest, ext):
+		return '%s/%s/%s%s' %(digest[:2], digest[2:4], digest, ext)
+
+	def get_available_name(self, name):
+		# identical names mean identical contents, nothing to avoid
+		return name
+
+	def _makedirs(self, directory):
+		try:
+			os.makedirs(directory)
+		except OSError, e:
+			if e.errno != errno.EEXIST:
+				raise
+
+	def _save(self, name, content):
+		ext = os.path.splitext(name)[1].lower()
+		staging = os.path.join(self.location, 'tmp')
+		self._makedirs(staging)
+
+		sha1 = hashlib.sha1()
+		fd, tmp_path = tempfile.mkstemp(dir=staging)
+		try:
+			with os.fdopen(fd, 'wb') as f:
+				for chunk in content.chunks(CHUNK_SIZE):
+					sha1.update(chunk)
+					f.write(chunk)
+
+			name = self.hashed_name(sha1.hexdigest(), ext)
+			full_path = self.path(name)
+			if os.path.exists(full_path):
+				os.remove(tmp_path)
+				return name
+
+			self._makedirs(os.path.dirname(full_path))
+			# mkstemp creates the file 0600; a web server serving it through
+			# HR_SENDFILE_BACKEND may run as another user, so give it the
+			# mode FileSystemStorage would
+			if settings.FILE_UPLOAD_PERMISSIONS is not None:
+				os.chmod(tmp_path, settings.FILE_UPLOAD_PERMISSIONS)
+			else:
+				os.chmod(tmp_path, 0666 & ~UMASK)
+			# atomic, and harmless if a concurrent upload of the same blob won
+			os.rename(tmp_path, full_path)
+		except:
+			if os.path.exists(tmp_path):
+				os.remove(tmp_path)
+			raise
+		return name
+
+	def url(self, name):
+		return reverse('admin:human_resources_person_file', kwargs={'name': name})
+
+	def is_hashed(self, name):
+		return bool(HASHED_NAME_RE.match(name or ''))
+
+
+person_file_storage = ContentAddressedStorage()
+
+
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+# a range starting past the end of the file, answered with 416
+UNSATISFIABLE = object()
+
+def _byte_range(range_header, size):
+	"""(start, end) of a single "bytes=" range, UNSATISFIABLE, or None to
+	send the whole file"""
+	match = RANGE_RE.match(range_header or '')
+	if not match or not any(match.groups()):
+		return None
+	start, end = match.groups()
+	if start:
+		start = int(start)
+		if end and int(end) < start:
+			# not a valid range, which is ignored
+			return None
+		if start >= size:
+			return UNSATISFIABLE
+		end = min(int(end), size - 1) if end else size - 1
+	else: # suffix range, the last n bytes
+		if not int(end) or not size:
+			return UNSATISFIABLE
+		start, end = max(size - int(end), 0), size - 1
+	return start, end
+
+
+class RangeFileWrapper(FileWrapper):
+	def __init__(self, filelike, start, length, blksize=CHUNK_SIZE):
+		filelike.seek(start)
+		super(RangeFileWrapper, self).__init__(filelike, blksize)
+		self.remaining = length
+
+	def next(self):
+		if self.remaining <= 0:
+			raise StopIteration
+		data = self.filelike.read(min(self.blksize, self.remaining))
+		if not data:
+			raise StopIteration
+		self.remaining -= len(data)
+		return data
+
+
+def serve(request, name, download_name=None, storage=person_file_storage):
+	"""Response for a stored file, letting the web server send it when a
+	sendfile backend is configured and otherwise streaming it in chunks"""
+	if not storage.is_hashed(name) or not storage.exists(name):
+		return HttpResponseNotFound()
+
+	content_type = mimetypes.guess_type(download_name or name)[0] or 'application/octet-stream'
+
+	if SENDFILE_BACKEND == 'x-sendfile':
+		response = HttpResponse(content_type=content_type)
+		response['X-Sendfile'] = storage.path(name).encode('utf-8')
+	elif SENDFILE_BACKEND == 'x-accel-redirect':
+		response = HttpResponse(content_type=content_type)
+		response['X-Accel-Redirect'] = (SENDFILE_URL_PREFIX + name).encode('utf-8')
+	else:
+		size = storage.size(name)
+		byte_range = _byte_range(request.META.get('HTTP_RANGE'), size)
+		if byte_range is UNSATISFIABLE:
+			response = HttpResponse(status=416)
+			response['Content-Range'] = 'bytes */%s' %(size)
+		elif byte_range:
+			start, end = byte_range
+			f = storage.open(name, 'rb')
+			response = HttpResponse(RangeFileWrapper(f, start, end - start + 1), content_type=content_type, status=206)
+			response['Content-Range'] = 'bytes %s-%s/%s' %(start, end, size)
+			response['Content-Length'] = str(end - start + 1)
+		else:
+			f = storage.open(name, 'rb')
+			response = HttpResponse(FileWrapper(f, CHUNK_SIZE), content_type=content_type)
+			response['Content-Length'] = str(size)
+		response['Accept-Ranges'] = 'bytes'
+
+	if download_name:
+		response['Content-Disposition'] = 'attachment; filename="%s"' %(download_name.replace('"', '').encode('utf-8'))
+	return response
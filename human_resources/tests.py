@@ -0,0 +1,823 @@
+"""
+Tests for human_resources. Run them with manage.py test human_resources in a
+project that includes the admin URLs.
+
+"""
+import datetime
+import os
+import shutil
+import stat
+import tempfile
+import time
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.urlresolvers import reverse
+from django.db import connection
+from django.http import HttpResponse
+from django.test import TestCase, TransactionTestCase, SimpleTestCase
+from django.test.client import RequestFactory
+from django.utils.unittest import skipUnless
+
+from human_resources.models import Person, PersonNote, WebLink, Position, \
+JobOpportunity, Candidacy, PublishedJob, SearchIndexEntry, Qualification, \
+NiceToHave, Evaluation, CandidacyScore, Interview, File, DuplicateSuggestion
+from human_resources import scoring
+from human_resources import query_plans
+from human_resources.column_cache import lru
+from human_resources.generator import Generator
+from human_resources.importer import PeopleImporter
+from human_resources.published_jobs import refresh_published_jobs, PUBLISHED
+from human_resources.signals import published_jobs_changed, evaluations_closed
+from human_resources import pipeline
+from human_resources import static_pages
+from human_resources import routers
+from human_resources.timeline import Timeline
+from human_resources.dedupe import Record, score, find_duplicates, \
+merge_people, DEDUPE_THRESHOLD
+from human_resources.scheduling import Booking, IntervalIndex, Schedule, \
+MAX_DURATION, INTERVIEWER, CANDIDATE, ROOM
+from human_resources.storage import ContentAddressedStorage, serve, \
+_byte_range, UNSATISFIABLE, UMASK
+from human_resources.transactions import commit_on_success
+from human_resources.twitter_status import TwitterStatusRefresher, \
+RateBudget, cache_key
+
+
+def count_queries(func, *args, **kwargs):
+	"""The number of queries func makes"""
+	use_debug_cursor = connection.use_debug_cursor
+	connection.use_debug_cursor = True
+	start = len(connection.queries)
+	try:
+		func(*args, **kwargs)
+	finally:
+		connection.use_debug_cursor = use_debug_cursor
+	return len(connection.queries) - start
+
+
+class HRTestCase(TestCase):
+
+	def setUp(self):
+		self.user = User.objects.create_superuser('admin', 'admin@example.com', 'secret')
+		self.position = Position.objects.create(name='Developer')
+		self.job = JobOpportunity.objects.create(position=self.position, location='Tustin, CA')
+
+	def tearDown(self):
+		cache.clear()
+		lru.clear()
+
+	def add_person(self, i, **kwargs):
+		fields = {
+			'first_name': 'First%s' % i,
+			'last_name': 'Last%s' % i,
+			'email': 'person%s@example.com' % i,
+			'mobile_phone': '714-555-%04d' % i,
+		}
+		fields.update(kwargs)
+		return Person.objects.create(**fields)
+
+
+class PersonChangelistTest(HRTestCase):
+
+	def setUp(self):
+		super(PersonChangelistTest, self).setUp()
+		self.client.login(username='admin', password='secret')
+		self.url = reverse('admin:human_resources_person_changelist')
+
+	def add_person(self, i, **kwargs):
+		person = super(PersonChangelistTest, self).add_person(i, **kwargs)
+		PersonNote.objects.create(author=self.user, person=person, note='Note %s' % i)
+		WebLink.objects.create(person=person, name='Site', url='http://example.com/%s' % i)
+		Candidacy.objects.create(person=person, job_opportunity=self.job)
+		return person
+
+	def get_changelist(self):
+		# nothing cached, so every row renders all of its columns
+		cache.clear()
+		lru.clear()
+		response = self.client.get(self.url)
+		self.assertEqual(response.status_code, 200)
+		return response
+
+	def test_queries_do_not_grow_with_rows(self):
+		self.add_person(0)
+		queries = count_queries(self.get_changelist)
+
+		for i in range(1, 10):
+			self.add_person(i)
+		self.assertNumQueries(queries, self.get_changelist)
+
+		response = self.get_changelist()
+		self.assertContains(response, 'Last9, First9')
+		self.assertContains(response, 'Note 9')
+
+
+class StubTwitterUser(object):
+
+	def __init__(self, screen_name, text):
+		self.screen_name = screen_name
+		self.status = type('Status', (object,), {'text': text})()
+
+
+class StubTwitterApi(object):
+	"""Fails its first call with an error python-twitter doesn't wrap, and
+	answers the others"""
+
+	def __init__(self):
+		self.calls = 0
+
+	def UsersLookup(self, screen_name):
+		self.calls += 1
+		if self.calls == 1:
+			raise ValueError("No JSON object could be decoded")
+		return [StubTwitterUser(name, 'Hello from %s' % name) for name in screen_name]
+
+
+class TwitterStatusRefresherTest(SimpleTestCase):
+
+	def tearDown(self):
+		cache.clear()
+
+	def test_worker_survives_unexpected_errors(self):
+		api = StubTwitterApi()
+		refresher = TwitterStatusRefresher(api=api, workers=1, budget=RateBudget(100, 60))
+
+		refresher.schedule(['first'])
+		refresher.join()
+		self.assertEqual(refresher.stats()['errors'], 1)
+		self.assertEqual(refresher.stats()['pending'], 0)
+		self.assertEqual(cache.get(cache_key('first')), None)
+
+		# the same single worker carries on
+		refresher.schedule(['first', 'second'])
+		refresher.join()
+		self.assertEqual(refresher.stats()['errors'], 1)
+		self.assertTrue('Hello from first' in cache.get(cache_key('first')))
+		self.assertTrue('Hello from second' in cache.get(cache_key('second')))
+
+
+class PublishedJobsTest(HRTestCase):
+
+	def setUp(self):
+		super(PublishedJobsTest, self).setUp()
+		self.sent = []
+		published_jobs_changed.connect(self.changed, dispatch_uid='hr_tests_published_jobs_changed')
+
+	def tearDown(self):
+		published_jobs_changed.disconnect(dispatch_uid='hr_tests_published_jobs_changed')
+		super(PublishedJobsTest, self).tearDown()
+
+	def changed(self, sender, slugs, removed_slugs, **kwargs):
+		self.sent.append((slugs, removed_slugs))
+
+	def test_changes_are_announced_after_commit(self):
+		JobOpportunity.objects.filter(pk=self.job.pk).update(published_status=PUBLISHED)
+		job = JobOpportunity.objects.get(pk=self.job.pk)
+
+		@commit_on_success
+		def publish():
+			refresh_published_jobs([job.pk])
+			self.assertTrue(PublishedJob.objects.filter(pk=job.pk).exists())
+			# still inside the transaction
+			self.assertEqual(self.sent, [])
+
+		publish()
+		self.assertEqual(self.sent, [(set([job.slug]), set())])
+
+
+class PeopleImporterTest(HRTestCase):
+
+	def test_emails_match_whatever_their_case(self):
+		person = self.add_person(1, email='Jane.Doe@Example.com')
+		stats = PeopleImporter().run([
+			{'first_name': 'Jane', 'last_name': 'Doe', 'email': 'jane.doe@example.COM', 'job_opportunities': unicode(self.job.pk)},
+		])
+		self.assertEqual((stats.people_matched, stats.people_created, stats.errors), (1, 0, 0))
+		self.assertEqual(Person.objects.count(), 1)
+		self.assertEqual(list(Candidacy.objects.values_list('person', flat=True)), [person.pk])
+
+
+class PeopleImporterTransactionTest(TransactionTestCase):
+
+	def test_failed_chunk_leaves_nothing_behind(self):
+		def fail(objects):
+			raise RuntimeError("Lost the connection")
+		# after the people and their search entries were written
+		WebLink.objects.bulk_create = fail
+		try:
+			self.assertRaises(RuntimeError, PeopleImporter().run, [
+				{'first_name': 'Jane', 'last_name': 'Doe', 'email': 'jane@example.com', 'web_links': 'Blog|http://example.com/'},
+			])
+		finally:
+			del WebLink.objects.bulk_create
+		self.assertEqual(Person.objects.count(), 0)
+		self.assertEqual(SearchIndexEntry.objects.count(), 0)
+
+
+class ByteRangeTest(SimpleTestCase):
+
+	def setUp(self):
+		self.storage = ContentAddressedStorage(location=tempfile.mkdtemp())
+		self.name = self.storage.save('resume.txt', ContentFile('0123456789'))
+
+	def tearDown(self):
+		shutil.rmtree(self.storage.location)
+
+	def test_file_mode(self):
+		mode = stat.S_IMODE(os.stat(self.storage.path(self.name)).st_mode)
+		if settings.FILE_UPLOAD_PERMISSIONS is None:
+			self.assertEqual(mode, 0666 & ~UMASK)
+		else:
+			self.assertEqual(mode, settings.FILE_UPLOAD_PERMISSIONS)
+
+	def test_ranges(self):
+		self.assertEqual(_byte_range('bytes=2-5', 10), (2, 5))
+		self.assertEqual(_byte_range('bytes=2-', 10), (2, 9))
+		self.assertEqual(_byte_range('bytes=8-20', 10), (8, 9))
+		self.assertEqual(_byte_range('bytes=-3', 10), (7, 9))
+		self.assertEqual(_byte_range('bytes=-30', 10), (0, 9))
+		self.assertEqual(_byte_range('bytes=5-2', 10), None)
+		self.assertEqual(_byte_range('items=1-2', 10), None)
+		self.assertEqual(_byte_range('bytes=10-', 10), UNSATISFIABLE)
+		self.assertEqual(_byte_range('bytes=-0', 10), UNSATISFIABLE)
+		self.assertEqual(_byte_range('bytes=-5', 0), UNSATISFIABLE)
+
+	def get(self, range_header):
+		request = RequestFactory().get('/', HTTP_RANGE=range_header)
+		return serve(request, self.name, storage=self.storage)
+
+	def test_partial_content(self):
+		response = self.get('bytes=2-5')
+		self.assertEqual(response.status_code, 206)
+		self.assertEqual(response['Content-Range'], 'bytes 2-5/10')
+		self.assertEqual(response.content, '2345')
+
+	def test_unsatisfiable_range(self):
+		response = self.get('bytes=10-')
+		self.assertEqual(response.status_code, 416)
+		self.assertEqual(response['Content-Range'], 'bytes */10')
+
+
+class ScoringTest(HRTestCase):
+
+	def setUp(self):
+		super(ScoringTest, self).setUp()
+		self.qualifications = [Qualification.objects.create(position=self.position, description='Q%s' % i) for i in range(3)]
+		self.nice_to_have = NiceToHave.objects.create(position=self.position, description='N')
+		self.candidacies = []
+		self.evaluations = []
+		for i in range(6):
+			candidacy = Candidacy.objects.create(person=self.add_person(i), job_opportunity=self.job)
+			self.candidacies.append(candidacy)
+			self.evaluations.append(Evaluation.objects.create(candidacy=candidacy))
+
+	def board(self):
+		return list(CandidacyScore.objects.filter(job_opportunity=self.job).order_by('place').values_list(
+			'candidacy', 'place', 'score', 'qualifications_satisfied', 'nice_to_haves_satisfied'))
+
+	def expected_board(self):
+		return [
+			(row.candidacy_id, row.place, row.score, row.qualifications_satisfied, row.nice_to_haves_satisfied)
+			for row in scoring.score_job(self.job.pk)
+		]
+
+	def test_incremental_changes_match_a_full_rescore(self):
+		self.assertEqual(len(self.board()), 6)
+		self.evaluations[4].satisfied_qualifications.add(*self.qualifications)
+		self.assertEqual(self.board()[0][0], self.candidacies[4].pk)
+		self.evaluations[1].satisfied_qualifications.add(self.qualifications[0])
+		self.evaluations[1].satisfied_nice_to_haves.add(self.nice_to_have)
+		self.evaluations[4].satisfied_qualifications.remove(self.qualifications[1])
+		Evaluation.objects.create(candidacy=self.candidacies[5]).satisfied_nice_to_haves.add(self.nice_to_have)
+		self.assertEqual(self.board(), self.expected_board())
+
+		self.candidacies[1].delete()
+		self.assertEqual(self.board(), self.expected_board())
+		self.assertEqual([place for candidacy, place, score, q, n in self.board()], range(1, 6))
+
+	def test_changes_in_a_transaction_rescore_once(self):
+		calls = []
+		rescore_candidacies = scoring.rescore_candidacies
+		def counting(job_id, candidacy_ids):
+			calls.append((job_id, set(candidacy_ids)))
+			return rescore_candidacies(job_id, candidacy_ids)
+		scoring.rescore_candidacies = counting
+
+		@commit_on_success
+		def evaluate():
+			for evaluation in self.evaluations[:3]:
+				evaluation.save()
+				evaluation.satisfied_qualifications.add(*self.qualifications[:2])
+				evaluation.satisfied_nice_to_haves.add(self.nice_to_have)
+			self.assertEqual(calls, [])
+		try:
+			evaluate()
+		finally:
+			scoring.rescore_candidacies = rescore_candidacies
+
+		self.assertEqual(calls, [(self.job.pk, set(c.pk for c in self.candidacies[:3]))])
+		self.assertEqual(self.board(), self.expected_board())
+
+	def test_place_job_closes_gaps_and_reorders(self):
+		for i, candidacy in enumerate(self.candidacies):
+			CandidacyScore.objects.filter(pk=candidacy.pk).update(score=i % 3, place=100 - 10 * i)
+		scoring.place_job(self.job.pk)
+		expected = sorted(enumerate(self.candidacies), key=lambda (i, candidacy): (-(i % 3), candidacy.pk))
+		self.assertEqual([(candidacy, place) for candidacy, place, score, q, n in self.board()],
+			[(candidacy.pk, place) for place, (i, candidacy) in enumerate(expected, 1)])
+
+
+class QueryPlansTest(TestCase):
+	"""The test database gets the indexes in human_resources/sql/ from
+	syncdb, like a new installation"""
+
+	def setUp(self):
+		Generator(seed=1, people=300, notes_per_person=2.0, positions=5, jobs=20,
+			candidacies=600, chunk_size=300).run()
+
+	def test_hot_queries_use_an_index(self):
+		for name, build_queryset, model in query_plans.HOT_QUERIES:
+			plan_lines, sequential = query_plans.explain_query(build_queryset(), model)
+			self.assertTrue(plan_lines, name)
+			self.assertFalse(sequential, '%s:\n%s' %(name, '\n'.join(plan_lines)))
+
+	def test_check_query_plans_reports_every_hot_query(self):
+		results = query_plans.check_query_plans()
+		self.assertEqual([name for name, plan_lines, sequential in results], [entry[0] for entry in query_plans.HOT_QUERIES])
+		self.assertEqual([name for name, plan_lines, sequential in results if sequential], [])
+
+
+class SequentialScanTest(SimpleTestCase):
+
+	def tearDown(self):
+		query_plans._vendor = self._vendor
+
+	def setUp(self):
+		self._vendor = query_plans._vendor
+
+	def sequential(self, vendor, plan_lines, table='human_resources_person'):
+		query_plans._vendor = lambda: vendor
+		return query_plans._is_sequential_scan(plan_lines, table)
+
+	def test_postgresql(self):
+		self.assertTrue(self.sequential('postgresql', ['Limit  (cost=0.00..4.10 rows=100 width=8)',
+			'  ->  Seq Scan on human_resources_person  (cost=0.00..41.00 rows=1000 width=8)']))
+		self.assertFalse(self.sequential('postgresql', ['Limit  (cost=0.28..8.30 rows=1 width=8)',
+			'  ->  Index Scan Backward using human_resources_person_status_last_name on human_resources_person  (cost=0.28..8.30 rows=1 width=8)']))
+		self.assertFalse(self.sequential('postgresql', ['Seq Scan on human_resources_personnote  (cost=0.00..41.00 rows=1000 width=8)']))
+
+	def test_sqlite(self):
+		self.assertTrue(self.sequential('sqlite', ['0 0 0 SCAN TABLE human_resources_person (~100000 rows)']))
+		self.assertTrue(self.sequential('sqlite', ['2 0 0 SCAN human_resources_person']))
+		self.assertFalse(self.sequential('sqlite', ['0 0 0 SCAN TABLE human_resources_person USING INDEX human_resources_person_last_name_id (~100000 rows)']))
+		self.assertFalse(self.sequential('sqlite', ['3 0 0 SEARCH human_resources_person USING INDEX human_resources_person_status_last_name (status=?)']))
+
+	def test_mysql(self):
+		self.assertTrue(self.sequential('mysql', ['1 SIMPLE human_resources_person ALL None None None None 1000 Using where']))
+		self.assertFalse(self.sequential('mysql', ['1 SIMPLE human_resources_person ref human_resources_person_status_last_name human_resources_person_status_last_name 4 const 10 Using where']))
+
+
+class StaticPagesQueueTest(SimpleTestCase):
+
+	def setUp(self):
+		self.root = static_pages.STATIC_JOBS_ROOT
+		self.render_jobs = static_pages.render_jobs
+		static_pages.STATIC_JOBS_ROOT = tempfile.mkdtemp()
+		self.rendered = []
+		static_pages.render_jobs = lambda slugs, removed_slugs=(): self.rendered.append((sorted(slugs), sorted(removed_slugs)))
+
+	def tearDown(self):
+		shutil.rmtree(static_pages.STATIC_JOBS_ROOT)
+		static_pages.STATIC_JOBS_ROOT = self.root
+		static_pages.render_jobs = self.render_jobs
+
+	def test_changes_are_rendered_by_the_worker(self):
+		static_pages.published_jobs_changed_handler(PublishedJob, slugs=set(['a', 'b']), removed_slugs=set(['old-a']))
+		static_pages.published_jobs_changed_handler(PublishedJob, slugs=set(), removed_slugs=set(['b']))
+		# nothing is rendered inside the request that changed the jobs
+		self.assertEqual(self.rendered, [])
+
+		self.assertEqual(static_pages.render_pending(), 3)
+		self.assertEqual(self.rendered, [(['a'], ['b', 'old-a'])])
+		self.assertEqual(static_pages.render_pending(), 0)
+		self.assertEqual(self.rendered, [(['a'], ['b', 'old-a'])])
+
+	def test_failed_render_is_requeued(self):
+		def fail(slugs, removed_slugs=()):
+			raise IOError("Disk full")
+		static_pages.render_jobs = fail
+		static_pages.enqueue(['a'])
+		self.assertRaises(IOError, static_pages.render_pending)
+		static_pages.render_jobs = lambda slugs, removed_slugs=(): self.rendered.append((sorted(slugs), sorted(removed_slugs)))
+		self.assertEqual(static_pages.render_pending(), 1)
+		self.assertEqual(self.rendered, [(['a'], [])])
+
+
+class CloseEvaluationsTest(HRTestCase):
+
+	def setUp(self):
+		super(CloseEvaluationsTest, self).setUp()
+		self.evaluation = Evaluation.objects.create(candidacy=Candidacy.objects.create(person=self.add_person(1), job_opportunity=self.job))
+		self.sent = []
+		evaluations_closed.connect(self.closed, dispatch_uid='hr_tests_evaluations_closed')
+
+	def tearDown(self):
+		evaluations_closed.disconnect(dispatch_uid='hr_tests_evaluations_closed')
+		super(CloseEvaluationsTest, self).tearDown()
+
+	def closed(self, sender, evaluation_ids, job_opportunity_ids, **kwargs):
+		self.sent.append((sender, evaluation_ids))
+
+	def status(self):
+		return Evaluation.objects.get(pk=self.evaluation.pk).status
+
+	def test_closes_only_when_the_job_is_filled_or_closed(self):
+		self.job.status = 2
+		self.job.save()
+		self.assertEqual(self.status(), pipeline.CANDIDACY_CLOSED)
+		self.assertEqual(self.sent, [(JobOpportunity, [self.evaluation.pk])])
+
+		# reopened by a recruiter: unrelated saves leave it open
+		Evaluation.objects.filter(pk=self.evaluation.pk).update(status=pipeline.IN_CONSIDERATION)
+		self.job.pay = '$100k'
+		self.job.save()
+		self.job.status = 3
+		self.job.save()
+		self.position.public_description = 'Writes code'
+		self.position.save()
+		self.assertEqual(self.status(), pipeline.IN_CONSIDERATION)
+		self.assertEqual(len(self.sent), 1)
+
+		self.job.status = 1
+		self.job.save()
+		self.job.status = 3
+		self.job.save()
+		self.assertEqual(self.status(), pipeline.CANDIDACY_CLOSED)
+		self.assertEqual(len(self.sent), 2)
+
+
+class ChangeStageTransactionTest(TransactionTestCase):
+
+	def setUp(self):
+		self.user = User.objects.create_user('hr', 'hr@example.com', 'secret')
+		job = JobOpportunity.objects.create(position=Position.objects.create(name='Developer'), location='Tustin, CA')
+		for i in range(3):
+			person = Person.objects.create(first_name='First%s' % i, last_name='Last%s' % i)
+			Evaluation.objects.create(candidacy=Candidacy.objects.create(person=person, job_opportunity=job))
+		self.sent = []
+		evaluations_closed.connect(self.closed, dispatch_uid='hr_tests_evaluations_closed')
+
+	def tearDown(self):
+		evaluations_closed.disconnect(dispatch_uid='hr_tests_evaluations_closed')
+
+	def closed(self, sender, evaluation_ids, job_opportunity_ids, **kwargs):
+		self.sent.append(sorted(evaluation_ids))
+
+	def test_failure_rolls_back_every_step(self):
+		index_objects = pipeline.index_objects
+		def fail(model, objects):
+			index_objects(model, objects)
+			if model is PersonNote:
+				raise RuntimeError("Lost the connection")
+		pipeline.index_objects = fail
+		try:
+			self.assertRaises(RuntimeError, pipeline.change_stage, evaluations=Evaluation.objects.all(),
+				status=pipeline.CANDIDACY_CLOSED, interview_type=1, interview_notes='Phone screen',
+				note='Moved on', author=self.user)
+		finally:
+			pipeline.index_objects = index_objects
+
+		self.assertEqual(Evaluation.objects.filter(status=pipeline.CANDIDACY_CLOSED).count(), 0)
+		self.assertEqual(Interview.objects.count(), 0)
+		self.assertEqual(PersonNote.objects.count(), 0)
+		self.assertEqual(SearchIndexEntry.objects.filter(source__in=['interview', 'personnote']).count(), 0)
+		self.assertEqual(self.sent, [])
+
+	def test_closed_evaluations_are_announced_after_commit(self):
+		summary = pipeline.change_stage(evaluations=Evaluation.objects.all(), status=pipeline.CANDIDACY_CLOSED,
+			interview_type=1, interview_notes='Phone screen', note='Moved on', author=self.user)
+		self.assertEqual(summary.evaluations_updated, 3)
+		self.assertEqual(self.sent, [sorted(Evaluation.objects.values_list('pk', flat=True))])
+		self.assertEqual(Interview.objects.count(), 3)
+		self.assertEqual(PersonNote.objects.count(), 3)
+		self.assertEqual(SearchIndexEntry.objects.filter(source='interview').values('source_id').distinct().count(), 3)
+
+
+class TimelineTest(HRTestCase):
+
+	def setUp(self):
+		super(TimelineTest, self).setUp()
+		self.person = self.add_person(1)
+		self.moment = datetime.datetime(2012, 6, 1, 9, 30)
+		self.earlier = self.moment - datetime.timedelta(days=1)
+
+		candidacy = Candidacy.objects.create(person=self.person, job_opportunity=self.job)
+		evaluation = Evaluation.objects.create(candidacy=candidacy)
+		self.notes = [PersonNote.objects.create(author=self.user, person=self.person, date_and_time=self.moment, note='Note %s' % i) for i in range(3)]
+		self.old_note = PersonNote.objects.create(author=self.user, person=self.person, date_and_time=self.earlier, note='Old')
+		self.interview = Interview.objects.create(evaluation=evaluation, interview_type=1, date=self.moment)
+		self.file = File.objects.create(person=self.person, name='Resume', person_file='00/00/' + '0' * 40 + '.pdf')
+		# everything but the old note at the same moment
+		Candidacy.objects.filter(pk=candidacy.pk).update(date_added=self.moment)
+		Evaluation.objects.filter(pk=evaluation.pk).update(date_added=self.moment)
+		File.objects.filter(pk=self.file.pk).update(date_added=self.moment)
+		self.candidacy, self.evaluation = candidacy, evaluation
+
+		# another person's history stays out
+		other = self.add_person(2)
+		PersonNote.objects.create(author=self.user, person=other, date_and_time=self.moment, note='Other')
+
+	def expected(self):
+		return [('note', pk) for pk in sorted((note.pk for note in self.notes), reverse=True)] + [
+			('candidacy', self.candidacy.pk),
+			('evaluation', self.evaluation.pk),
+			('interview', self.interview.pk),
+			('file', self.file.pk),
+			('note', self.old_note.pk),
+		]
+
+	def test_equal_timestamps_order_by_source_then_newest_id(self):
+		page = Timeline(self.person.pk).page(per_page=20)
+		self.assertEqual([(entry.kind, entry.obj.pk) for entry in page.entries], self.expected())
+		self.assertEqual(page.next_cursor, None)
+
+	def test_cursor_pages_continue_without_gaps_or_repeats(self):
+		timeline = Timeline(self.person.pk)
+		for per_page in (1, 2, 3):
+			seen = []
+			cursor = None
+			while True:
+				page = timeline.page(after=cursor, per_page=per_page)
+				seen.extend((entry.kind, entry.obj.pk) for entry in page.entries)
+				cursor = page.next_cursor
+				if cursor is None:
+					break
+			self.assertEqual(seen, self.expected(), per_page)
+
+	def test_invalid_cursor(self):
+		timeline = Timeline(self.person.pk)
+		for cursor in ('', 'garbage', 'WyJib2d1cyIsICIyMDEyLTA2LTAxIiwgMV0='):
+			self.assertRaises(ValueError, timeline.page, after=cursor)
+
+
+def at(hour, minute=0, day=4):
+	return datetime.datetime(2012, 6, day, hour, minute)
+
+
+class IntervalIndexTest(SimpleTestCase):
+
+	def setUp(self):
+		self.index = IntervalIndex()
+		self.ten = Booking(at(10), 60)
+		self.longest = Booking(at(12), MAX_DURATION.seconds // 60)
+		for booking in (self.longest, self.ten):
+			self.index.add(booking)
+
+	def test_touching_intervals_do_not_overlap(self):
+		self.assertEqual(self.index.overlapping(at(9), at(10)), [])
+		self.assertEqual(self.index.overlapping(at(11), at(11, 30)), [])
+		end = self.longest.end
+		self.assertEqual(self.index.overlapping(end, end + datetime.timedelta(hours=1)), [])
+
+	def test_overlaps(self):
+		self.assertEqual(self.index.overlapping(at(9, 30), at(10, 1)), [self.ten])
+		self.assertEqual(self.index.overlapping(at(10, 59), at(11, 30)), [self.ten])
+		self.assertEqual(self.index.overlapping(at(10, 15), at(10, 45)), [self.ten])
+		self.assertEqual(self.index.overlapping(at(9), at(13)), [self.ten, self.longest])
+		# found although it started the longest possible interview earlier
+		end = self.longest.end
+		self.assertEqual(self.index.overlapping(end - datetime.timedelta(minutes=1), end), [self.longest])
+
+
+class ScheduleTest(HRTestCase):
+
+	def setUp(self):
+		super(ScheduleTest, self).setUp()
+		self.interviewer = self.user
+		self.person = self.add_person(1)
+		evaluation = Evaluation.objects.create(candidacy=Candidacy.objects.create(person=self.person, job_opportunity=self.job))
+		for start, duration, room in ((at(9), 60, 'Blue'), (at(10, 30), 60, ''), (at(16, 30), 30, '')):
+			interview = Interview.objects.create(evaluation=evaluation, interview_type=1, date=start, duration=duration, room=room)
+			interview.interviewers.add(self.interviewer)
+		self.schedule = Schedule(at(0), at(0, day=6))
+
+	def test_load_indexes_every_resource(self):
+		self.assertEqual(len(self.schedule.indexes[(INTERVIEWER, self.interviewer.pk)].bookings), 3)
+		self.assertEqual(len(self.schedule.indexes[(CANDIDATE, self.person.pk)].bookings), 3)
+		self.assertEqual(len(self.schedule.indexes[(ROOM, 'blue')].bookings), 1)
+
+	def test_conflicts(self):
+		self.assertEqual(len(self.schedule.conflicts(Booking(at(10), 30, [self.interviewer.pk]))), 0)
+		conflicts = self.schedule.conflicts(Booking(at(9, 30), 90, [self.interviewer.pk], room=' BLUE'))
+		self.assertEqual(sorted((c.kind, c.booking.start) for c in conflicts),
+			[(INTERVIEWER, at(9)), (INTERVIEWER, at(10, 30)), (ROOM, at(9))])
+
+	def test_free_slots_skip_bookings_and_closed_hours(self):
+		booking = Booking(at(8), 60, [self.interviewer.pk])
+		self.assertEqual(self.schedule.free_slots(booking, count=5), [at(11, 30), at(12, 30), at(13, 30), at(14, 30), at(15, 30)])
+		# nothing fits before closing, so the next morning
+		self.assertEqual(self.schedule.free_slots(Booking(at(16), 60, [self.interviewer.pk]), count=2), [at(9, day=5), at(10, day=5)])
+
+	def test_book_adds_only_free_bookings(self):
+		self.assertEqual(self.schedule.book(Booking(at(12), 60, [self.interviewer.pk])), [])
+		self.assertEqual(len(self.schedule.book(Booking(at(12, 30), 60, [self.interviewer.pk]))), 1)
+		self.assertEqual(len(self.schedule.indexes[(INTERVIEWER, self.interviewer.pk)].bookings), 4)
+
+
+def record(pk, first_name, last_name, email='', mobile_phone='', zip_code='', city='', state=''):
+	return Record(pk, first_name, last_name, email, mobile_phone, '', zip_code, city, state)
+
+
+class DuplicateScoreTest(SimpleTestCase):
+
+	def test_same_name_needs_the_same_place(self):
+		jane = record(1, 'Jane', 'Doe', zip_code='92780', city='Tustin', state='CA')
+		self.assertTrue(score(jane, record(2, 'Jane', 'Doe', zip_code='92780'))[0] >= DEDUPE_THRESHOLD)
+		self.assertTrue(score(jane, record(2, 'Jane', 'Doe', city='tustin ', state='CA'))[0] >= DEDUPE_THRESHOLD)
+		self.assertTrue(score(jane, record(2, 'Jane', 'Doe'))[0] < DEDUPE_THRESHOLD)
+		self.assertTrue(score(jane, record(2, 'Jane', 'Doe', city='Tustin', state='TX'))[0] < DEDUPE_THRESHOLD)
+
+	def test_contact_details(self):
+		bob = record(1, 'Bob', 'Smith', email='bob.smith@gmail.com', mobile_phone='(714) 555-0100')
+		self.assertTrue(score(bob, record(2, 'Robert', 'Smith', email='bobsmith+jobs@gmail.com'))[0] >= DEDUPE_THRESHOLD)
+		self.assertTrue(score(bob, record(2, 'Robert', 'Smith', mobile_phone='1-714-555-0100'))[0] >= DEDUPE_THRESHOLD)
+		# a family email
+		self.assertTrue(score(bob, record(2, 'Alice', 'Nguyen', email='bob.smith@gmail.com'))[0] < DEDUPE_THRESHOLD)
+
+
+class DedupeTest(HRTestCase):
+
+	def test_find_duplicates_suggests_same_name_same_zip(self):
+		jane = self.add_person(1, first_name='Jane', last_name='Doe', email='', mobile_phone='', zip_code='92780')
+		other_jane = self.add_person(2, first_name='Jane', last_name='Doe', email='', mobile_phone='', zip_code='92780')
+		self.add_person(3, first_name='Jane', last_name='Doe', email='', mobile_phone='', zip_code='10001')
+		self.assertEqual(find_duplicates(), 1)
+		self.assertEqual(list(DuplicateSuggestion.objects.values_list('person', 'duplicate')), [(jane.pk, other_jane.pk)])
+
+	def test_merge_people(self):
+		other_job = JobOpportunity.objects.create(position=self.position, location='Irvine, CA')
+		person = self.add_person(1, city='')
+		duplicate = self.add_person(2, city='Irvine')
+		third = self.add_person(3)
+
+		WebLink.objects.create(person=person, name='Blog', url='http://example.com/blog')
+		WebLink.objects.create(person=duplicate, name='Blog', url='http://example.com/blog')
+		WebLink.objects.create(person=duplicate, name='Site', url='http://example.com/')
+		WebLink.objects.create(person=third, name='Blog', url='http://example.com/blog')
+
+		resume = '00/00/' + '0' * 40 + '.pdf'
+		File.objects.create(person=person, name='Resume', person_file=resume)
+		File.objects.create(person=duplicate, name='Resume', person_file=resume)
+		File.objects.create(person=duplicate, name='Cover letter', person_file='11/11/' + '1' * 40 + '.pdf')
+		File.objects.create(person=third, name='Resume', person_file='22/22/' + '2' * 40 + '.pdf')
+
+		kept = Candidacy.objects.create(person=person, job_opportunity=self.job)
+		kept_evaluation = Evaluation.objects.create(candidacy=kept)
+		folded = Candidacy.objects.create(person=duplicate, job_opportunity=self.job, rank=3)
+		folded_evaluation = Evaluation.objects.create(candidacy=folded)
+		moved = Candidacy.objects.create(person=third, job_opportunity=other_job)
+
+		self.assertEqual(merge_people(person, [duplicate, third.pk, person]), 2)
+
+		self.assertEqual(list(Person.objects.values_list('pk', flat=True)), [person.pk])
+		self.assertEqual(Person.objects.get(pk=person.pk).city, 'Irvine')
+		self.assertEqual(sorted(WebLink.objects.values_list('name', 'url')),
+			[('Blog', 'http://example.com/blog'), ('Site', 'http://example.com/')])
+		self.assertEqual(sorted(File.objects.values_list('name', 'person_file')), [
+			('Cover letter', '11/11/' + '1' * 40 + '.pdf'),
+			('Resume', resume),
+			('Resume (2)', '22/22/' + '2' * 40 + '.pdf'),
+		])
+		self.assertEqual(sorted(Candidacy.objects.values_list('pk', 'job_opportunity', 'rank')),
+			sorted([(kept.pk, self.job.pk, 3), (moved.pk, other_job.pk, None)]))
+		self.assertEqual(sorted(Evaluation.objects.values_list('pk', 'candidacy')),
+			sorted([(kept_evaluation.pk, kept.pk), (folded_evaluation.pk, kept.pk)]))
+		self.assertEqual(sorted(CandidacyScore.objects.values_list('candidacy', 'place')),
+			sorted([(kept.pk, 1), (moved.pk, 1)]))
+
+
+class ReplicaTestMixin(object):
+	"""One replica, 'replica', that was last checked as usable"""
+
+	def setUp(self):
+		super(ReplicaTestMixin, self).setUp()
+		self.replica_databases = routers.REPLICA_DATABASES
+		routers.REPLICA_DATABASES = ['replica']
+		routers.health.checked = {'replica': (time.time(), True)}
+		routers._state.__dict__.clear()
+
+	def tearDown(self):
+		routers.REPLICA_DATABASES = self.replica_databases
+		routers.health.checked = {}
+		routers._state.__dict__.clear()
+		super(ReplicaTestMixin, self).tearDown()
+
+
+class ReplicaRoutingTest(ReplicaTestMixin, SimpleTestCase):
+
+	def test_read_database(self):
+		self.assertEqual(routers.read_database(), 'default')
+		with routers.replica_reads():
+			self.assertEqual(routers.read_database(), 'replica')
+			with routers.primary_reads():
+				self.assertEqual(routers.read_database(), 'default')
+			self.assertEqual(routers.read_database(), 'replica')
+			routers.pin()
+			self.assertEqual(routers.read_database(), 'default')
+
+	def test_falls_back_to_the_primary(self):
+		replica_lag = routers.replica_lag
+		try:
+			routers.health.checked = {}
+			routers.replica_lag = lambda alias: routers.MAX_LAG + 1
+			with routers.replica_reads():
+				self.assertEqual(routers.read_database(), 'default')
+
+			def unreachable(alias):
+				raise Exception("could not connect")
+			routers.health.checked = {}
+			routers.replica_lag = unreachable
+			with routers.replica_reads():
+				self.assertEqual(routers.read_database(), 'default')
+		finally:
+			routers.replica_lag = replica_lag
+
+	def test_postgresql_lag_query(self):
+		class Cursor(object):
+			def execute(cursor, sql):
+				self.executed.append(sql)
+			def fetchone(cursor):
+				return (None,)
+
+		class Connection(object):
+			vendor = 'postgresql'
+			def cursor(connection):
+				return Cursor()
+
+		connections = routers.connections
+		try:
+			for pg_version, function in ((90600, 'pg_last_xlog_replay_location()'), (100005, 'pg_last_wal_replay_lsn()')):
+				self.executed = []
+				routers.connections = {'replica': Connection()}
+				routers.connections['replica'].pg_version = pg_version
+				self.assertEqual(routers.replica_lag('replica'), 0.0)
+				self.assertTrue(function in self.executed[0])
+		finally:
+			routers.connections = connections
+
+	def test_write_sets_the_cookie(self):
+		middleware = routers.ReplicaMiddleware()
+		request = RequestFactory().get('/')
+		middleware.process_request(request)
+		response = middleware.process_response(request, HttpResponse())
+		self.assertFalse(routers.STICKY_COOKIE in response.cookies)
+
+		request = RequestFactory().post('/')
+		middleware.process_request(request)
+		routers.pin()
+		response = middleware.process_response(request, HttpResponse())
+		self.assertTrue(float(response.cookies[routers.STICKY_COOKIE].value) > time.time())
+		self.assertFalse(routers.pinned())
+
+		request = RequestFactory().get('/')
+		request.COOKIES[routers.STICKY_COOKIE] = response.cookies[routers.STICKY_COOKIE].value
+		middleware.process_request(request)
+		with routers.replica_reads():
+			self.assertEqual(routers.read_database(), 'default')
+		middleware.process_response(request, HttpResponse())
+
+	def test_nested_request_keeps_the_pin(self):
+		middleware = routers.ReplicaMiddleware()
+		outer = RequestFactory().get('/')
+		outer.COOKIES[routers.STICKY_COOKIE] = '%.3f' %(time.time() + 60)
+		middleware.process_request(outer)
+		pinned_until = routers._state.pinned_until
+
+		inner = RequestFactory().get('/')
+		middleware.process_request(inner)
+		self.assertTrue(routers.pinned())
+		routers.pin(1)
+		inner_response = middleware.process_response(inner, HttpResponse())
+		self.assertEqual(inner_response.cookies[routers.STICKY_COOKIE].value, '%.3f' %(pinned_until))
+
+		self.assertEqual(routers._state.pinned_until, pinned_until)
+		response = middleware.process_response(outer, HttpResponse())
+		self.assertTrue(routers.STICKY_COOKIE in response.cookies)
+
+
+@skipUnless('replica' in settings.DATABASES, "needs a 'replica' database alias")
+class ReplicaReadsTest(ReplicaTestMixin, TransactionTestCase):
+	# a mirror is another connection: it only sees committed rows
+	multi_db = True
+
+	def test_reads_from_the_replica(self):
+		person = Person.objects.create(first_name='Jane', last_name='Doe')
+		self.assertEqual(person._state.db, 'default')
+		with routers.replica_reads():
+			self.assertEqual(Person.objects.get(pk=person.pk)._state.db, 'default')
+		routers._state.pinned_until = 0
+		with routers.replica_reads():
+			self.assertEqual(Person.objects.get(pk=person.pk)._state.db, 'replica')
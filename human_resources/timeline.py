@@ -0,0 +1,129 @@
+"""
+Activity timeline of a person.
+
+The notes, candidacies, evaluations, interviews and files of a person are
+each read newest first through an index on (owner, timestamp, id), at most
+one page plus one row per source, and merged lazily with heapq.merge. A
+page costs the same few queries however long the history is. Pages are
+continued with a cursor holding the source, timestamp and id of the last
+entry shown; entries with the same timestamp are ordered by source, then
+newest id first.
+
+"""
+import base64
+import heapq
+import json
+from itertools import islice
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db.models import DateTimeField
+
+from human_resources.models import PersonNote, Candidacy, Evaluation, \
+Interview, File
+from human_resources.pagination import Keyset
+
+TIMELINE_PAGE_SIZE = getattr(settings, 'HR_TIMELINE_PAGE_SIZE', 25)
+
+# (kind, timestamp field), in the order entries with the same timestamp are shown
+SOURCES = (
+	('note', 'date_and_time'),
+	('candidacy', 'date_added'),
+	('evaluation', 'date_added'),
+	('interview', 'date'),
+	('file', 'date_added'),
+)
+SOURCE_ORDER = dict((kind, i) for i, (kind, field) in enumerate(SOURCES))
+
+
+class Entry(object):
+	"""One row of the timeline; sorts newest first"""
+
+	def __init__(self, kind, timestamp, obj):
+		self.kind = kind
+		self.timestamp = timestamp
+		self.obj = obj
+		self.key = (timestamp, -SOURCE_ORDER[kind], obj.pk)
+
+	def __lt__(self, other):
+		return self.key > other.key
+
+
+class TimelinePage(object):
+
+	def __init__(self, entries, next_cursor):
+		self.entries = entries
+		self.next_cursor = next_cursor
+
+
+class Timeline(object):
+
+	def __init__(self, person_id):
+		self.person_id = person_id
+
+	def querysets(self):
+		"""The queryset of every source, as {kind: queryset}"""
+		candidacy_ids = list(Candidacy.objects.filter(person=self.person_id).values_list('pk', flat=True))
+		if candidacy_ids:
+			evaluation_ids = list(Evaluation.objects.filter(candidacy__in=candidacy_ids).values_list('pk', flat=True))
+		else:
+			evaluation_ids = []
+
+		return {
+			'note': PersonNote.objects.filter(person=self.person_id).select_related('author'),
+			'candidacy': Candidacy.objects.filter(pk__in=candidacy_ids).select_related('job_opportunity'),
+			'evaluation': Evaluation.objects.filter(pk__in=evaluation_ids).select_related('candidacy__job_opportunity'),
+			'interview': Interview.objects.filter(evaluation__in=evaluation_ids).select_related('evaluation__candidacy__job_opportunity'),
+			'file': File.objects.filter(person=self.person_id),
+		}
+
+	def cursor(self, entry):
+		return base64.urlsafe_b64encode(json.dumps([entry.kind, unicode(entry.timestamp), entry.obj.pk]))
+
+	def position(self, cursor):
+		"""(kind, timestamp, pk) of cursor; raises ValueError if it isn't
+		one of ours"""
+		try:
+			kind, timestamp, pk = json.loads(base64.urlsafe_b64decode(str(cursor)))
+			timestamp = DateTimeField().to_python(timestamp)
+			pk = int(pk)
+		except (TypeError, ValueError, ValidationError):
+			raise ValueError("Invalid cursor")
+		if kind not in SOURCE_ORDER or timestamp is None:
+			raise ValueError("Invalid cursor")
+		return kind, timestamp, pk
+
+	def _after(self, kind, field, queryset, position):
+		"""queryset narrowed to the rows shown after position"""
+		position_kind, timestamp, pk = position
+		if kind == position_kind:
+			return Keyset.for_queryset(queryset).seek([timestamp, pk])
+		if SOURCE_ORDER[kind] < SOURCE_ORDER[position_kind]:
+			# shown before the cursor's source at the same timestamp
+			return queryset.filter(**{field + '__lt': timestamp})
+		return queryset.filter(**{field + '__lte': timestamp})
+
+	def _stream(self, kind, field, queryset):
+		for obj in queryset:
+			yield Entry(kind, getattr(obj, field), obj)
+
+	def page(self, after=None, per_page=TIMELINE_PAGE_SIZE):
+		"""The page after the cursor after, or the newest page"""
+
+		position = None if after is None else self.position(after)
+		querysets = self.querysets()
+
+		streams = []
+		for kind, field in SOURCES:
+			queryset = querysets[kind].order_by('-' + field, '-pk')
+			if position is not None:
+				queryset = self._after(kind, field, queryset, position)
+			streams.append(self._stream(kind, field, queryset[:per_page + 1]))
+
+		entries = list(islice(heapq.merge(*streams), per_page + 1))
+		if len(entries) > per_page:
+			return TimelinePage(entries[:per_page], self.cursor(entries[per_page - 1]))
+		return TimelinePage(entries, None)
+
+	def first_page(self):
+		return self.page()
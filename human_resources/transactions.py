@@ -0,0 +1,48 @@
+"""
+Transactions that nest.
+
+Django's commit_on_success commits the connection when any decorated
+function returns, even one called inside another. A function decorated
+with commit_on_success from here joins the transaction of an enclosing one
+instead, so the outermost call commits or rolls back all of the work.
+Side effects that must only happen once that work is committed, e.g.
+telling caches or other processes about it, are registered with
+on_commit.
+
+"""
+import threading
+from functools import wraps
+
+from django.db import transaction
+
+_state = threading.local()
+
+
+def commit_on_success(func):
+	@wraps(func)
+	def wrapper(*args, **kwargs):
+		if getattr(_state, 'depth', 0):
+			return func(*args, **kwargs)
+
+		_state.depth = 1
+		_state.callbacks = []
+		try:
+			result = transaction.commit_on_success(func)(*args, **kwargs)
+			callbacks = _state.callbacks
+		finally:
+			_state.depth = 0
+			_state.callbacks = []
+
+		for callback in callbacks:
+			callback()
+		return result
+	return wrapper
+
+
+def on_commit(callback):
+	"""Call callback once the outermost commit_on_success has committed, or
+	now outside of one; callbacks of a rolled back transaction are dropped"""
+	if getattr(_state, 'depth', 0):
+		_state.callbacks.append(callback)
+	else:
+		callback()
@@ -0,0 +1,232 @@
+"""
+Keeps rendered "latest tweet" snippets for PersonAdmin in the cache.
+
+The admin never talks to Twitter itself. It reads snippets with
+get_cached_statuses and hands any misses to the refresher, which looks
+the handles up in batches on a small pool of worker threads, stays within
+a call budget and writes the rendered html back to the cache.
+
+"""
+import logging
+import threading
+import time
+from Queue import Queue
+
+from django.conf import settings
+from django.core.cache import cache
+
+import twitter
+
+TWITTER_CACHE_TIME = getattr(settings, 'HR_TWITTER_CACHE_TIME', 60 * 5) # 5 min
+TWITTER_REFRESH_WORKERS = getattr(settings, 'HR_TWITTER_REFRESH_WORKERS', 2)
+TWITTER_BATCH_SIZE = getattr(settings, 'HR_TWITTER_BATCH_SIZE', 100) # UsersLookup maximum
+TWITTER_CALLS_PER_WINDOW = getattr(settings, 'HR_TWITTER_CALLS_PER_WINDOW', 180)
+TWITTER_WINDOW = getattr(settings, 'HR_TWITTER_WINDOW', 60 * 15) # 15 min
+
+CACHE_KEY_PREFIX = 'twitter_status_html_for_'
+
+logger = logging.getLogger('human_resources.twitter_status')
+
+
+def cache_key(handle):
+	return CACHE_KEY_PREFIX + handle.lower()
+
+
+def profile_link_html(handle):
+	return '<a target="_blank" href="http://twitter.com/#!/' + handle + '">@' + handle + '</a>'
+
+
+def placeholder_html(handle):
+	return '<div style="color:#999; margin-bottom:5px;">Latest tweet loading&hellip;</div>' + profile_link_html(handle)
+
+
+def render_status_html(handle, text):
+	link_html = profile_link_html(handle)
+	if text:
+		latest_tweet_html = '<div style="font-weight:bold; margin-bottom:5px;">Latest Tweet:</div><div>'
+		latest_tweet_html = latest_tweet_html + '<div style="margin-bottom:5px;">"' + text + '"</div>'
+		return latest_tweet_html + link_html
+	else:
+		return link_html
+
+
+class RateBudget(object):
+	"""Allows at most `calls` acquisitions per `window` seconds, making the
+	caller wait for the oldest call to age out once the budget is spent"""
+
+	def __init__(self, calls, window, clock=time.time, sleep=time.sleep):
+		self.calls = calls
+		self.window = window
+		self.clock = clock
+		self.sleep = sleep
+		self._spent = []
+		self._lock = threading.Lock()
+
+	def acquire(self):
+		while True:
+			with self._lock:
+				now = self.clock()
+				self._spent = [t for t in self._spent if now - t < self.window]
+				if len(self._spent) < self.calls:
+					self._spent.append(now)
+					return
+				wait = self.window - (now - self._spent[0])
+			self.sleep(max(wait, 0))
+
+
+class TwitterStatusRefresher(object):
+	"""
+	Bounded pool of worker threads that refreshes cached status snippets.
+
+	`api` only needs a python-twitter style UsersLookup(screen_name=[...])
+	returning users with `screen_name` and `status`, so a local stub can
+	stand in for Twitter.
+
+	"""
+
+	def __init__(self, api=None, workers=TWITTER_REFRESH_WORKERS, batch_size=TWITTER_BATCH_SIZE,
+			budget=None, cache_time=TWITTER_CACHE_TIME):
+		self.api = api or twitter.Api()
+		self.workers = workers
+		self.batch_size = batch_size
+		self.budget = budget or RateBudget(TWITTER_CALLS_PER_WINDOW, TWITTER_WINDOW)
+		self.cache_time = cache_time
+
+		self._queue = Queue()
+		self._pending = set()
+		self._lock = threading.Lock()
+		self._threads = []
+		self._counters = {
+			'hits': 0,
+			'misses': 0,
+			'refreshes': 0,
+			'errors': 0,
+			'refresh_latency_total': 0.0,
+			'refresh_latency_max': 0.0,
+		}
+
+	def _count(self, name, amount=1):
+		with self._lock:
+			self._counters[name] += amount
+
+	def start(self):
+		with self._lock:
+			if self._threads:
+				return
+			for i in range(self.workers):
+				thread = threading.Thread(target=self._work, name='twitter-refresher-%s' % i)
+				thread.daemon = True
+				thread.start()
+				self._threads.append(thread)
+
+	def schedule(self, handles):
+		"""Queue handles for a refresh, ignoring ones that are already queued"""
+		self.start()
+		with self._lock:
+			new_handles = [h for h in set(handles) if h and h not in self._pending]
+			self._pending.update(new_handles)
+		for handle in new_handles:
+			self._queue.put(handle)
+
+	def join(self):
+		"""Block until everything scheduled so far has been refreshed"""
+		self._queue.join()
+
+	def _next_batch(self):
+		batch = [self._queue.get()]
+		while len(batch) < self.batch_size and not self._queue.empty():
+			batch.append(self._queue.get())
+		return batch
+
+	def _work(self):
+		while True:
+			batch = self._next_batch()
+			try:
+				self.refresh(batch)
+			except Exception:
+				# don't let one bad batch end the worker; the handles stay
+				# uncached and are retried on a later page view
+				logger.exception("Refreshing the Twitter statuses of %s failed", ', '.join(batch))
+				self._count('errors')
+			finally:
+				with self._lock:
+					self._pending.difference_update(batch)
+				for handle in batch:
+					self._queue.task_done()
+
+	def refresh(self, handles):
+		"""Look up the latest status of every handle with one API call and
+		write the rendered snippets to the cache"""
+		self.budget.acquire()
+		started = time.time()
+
+		try:
+			users = self.api.UsersLookup(screen_name=list(handles))
+		except twitter.TwitterError:
+			# leave the handles uncached so the next page view retries them
+			self._count('errors')
+			return
+
+		texts = {}
+		for user in users:
+			status = getattr(user, 'status', None)
+			texts[user.screen_name.lower()] = status.text if status else None
+
+		snippets = {}
+		for handle in handles:
+			if handle.lower() in texts:
+				snippets[cache_key(handle)] = render_status_html(handle, texts[handle.lower()])
+			else:
+				snippets[cache_key(handle)] = '<span>Twitter user not found</span>'
+		cache.set_many(snippets, self.cache_time)
+
+		elapsed = time.time() - started
+		with self._lock:
+			self._counters['refreshes'] += 1
+			self._counters['refresh_latency_total'] += elapsed
+			self._counters['refresh_latency_max'] = max(self._counters['refresh_latency_max'], elapsed)
+
+	def get_cached_statuses(self, handles):
+		"""Return {handle: html} from the cache, scheduling a refresh for
+		every miss and answering it with a placeholder meanwhile"""
+		handles = [h for h in set(handles) if h]
+		if not handles:
+			return {}
+
+		cached = cache.get_many([cache_key(h) for h in handles])
+
+		statuses = {}
+		misses = []
+		for handle in handles:
+			html = cached.get(cache_key(handle))
+			if html is None:
+				misses.append(handle)
+				html = placeholder_html(handle)
+			statuses[handle] = html
+
+		self._count('hits', len(handles) - len(misses))
+		self._count('misses', len(misses))
+		if misses:
+			self.schedule(misses)
+		return statuses
+
+	def stats(self):
+		with self._lock:
+			stats = dict(self._counters)
+		stats['pending'] = len(self._pending)
+		if stats['refreshes']:
+			stats['refresh_latency_avg'] = stats['refresh_latency_total'] / stats['refreshes']
+		else:
+			stats['refresh_latency_avg'] = 0.0
+		return stats
+
+
+_refresher = None
+_refresher_lock = threading.Lock()
+
+def get_refresher():
+	global _refresher
+	with _refresher_lock:
+		if _refresher is None:
+			_refresher = TwitterStatusRefresher()
+		return _refresher